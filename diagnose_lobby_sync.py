@@ -7,6 +7,8 @@ import requests
 import json
 import time
 
+from pes_lobby_model import decode_lobbies
+
 def test_wordpress_api():
     """Test WordPress API"""
     print("🧪 TESTING WORDPRESS API...")
@@ -20,10 +22,10 @@ def test_wordpress_api():
         if response.status_code == 200:
             data = response.json()
             if data.get('success'):
-                lobbies = data.get('lobbies', [])
+                lobbies = decode_lobbies(data.get('lobbies', []))
                 print(f"✅ WordPress API: Found {len(lobbies)} lobbies")
                 for lobby in lobbies:
-                    print(f"   - {lobby.get('lobby_name', 'Unknown')} ({lobby.get('current_players', 0)}/{lobby.get('max_players', 0)})")
+                    print(f"   - {lobby.name} ({lobby.current_players}/{lobby.max_players})")
                 return len(lobbies)
             else:
                 print(f"⚠️ WordPress API no lobbies: {data}")
@@ -57,14 +59,11 @@ def test_pes_server():
         response = requests.get("http://localhost/api/lobbies", timeout=5)
         if response.status_code == 200:
             data = response.json()
-            lobbies = data.get('lobbies', [])
+            lobbies = decode_lobbies(data.get('lobbies', []))
             total = data.get('total_lobbies', 0)
             print(f"📊 PES Server API: Found {total} lobbies")
             for lobby in lobbies:
-                name = lobby.get('lobby_name', lobby.get('name', 'Unknown'))
-                players = lobby.get('current_players', 0)
-                max_players = lobby.get('max_players', 0)
-                print(f"   - {name} ({players}/{max_players})")
+                print(f"   - {lobby.name} ({lobby.current_players}/{lobby.max_players})")
             return total
         else:
             print(f"❌ PES lobbies error: {response.status_code}")
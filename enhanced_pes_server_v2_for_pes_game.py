@@ -5,173 +5,830 @@ Full 11vs11 Lobby Implementation with PES Message Interception
 THIS VERSION IS SPECIFICALLY FOR PES 2021 GAME COMPATIBILITY
 """
 
-import asyncio
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import json
 import time
+STARTED = time.perf_counter()
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import socket
+import signal
+import tempfile
+import select
+import subprocess
+import json
 import sqlite3
 import uuid
-import hashlib
 from datetime import datetime, timedelta
 import threading
 import os
-import requests
+import sys
+import queue
+import logging
+import logging.handlers
+from contextlib import contextmanager
+from collections import Counter
 import urllib.parse
 
+from pes_registry import load_registry
+from pes_match_service import MatchLifecycleService, InvalidTransition, MATCH_STATES
+from pes_match_archive import MatchArchive
+from pes_match_codec import migrate_matches, POSITIONS
+from pes_lobby_sync import LobbySyncWorker, FULL_SYNC_KEY
+from pes_lobby_model import Lobby, LobbyPlayer, encode_lobbies, decode_lobbies
+from pes_auth import AuthService, AuthenticationError
+from pes_admission import AdmissionController
+
+IMPORTED = time.perf_counter()
+
+logger = logging.getLogger("pes_server")
+
+
+def setup_logging(level=None, queued=True):
+    """Route server logging through a non-blocking queue handler.
+
+    Request threads only enqueue records; a single listener thread does the
+    actual (slow) console I/O. Level comes from PES_LOG_LEVEL (default INFO).
+    With ``queued=False`` (the multi-worker supervisor, which must stay
+    thread-free to fork safely) records are written directly.
+    """
+    level = level or os.environ.get("PES_LOG_LEVEL", "INFO")
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(process)d %(threadName)s %(message)s",
+                                           "%H:%M:%S"))
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    if not queued:
+        logger.handlers[:] = [console]
+        return None
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, console, respect_handler_level=True)
+    logger.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    listener.start()
+    return listener
+
+
+class ServerMetrics:
+    """Thread-safe request counters and stage timing histograms (Prometheus text format)"""
+
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    STAGES = ('parse', 'upstream', 'db', 'render', 'write', 'request')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.requests = Counter()
+        self.host_groups = Counter()
+        self.histograms = {}
+        self.profiler = SamplingProfiler()
+
+    def observe(self, stage, seconds):
+        """Record one duration for a stage"""
+        with self.lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = self.histograms[stage] = {'buckets': [0] * len(self.BUCKETS), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    hist['buckets'][i] += 1
+                    break
+            hist['sum'] += seconds
+            hist['count'] += 1
+
+    @contextmanager
+    def span(self, stage):
+        """Time the enclosed block as one stage of the current request"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count_request(self, method, route, status, host_group=None):
+        with self.lock:
+            self.requests[(method, route, status)] += 1
+            self.host_groups[host_group or 'other'] += 1
+
+    def render(self):
+        """Render all metrics in Prometheus text exposition format"""
+        lines = [
+            '# HELP pes_uptime_seconds Seconds since the server started',
+            '# TYPE pes_uptime_seconds gauge',
+            f'pes_uptime_seconds {time.time() - self.started_at:.3f}',
+            '# HELP pes_http_requests_total HTTP requests served',
+            '# TYPE pes_http_requests_total counter',
+        ]
+        with self.lock:
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f'pes_http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+            lines.append('# HELP pes_http_requests_by_host_total Requests by registry group of the Host header')
+            lines.append('# TYPE pes_http_requests_by_host_total counter')
+            for group, count in sorted(self.host_groups.items()):
+                lines.append(f'pes_http_requests_by_host_total{{group="{group}"}} {count}')
+            lines.append('# HELP pes_stage_duration_seconds Time spent per request stage')
+            lines.append('# TYPE pes_stage_duration_seconds histogram')
+            for stage, hist in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS, hist['buckets']):
+                    cumulative += count
+                    lines.append(f'pes_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'pes_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist["count"]}')
+                lines.append(f'pes_stage_duration_seconds_sum{{stage="{stage}"}} {hist["sum"]:.6f}')
+                lines.append(f'pes_stage_duration_seconds_count{{stage="{stage}"}} {hist["count"]}')
+        lines.extend(self.profiler.render())
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """Optional low-overhead stack sampler, toggled at runtime via POST /api/metrics/profiler"""
+
+    def __init__(self, interval=0.01, top=20):
+        self.interval = interval
+        self.top = top
+        self.samples = Counter()
+        self.lock = threading.Lock()
+        self.toggle_lock = threading.Lock()
+        self.running = False
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        with self.toggle_lock:
+            if self.running:
+                return
+            self.running = True
+            self.stop_event = threading.Event()
+            self.thread = threading.Thread(target=self._run, args=(self.stop_event,), name="pes-profiler",
+                                           daemon=True)
+            self.thread.start()
+        logger.info("🔬 Sampling profiler started (interval %.3fs)", self.interval)
+
+    def stop(self):
+        with self.toggle_lock:
+            if not self.running:
+                return
+            self.running = False
+            self.stop_event.set()
+            # Joined before returning, so a quick off → on never leaves two samplers running
+            self.thread.join()
+            self.thread = None
+        logger.info("🔬 Sampling profiler stopped")
+
+    def _run(self, stop_event):
+        own_id = threading.get_ident()
+        while not stop_event.is_set():
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    code = frame.f_code
+                    self.samples[f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"] += 1
+            del frames
+            stop_event.wait(self.interval)
+
+    def render(self):
+        lines = [
+            '# HELP pes_profiler_running Whether the sampling profiler is active',
+            '# TYPE pes_profiler_running gauge',
+            f'pes_profiler_running {int(self.running)}',
+        ]
+        with self.lock:
+            hottest = self.samples.most_common(self.top)
+        if hottest:
+            lines.append('# HELP pes_profiler_samples_total Stack samples per innermost frame')
+            lines.append('# TYPE pes_profiler_samples_total counter')
+            for frame, count in hottest:
+                label = frame.replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(f'pes_profiler_samples_total{{frame="{label}"}} {count}')
+        return lines
+
+
+METRICS = ServerMetrics()
+ADMISSION = AdmissionController()
+REGISTRY = load_registry()
+
+
+class RouteTable:
+    """Precompiled request router.
+
+    Static paths resolve with a single dict lookup on (method, path).
+    Parameterized patterns such as ``/api/lobbies/<lobby_id>`` are compiled
+    into a segment trie, so lookup cost depends on path depth only and not on
+    how many endpoints are registered.
+    """
+
+    PARAM = object()
+
+    def __init__(self):
+        self.static = {}
+        self.trie = {}
+        self.methods = {}
+        self.fallbacks = {}
+
+    def add(self, method, pattern, handler, name):
+        """Register ``handler`` (a handler method name) for method + pattern"""
+        pattern = self._normalize(pattern)
+        self.methods.setdefault(pattern, set()).add(method)
+        if '<' not in pattern:
+            self.static[(method, pattern)] = (name, handler, ())
+            return
+        node = self.trie
+        param_names = []
+        for segment in pattern.strip('/').split('/'):
+            if segment.startswith('<') and segment.endswith('>'):
+                param_names.append(segment[1:-1])
+                segment = self.PARAM
+            node = node.setdefault(segment, {})
+        node.setdefault(None, {})[method] = (name, handler, tuple(param_names))
+
+    def fallback(self, method, handler, name='default'):
+        """Handler used when nothing matches for ``method``"""
+        self.fallbacks[method] = (name, handler, ())
+
+    def resolve(self, method, path):
+        """Return ``(name, handler, params, allowed_methods)`` for a request path"""
+        path = self._normalize(path)
+        route = self.static.get((method, path))
+        if route is not None:
+            return route[0], route[1], {}, None
+        
+        node = self.trie
+        values = []
+        for segment in path.strip('/').split('/'):
+            child = node.get(segment)
+            if child is None:
+                child = node.get(self.PARAM)
+                if child is None:
+                    node = None
+                    break
+                values.append(urllib.parse.unquote(segment))
+            node = child
+        
+        endpoints = node.get(None) if node is not None else None
+        if endpoints:
+            route = endpoints.get(method)
+            if route is not None:
+                return route[0], route[1], dict(zip(route[2], values)), None
+            allowed = endpoints
+        else:
+            allowed = self.methods.get(path)
+            if allowed and method in allowed:
+                allowed = None
+        # CORS preflights go to the OPTIONS fallback on routed paths too
+        if allowed and not (method == 'OPTIONS' and method in self.fallbacks):
+            return None, None, {}, sorted(allowed)
+        
+        name, handler, _ = self.fallbacks[method]
+        return name, handler, {}, None
+
+    @staticmethod
+    def _normalize(path):
+        return path.rstrip('/') or '/'
+
+class LobbyCache:
+    """Per-lobby response cache.
+
+    Each lobby is stored as a pre-rendered JSON body with a content ETag.
+    ``update`` diffs a fresh lobby list against the cache and only replaces
+    entries whose content changed, so unchanged lobbies keep their ETag and
+    clients revalidating them get a 304.
+    """
+
+    def __init__(self, ttl=2.0):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.entries = {}
+        self.player_index = {}
+        self.refreshed_at = 0.0
+        self.source = None
+
+    def is_stale(self):
+        return time.monotonic() - self.refreshed_at > self.ttl
+    
+    def invalidate(self):
+        """Force a refresh on the next read (after a local roster change)"""
+        self.refreshed_at = 0.0
+        self.source = None
+
+    def update(self, lobbies, source=None):
+        """Apply a fresh lobby list; returns the ids that changed or disappeared
+        
+        ``source`` identifies the upstream data the list came from (the raw
+        WordPress body); when it is the same as last time only the refresh
+        time moves, so the PES-critical path skips rendering and hashing.
+        """
+        if source is not None and source == self.source:
+            with self.lock:
+                self.refreshed_at = time.monotonic()
+            return []
+        import hashlib  # first use only: keeps it off the startup path
+        
+        changed = []
+        entries = {}
+        player_index = {}
+        for lobby in lobbies:
+            lobby_id = str(lobby.id)
+            body = f'{{"lobby":{lobby.to_json()},"status":"success"}}'.encode('ascii')
+            current = self.entries.get(lobby_id)
+            if current is not None and current[1] == body:
+                entries[lobby_id] = current
+            else:
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+                entries[lobby_id] = (etag, body)
+                changed.append(lobby_id)
+            for player in lobby.players:
+                for key in (player.player_id, player.username):
+                    if key is not None:
+                        player_index[str(key)] = lobby_id
+        
+        with self.lock:
+            changed.extend(lobby_id for lobby_id in self.entries if lobby_id not in entries)
+            self.entries = entries
+            self.player_index = player_index
+            self.refreshed_at = time.monotonic()
+            self.source = source
+        if changed:
+            logger.debug("🗂️ Lobby cache invalidated: %s", ', '.join(changed))
+        return changed
+
+    def get(self, lobby_id):
+        """Return ``(etag, body)`` for a lobby, or None"""
+        with self.lock:
+            return self.entries.get(lobby_id)
+
+    def get_for_player(self, player_id):
+        """Return ``(etag, body)`` for the lobby a player is in, or None"""
+        with self.lock:
+            lobby_id = self.player_index.get(player_id)
+            return self.entries.get(lobby_id) if lobby_id is not None else None
+
+class LobbySnapshotStore:
+    """Lobby list shared between worker processes through one local file.
+
+    The supervisor publishes with write-temp-and-rename, so readers never see
+    a partial snapshot. Readers only ``stat`` the file per request and
+    re-parse it when it was replaced. The file lives in /dev/shm when
+    available, so this is effectively shared memory.
+    """
+
+    def __init__(self, path, max_age=30.0):
+        self.path = path
+        self.max_age = max_age
+        self.version = 0
+        self.lock = threading.Lock()
+        self._stat_key = None
+        self._lobbies = None
+        self._published_at = 0.0
+
+    @staticmethod
+    def default_path(port):
+        base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        return os.path.join(base, f"pes_lobby_snapshot_{port}.json")
+
+    def publish(self, lobbies):
+        """Atomically replace the snapshot (supervisor side)"""
+        self.version += 1
+        payload = b'{"version":%d,"published_at":%r,"lobbies":%s}' % (self.version, time.time(),
+                                                                       encode_lobbies(lobbies))
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """Return ``(version, lobbies)`` or None if missing or too old (worker side)"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self.lock:
+            if key != self._stat_key:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    return None
+                self._stat_key = key
+                self.version = data['version']
+                self._lobbies = decode_lobbies(data['lobbies'])
+                self._published_at = data['published_at']
+            if time.time() - self._published_at > self.max_age:
+                return None
+            return self.version, self._lobbies
+
+# V2 tables as first shipped (migration 1)
+BASE_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS players (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE,
+        password_hash TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_login TIMESTAMP,
+        last_heartbeat TIMESTAMP,
+        matches_played INTEGER DEFAULT 0,
+        wins INTEGER DEFAULT 0,
+        losses INTEGER DEFAULT 0,
+        rating INTEGER DEFAULT 1000,
+        status TEXT DEFAULT 'offline',
+        session_token TEXT,
+        ip_address TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS lobbies (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        host_player_id INTEGER,
+        max_players INTEGER DEFAULT 22,
+        current_players INTEGER DEFAULT 1,
+        status TEXT DEFAULT 'waiting',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        game_mode TEXT DEFAULT 'team_play',
+        password_hash TEXT,
+        match_type TEXT DEFAULT '11vs11',
+        FOREIGN KEY (host_player_id) REFERENCES players (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS lobby_players (
+        lobby_id TEXT,
+        player_id INTEGER,
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        team INTEGER DEFAULT 0,
+        ready INTEGER DEFAULT 0,
+        position TEXT DEFAULT 'any',
+        FOREIGN KEY (lobby_id) REFERENCES lobbies (id),
+        FOREIGN KEY (player_id) REFERENCES players (id),
+        PRIMARY KEY (lobby_id, player_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS matches (
+        id TEXT PRIMARY KEY,
+        lobby_id TEXT,
+        team1_players TEXT,
+        team2_players TEXT,
+        status TEXT DEFAULT 'preparing',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        ended_at TIMESTAMP,
+        score_team1 INTEGER DEFAULT 0,
+        score_team2 INTEGER DEFAULT 0,
+        match_data TEXT,
+        FOREIGN KEY (lobby_id) REFERENCES lobbies (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS player_sessions (
+        player_id INTEGER,
+        session_token TEXT,
+        ip_address TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_heartbeat TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        status TEXT DEFAULT 'online',
+        current_lobby TEXT,
+        current_match TEXT,
+        FOREIGN KEY (player_id) REFERENCES players (id),
+        PRIMARY KEY (player_id)
+    )
+    ''',
+)
+
+def add_column_if_missing(conn, table, column, declaration):
+    """ALTER TABLE ADD COLUMN unless an older release already added it"""
+    if column not in {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+def migrate_base_schema(conn):
+    """v1: the V2 tables"""
+    for statement in BASE_SCHEMA:
+        conn.execute(statement)
+
+def migrate_lobby_columns(conn):
+    """v2: team/ready counters and player positions (present on databases from before versioning)"""
+    add_column_if_missing(conn, 'lobbies', 'ready_players', 'INTEGER DEFAULT 0')
+    add_column_if_missing(conn, 'lobbies', 'team1_size', 'INTEGER DEFAULT 0')
+    add_column_if_missing(conn, 'lobbies', 'team2_size', 'INTEGER DEFAULT 0')
+    add_column_if_missing(conn, 'lobby_players', 'position', 'TEXT DEFAULT "any"')
+
+def migrate_match_indexes(conn):
+    """v3: match lookups by status (startup recovery) and lobby (history)"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_matches_status ON matches (status)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_matches_lobby ON matches (lobby_id, created_at)')
+
+def migrate_binary_rosters(conn):
+    """v4: JSON rosters / match data → binary format"""
+    migrate_matches(conn, commit=False)
+
+# Occupancy counters of one roster row (team/ready may be NULL in old rows)
+LOBBY_AGGREGATE_DELTA = ('current_players = current_players {sign} 1, '
+                         'ready_players = ready_players {sign} (COALESCE({row}.ready, 0) != 0), '
+                         'team1_size = team1_size {sign} ({row}.team IS 1), '
+                         'team2_size = team2_size {sign} ({row}.team IS 2)')
+
+LOBBY_AGGREGATE_SELECT = ('SELECT COUNT(*), COALESCE(SUM(COALESCE(ready, 0) != 0), 0), '
+                          'COALESCE(SUM(team IS 1), 0), COALESCE(SUM(team IS 2), 0) '
+                          'FROM lobby_players WHERE lobby_id = lobbies.id')
+
+# SQLite keeps lobbies' counters in step with every lobby_players change.
+# Note: INSERT OR REPLACE only fires the delete trigger with recursive_triggers
+# on, so roster writes use INSERT ... ON CONFLICT DO UPDATE instead.
+LOBBY_AGGREGATE_TRIGGERS = (
+    f'''
+    CREATE TRIGGER IF NOT EXISTS lobby_players_after_insert AFTER INSERT ON lobby_players BEGIN
+        UPDATE lobbies SET {LOBBY_AGGREGATE_DELTA.format(sign='+', row='NEW')} WHERE id = NEW.lobby_id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS lobby_players_after_delete AFTER DELETE ON lobby_players BEGIN
+        UPDATE lobbies SET {LOBBY_AGGREGATE_DELTA.format(sign='-', row='OLD')} WHERE id = OLD.lobby_id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS lobby_players_after_update AFTER UPDATE OF lobby_id, team, ready ON lobby_players
+    BEGIN
+        UPDATE lobbies SET {LOBBY_AGGREGATE_DELTA.format(sign='-', row='OLD')} WHERE id = OLD.lobby_id;
+        UPDATE lobbies SET {LOBBY_AGGREGATE_DELTA.format(sign='+', row='NEW')} WHERE id = NEW.lobby_id;
+    END
+    ''',
+    # A new lobby starts from whatever roster rows already point at it
+    f'''
+    CREATE TRIGGER IF NOT EXISTS lobbies_after_insert AFTER INSERT ON lobbies BEGIN
+        UPDATE lobbies SET (current_players, ready_players, team1_size, team2_size) = ({LOBBY_AGGREGATE_SELECT})
+        WHERE id = NEW.id;
+    END
+    ''',
+)
+
+def rebuild_lobby_aggregates(conn, lobby_ids=None):
+    """Recompute occupancy counters from lobby_players (all lobbies, or the given ids)"""
+    sql = (f'UPDATE lobbies SET (current_players, ready_players, team1_size, team2_size) = '
+           f'({LOBBY_AGGREGATE_SELECT})')
+    if lobby_ids is None:
+        return conn.execute(sql).rowcount
+    lobby_ids = list(lobby_ids)
+    updated = 0
+    for start in range(0, len(lobby_ids), 500):
+        chunk = lobby_ids[start:start + 500]
+        updated += conn.execute(f"{sql} WHERE id IN ({','.join('?' * len(chunk))})", chunk).rowcount
+    return updated
+
+def check_lobby_aggregates(conn):
+    """Lobbies whose stored counters disagree with their roster: [(lobby_id, stored, actual)]"""
+    rows = conn.execute('''
+        SELECT l.id, l.current_players, l.ready_players, l.team1_size, l.team2_size,
+               COALESCE(r.players, 0), COALESCE(r.ready, 0), COALESCE(r.team1, 0), COALESCE(r.team2, 0)
+        FROM lobbies l
+        LEFT JOIN (
+            SELECT lobby_id, COUNT(*) AS players, SUM(COALESCE(ready, 0) != 0) AS ready,
+                   SUM(team IS 1) AS team1, SUM(team IS 2) AS team2
+            FROM lobby_players GROUP BY lobby_id
+        ) r ON r.lobby_id = l.id
+    ''').fetchall()
+    return [(row[0], row[1:5], row[5:9]) for row in rows if tuple(row[1:5]) != tuple(row[5:9])]
+
+def migrate_lobby_aggregates(conn):
+    """v5: trigger-maintained occupancy counters, starting from exact values"""
+    for statement in LOBBY_AGGREGATE_TRIGGERS:
+        conn.execute(statement)
+    rebuild_lobby_aggregates(conn)
+
+def migrate_sync_state(conn):
+    """v6: cursors of the WordPress lobby sync"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+def migrate_session_tokens(conn):
+    """v7: token lookups for authenticated requests"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_player_sessions_token ON player_sessions (session_token)')
+
+def migrate_local_lobby_rows(conn):
+    """v8: tell WordPress-synced lobbies / roster rows from local ones, so the sync leaves local ones alone"""
+    add_column_if_missing(conn, 'lobbies', 'synced', 'INTEGER DEFAULT 0')
+    add_column_if_missing(conn, 'lobby_players', 'local_join', 'INTEGER DEFAULT 0')
+    # After a full sync, every lobby already here came from WordPress
+    if conn.execute('SELECT 1 FROM sync_state WHERE key = ?', (FULL_SYNC_KEY,)).fetchone():
+        conn.execute('UPDATE lobbies SET synced = 1')
+
+def migrate_wordpress_privacy(conn):
+    """v9: lobbies private on WordPress (their password is only known there)"""
+    add_column_if_missing(conn, 'lobbies', 'has_password', 'INTEGER DEFAULT 0')
+
+def migrate_binary_rosters_v2(conn):
+    """v10: rows format v1 left as JSON (id-only rosters, entries without some fields) → binary"""
+    migrate_matches(conn, commit=False)
+
+# Numbered schema migrations; PRAGMA user_version records the last one applied
+MIGRATIONS = [
+    (1, migrate_base_schema),
+    (2, migrate_lobby_columns),
+    (3, migrate_match_indexes),
+    (4, migrate_binary_rosters),
+    (5, migrate_lobby_aggregates),
+    (6, migrate_sync_state),
+    (7, migrate_session_tokens),
+    (8, migrate_local_lobby_rows),
+    (9, migrate_wordpress_privacy),
+    (10, migrate_binary_rosters_v2),
+]
+
+def run_migrations(conn):
+    """Apply pending migrations in one transaction; returns the versions applied"""
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    pending = [(version, migration) for version, migration in MIGRATIONS if version > current]
+    if not pending:
+        return []
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Another process may have migrated while we waited for the lock
+        current = conn.execute('PRAGMA user_version').fetchone()[0]
+        pending = [(version, migration) for version, migration in pending if version > current]
+        for version, migration in pending:
+            migration(conn)
+        if pending:
+            conn.execute(f'PRAGMA user_version = {pending[-1][0]}')
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return [version for version, _ in pending]
+
 class PESDatabase:
     """Enhanced database for full 11vs11 functionality"""
     
     def __init__(self, db_path="pes_server.db"):
         self.db_path = db_path
         self.wordpress_api_url = "http://localhost:8080/wp-json/pes/v1/"
+        self.lobby_cache = LobbyCache()
+        self.snapshot_store = None
+        # (raw WordPress body, lobbies decoded from it): unchanged bodies are not decoded again
+        self.upstream_lobbies = (None, None)
+        self.matches = None
+        self.lobby_sync = None
         self.init_database()
+        # Hashing pool starts on the first login, not here
+        self.auth = AuthService(db_path)
     
     def init_database(self):
-        """Initialize SQLite database with enhanced schema"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Players table (enhanced)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS players (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE,
-                password_hash TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP,
-                last_heartbeat TIMESTAMP,
-                matches_played INTEGER DEFAULT 0,
-                wins INTEGER DEFAULT 0,
-                losses INTEGER DEFAULT 0,
-                rating INTEGER DEFAULT 1000,
-                status TEXT DEFAULT 'offline',
-                session_token TEXT,
-                ip_address TEXT
-            )
-        ''')
-        
-        # Lobbies table (enhanced)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS lobbies (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                host_player_id INTEGER,
-                max_players INTEGER DEFAULT 22,
-                current_players INTEGER DEFAULT 1,
-                status TEXT DEFAULT 'waiting',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                game_mode TEXT DEFAULT 'team_play',
-                password_hash TEXT,
-                match_type TEXT DEFAULT '11vs11',
-                FOREIGN KEY (host_player_id) REFERENCES players (id)
-            )
-        ''')
-        
-        # Add missing columns if they don't exist
+        """Bring the schema up to date (a no-op on an already migrated database)"""
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
         try:
-            cursor.execute('ALTER TABLE lobbies ADD COLUMN ready_players INTEGER DEFAULT 0')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        
-        try:
-            cursor.execute('ALTER TABLE lobbies ADD COLUMN team1_size INTEGER DEFAULT 0')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-            
-        try:
-            cursor.execute('ALTER TABLE lobbies ADD COLUMN team2_size INTEGER DEFAULT 0')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        
-        # Lobby players table (enhanced)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS lobby_players (
-                lobby_id TEXT,
-                player_id INTEGER,
-                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                team INTEGER DEFAULT 0,
-                ready INTEGER DEFAULT 0,
-                position TEXT DEFAULT 'any',
-                FOREIGN KEY (lobby_id) REFERENCES lobbies (id),
-                FOREIGN KEY (player_id) REFERENCES players (id),
-                PRIMARY KEY (lobby_id, player_id)
-            )
-        ''')
-        
-        # Add missing position column if it doesn't exist
-        try:
-            cursor.execute('ALTER TABLE lobby_players ADD COLUMN position TEXT DEFAULT "any"')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        
-        # Matches table (new for v2)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS matches (
-                id TEXT PRIMARY KEY,
-                lobby_id TEXT,
-                team1_players TEXT,
-                team2_players TEXT,
-                status TEXT DEFAULT 'preparing',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                started_at TIMESTAMP,
-                ended_at TIMESTAMP,
-                score_team1 INTEGER DEFAULT 0,
-                score_team2 INTEGER DEFAULT 0,
-                match_data TEXT,
-                FOREIGN KEY (lobby_id) REFERENCES lobbies (id)
-            )
-        ''')
-        
-        # Player sessions table (new for v2)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS player_sessions (
-                player_id INTEGER,
-                session_token TEXT,
-                ip_address TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_heartbeat TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'online',
-                current_lobby TEXT,
-                current_match TEXT,
-                FOREIGN KEY (player_id) REFERENCES players (id),
-                PRIMARY KEY (player_id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        print("🗄️ Enhanced Database V2 initialized for PES Game compatibility")
+            applied = run_migrations(conn)
+        finally:
+            conn.close()
+        if applied:
+            logger.info("🗄️ Applied %d schema migration(s), database at version %d", len(applied), applied[-1])
+            # Archived tables follow the hot schema, so partition reads and moves keep working
+            MatchArchive(self.db_path).migrate_partitions()
+        logger.info("🗄️ Enhanced Database V2 initialized for PES Game compatibility")
     
     def get_connection(self):
         """Get database connection"""
         return sqlite3.connect(self.db_path)
     
+    def check_lobby_aggregates(self, repair=False):
+        """Compare stored lobby counters with the rosters; optionally rebuild the wrong ones"""
+        conn = self.get_connection()
+        try:
+            mismatches = check_lobby_aggregates(conn)
+            if repair and mismatches:
+                with conn:
+                    rebuild_lobby_aggregates(conn, [lobby_id for lobby_id, _, _ in mismatches])
+        finally:
+            conn.close()
+        return mismatches
+    
+    def start_lobby_sync(self):
+        """Keep the local lobby tables warm from WordPress (the fallback when it is down)"""
+        self.lobby_sync = LobbySyncWorker(self.db_path, self.wordpress_api_url).start()
+        return self.lobby_sync
+    
+    def push_lobby_join(self, lobby_id, player_id, team=0, position='any'):
+        """Forward a local join to WordPress so /api/lobbies shows it.
+
+        Returns whether WordPress got it (False while it is unreachable);
+        raises AuthenticationError with WordPress's status when it refuses.
+        """
+        try:
+            import requests
+            
+            with METRICS.span('upstream'):
+                response = requests.post(f"{self.wordpress_api_url}lobby/{urllib.parse.quote(str(lobby_id))}/join",
+                                         json={'player_id': player_id, 'team': team, 'position': position},
+                                         timeout=3)
+        except Exception as e:
+            logger.warning("⚠️ Could not forward lobby join to WordPress: %s", e)
+            return False
+        if response.ok:
+            return True
+        logger.warning("⚠️ WordPress refused join of player %s to lobby %s: %s",
+                       player_id, lobby_id, response.status_code)
+        try:
+            message = response.json().get('message')
+        except (ValueError, AttributeError):
+            message = None
+        raise AuthenticationError(f"WordPress refused the join: {message or response.reason}", response.status_code)
+    
+    def start_match_service(self, background=True):
+        """Start the match lifecycle service.
+        
+        With ``background`` it also re-arms timeouts of active matches and
+        schedules archiving; with several workers only one of them does.
+        """
+        self.matches = MatchLifecycleService(self.db_path, archive=MatchArchive(self.db_path), recover=background)
+        if background:
+            self.matches.schedule_archiving()
+        return self.matches
+    
     def get_lobbies_enhanced(self):
         """Get enhanced lobby list from WordPress API - FIXED VERSION"""
+        if self.snapshot_store is not None:
+            # Multi-worker mode: the supervisor polls WordPress for everyone
+            snapshot = self.snapshot_store.load()
+            if snapshot is not None:
+                version, lobbies = snapshot
+                self.lobby_cache.update(lobbies, source=('snapshot', version))
+                return lobbies
+            logger.warning("⚠️ Shared lobby snapshot missing or stale, fetching directly")
+        
         try:
+            # Deferred: importing requests costs more than the rest of startup together
+            import requests
+            
             # Try to get lobbies from WordPress API
-            response = requests.get(f"{self.wordpress_api_url}lobbies", timeout=3)
+            with METRICS.span('upstream'):
+                response = requests.get(f"{self.wordpress_api_url}lobbies", timeout=3)
             if response.status_code == 200:
-                data = response.json()
+                body, lobbies = self.upstream_lobbies
+                if lobbies is not None and response.content == body:
+                    # Same upstream data as last time: no decoding, no cache rebuild
+                    self.lobby_cache.update(lobbies, source=body)
+                    return lobbies
+            data = response.json() if response.status_code == 200 else None
+            if data is not None:
                 if data.get('success') and data.get('lobbies'):
-                    print(f"✅ Found {len(data['lobbies'])} lobbies from WordPress API")
-                    return data['lobbies']
+                    logger.debug("✅ Found %d lobbies from WordPress API", len(data['lobbies']))
+                    lobbies = decode_lobbies(data['lobbies'])
+                    self.upstream_lobbies = (response.content, lobbies)
+                    self.lobby_cache.update(lobbies, source=response.content)
+                    return lobbies
                 else:
-                    print("⚠️ WordPress API returned no lobbies")
+                    logger.warning("⚠️ WordPress API returned no lobbies")
             else:
-                print(f"⚠️ WordPress API error: {response.status_code}")
+                logger.warning("⚠️ WordPress API error: %s", response.status_code)
         except Exception as e:
-            print(f"⚠️ WordPress API connection failed: {e}")
+            logger.warning("⚠️ WordPress API connection failed: %s", e)
         
         # Fallback to SQLite if WordPress API fails
-        print("🔄 Fallback to SQLite database")
+        logger.debug("🔄 Fallback to SQLite database")
+        with METRICS.span('db'):
+            lobbies = self._get_lobbies_sqlite()
+        self.lobby_cache.update(lobbies)
+        return lobbies
+    
+    def get_cached_lobby(self, lobby_id=None, player_id=None):
+        """Return ``(etag, body)`` for one lobby, refreshing the cache when stale"""
+        cache = self.lobby_cache
+        if cache.is_stale():
+            with cache.refresh_lock:
+                # Concurrent misses share one refresh
+                if cache.is_stale():
+                    self.get_lobbies_enhanced()
+        if player_id is not None:
+            return cache.get_for_player(player_id)
+        return cache.get(lobby_id)
+    
+    def get_player(self, player_id):
+        """Public profile of a player (no email, password or session data), or None"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute('''
+                SELECT id, username, created_at, last_login, matches_played, wins, losses, rating, status
+                FROM players WHERE id = ?
+            ''', (player_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return dict(zip(('player_id', 'username', 'created_at', 'last_login', 'matches_played', 'wins', 'losses',
+                         'rating', 'status'), row))
+    
+    def _get_lobbies_sqlite(self):
+        """Read open lobbies and their rosters from the local SQLite database"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
             SELECT l.id, l.name, l.host_player_id, l.max_players, l.current_players,
-                   l.status, l.created_at, l.game_mode, l.password_hash,
+                   l.status, l.created_at, l.game_mode, l.password_hash IS NOT NULL OR COALESCE(l.has_password, 0),
                    COALESCE(l.ready_players, 0) as ready_players,
                    COALESCE(l.team1_size, 0) as team1_size,
                    COALESCE(l.team2_size, 0) as team2_size,
@@ -188,7 +845,8 @@ class PESDatabase:
             
             # Get players in lobby
             cursor.execute('''
-                SELECT p.username, lp.team, lp.ready, COALESCE(lp.position, 'any') as position
+                SELECT p.username, lp.team, lp.ready, COALESCE(lp.position, 'any') as position,
+                       lp.player_id
                 FROM lobby_players lp
                 JOIN players p ON lp.player_id = p.id
                 WHERE lp.lobby_id = ?
@@ -196,111 +854,277 @@ class PESDatabase:
             
             players_data = cursor.fetchall()
             
-            lobbies.append({
-                'id': row[0],
-                'name': row[1],
-                'host_player_id': row[2],
-                'max_players': row[3],
-                'current_players': row[4],
-                'status': row[5],
-                'created_at': row[6],
-                'game_mode': row[7],
-                'has_password': bool(row[8]),
-                'ready_players': row[9],
-                'team1_size': row[10],
-                'team2_size': row[11],
-                'host_username': row[12],
-                'players': [{'username': p[0], 'team': p[1], 'ready': bool(p[2]), 'position': p[3]} for p in players_data]
-            })
+            lobbies.append(Lobby(
+                id=row[0],
+                name=row[1],
+                host_player_id=row[2],
+                max_players=row[3],
+                current_players=row[4],
+                status=row[5],
+                created_at=row[6],
+                game_mode=row[7],
+                has_password=bool(row[8]),
+                ready_players=row[9],
+                team1_size=row[10],
+                team2_size=row[11],
+                host_username=row[12],
+                players=[LobbyPlayer(p[4], p[0], p[1], bool(p[2]), p[3]) for p in players_data]
+            ))
         
         conn.close()
         return lobbies
 
+CORS_HEADERS = (
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type, Authorization'),
+)
+
 class EnhancedPESGameHandler(BaseHTTPRequestHandler):
     """Enhanced HTTP handler SPECIFICALLY FOR PES 2021 GAME"""
     
+    # Persistent connections: PES and the launcher reuse one socket for many requests
+    protocol_version = 'HTTP/1.1'
+    server_version = 'PES-TeamPlay-Enhanced-V2-Game/1.0'
+    timeout = 15  # idle keep-alive timeout (seconds)
+    max_keepalive_requests = 100
+    disable_nagle_algorithm = True
+    
     def __init__(self, *args, database=None, **kwargs):
         self.database = database
+        self.requests_handled = 0
         super().__init__(*args, **kwargs)
     
+    def version_string(self):
+        return self.server_version
+    
     def log_message(self, format, *args):
         """Custom logging"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        print(f"🎮 [{timestamp}] {format % args}")
+        logger.info("🎮 %s %s", self.client_address[0], format % args)
+    
+    def handle_one_request(self):
+        """Read and serve one request; between requests the connection counts as idle"""
+        idle = self.requests_handled > 0 and hasattr(self.server, 'mark_idle')
+        if idle and not self.server.mark_idle(self.connection):
+            # Server is draining: don't wait for another request on this connection
+            self.close_connection = True
+            return
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except (TimeoutError, OSError):
+            # Idle timeout, or drain shut the idle connection down
+            self.close_connection = True
+            return
+        finally:
+            if idle:
+                self.server.mark_busy(self.connection)
+        
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        self.requests_handled += 1
+        if not self.parse_request():
+            return
+        handler = getattr(self, 'do_' + self.command, None)
+        if handler is None:
+            self.send_error(501, f"Unsupported method ({self.command!r})")
+            return
+        handler()
+        self.wfile.flush()
+    
+    def send_response(self, code, message=None):
+        """Remember the status code for request metrics"""
+        self.response_status = code
+        super().send_response(code, message)
+    
+    def send_buffered(self, status, headers, body=b''):
+        """Write status line, headers and body as one buffer (a single sendall)"""
+        self.response_status = status
+        if self.requests_handled >= self.max_keepalive_requests or getattr(self.server, 'draining', False):
+            self.close_connection = True
+        
+        head = [f"{self.protocol_version} {status} {self.responses.get(status, ('',))[0]}",
+                f"Server: {self.server_version}",
+                f"Date: {self.date_time_string()}"]
+        head.extend(f"{name}: {value}" for name, value in headers)
+        if status != 304:
+            head.append(f"Content-Length: {len(body)}")
+        if self.close_connection:
+            head.append("Connection: close")
+        else:
+            head.append("Connection: keep-alive")
+            head.append(f"Keep-Alive: timeout={self.timeout}, "
+                        f"max={self.max_keepalive_requests - self.requests_handled}")
+        head.append("\r\n")
+        
+        self.log_request(status, len(body))
+        self.wfile.write("\r\n".join(head).encode('latin-1') + body)
     
     def send_text_response(self, content, status=200):
         """Send text response for PES game"""
         try:
-            self.send_response(status)
-            self.send_header('Content-Type', 'text/plain; charset=utf-8')
-            self.send_header('Content-Length', str(len(content)))
-            self.send_header('Connection', 'keep-alive')
-            self.send_header('Server', 'PES-TeamPlay-Enhanced-V2-Game/1.0')
-            self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
+            with METRICS.span('render'):
+                body = content.encode('utf-8')
+            with METRICS.span('write'):
+                self.send_buffered(status, [('Content-Type', 'text/plain; charset=utf-8')], body)
         except Exception as e:
-            print(f"❌ Error sending text response: {e}")
+            logger.error("❌ Error sending text response: %s", e)
     
     def send_json_response(self, data, status=200):
         """Send JSON response"""
         try:
-            json_data = json.dumps(data, indent=2, default=str)
-            self.send_response(status)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Content-Length', str(len(json_data)))
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-            self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-            self.send_header('Connection', 'keep-alive')
-            self.send_header('Server', 'PES-TeamPlay-Enhanced-V2-Game/1.0')
-            self.end_headers()
-            self.wfile.write(json_data.encode('utf-8'))
+            with METRICS.span('render'):
+                json_data = json.dumps(data, indent=2, default=str).encode('utf-8')
+            with METRICS.span('write'):
+                self.send_buffered(status, [('Content-Type', 'application/json'), *CORS_HEADERS], json_data)
         except Exception as e:
-            print(f"❌ Error sending JSON response: {e}")
+            logger.error("❌ Error sending JSON response: %s", e)
+    
+    def send_cached_json(self, etag, body):
+        """Send a pre-rendered JSON body, or 304 if the client already has it"""
+        with METRICS.span('write'):
+            headers = [('ETag', etag), ('Cache-Control', 'no-cache'),
+                       ('Access-Control-Allow-Origin', '*'), ('Access-Control-Expose-Headers', 'ETag')]
+            if etag in self.headers.get('If-None-Match', ''):
+                self.send_buffered(304, headers)
+            else:
+                self.send_buffered(200, headers + [('Content-Type', 'application/json')], body)
     
     def do_OPTIONS(self):
         """Handle preflight requests"""
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        self.end_headers()
+        self.dispatch('OPTIONS')
     
     def do_GET(self):
         """Handle GET requests"""
-        client_ip = self.client_address[0]
-        user_agent = self.headers.get('User-Agent', 'Unknown')
+        self.dispatch('GET')
+    
+    def do_POST(self):
+        """Handle POST requests"""
+        self.dispatch('POST')
+    
+    def dispatch(self, method):
+        """Resolve the request through ROUTES and call the matching handler"""
+        started = time.perf_counter()
+        self.response_status = None
+        self.body_read = False
+        route = 'default'
         
-        print(f"🎮 PES GET {self.path}")
-        print(f"   From: {client_ip}")
-        print(f"   User-Agent: {user_agent}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🎮 PES %s %s from %s (User-Agent: %s)", method,
+                         self.path, self.client_address[0], self.headers.get('User-Agent', 'Unknown'))
         
         try:
             # Parse URL and query parameters
-            path_parts = self.path.split('?')
-            path = path_parts[0]
-            query_params = {}
-            if len(path_parts) > 1:
-                query_params = urllib.parse.parse_qs(path_parts[1])
+            with METRICS.span('parse'):
+                url = urllib.parse.urlsplit(self.path)
+                self.query_params = urllib.parse.parse_qs(url.query) if url.query else {}
+                route, handler, params, allowed = ROUTES.resolve(method, url.path)
             
-            # Route requests - PES GAME SPECIFIC
-            if path == '/XME994-E1/info/info_en.txt':
-                self.handle_pes_info_en()
-            elif path == '/XME994-E1/info/info_us.txt':
-                self.handle_pes_info_us()
-            elif path.startswith('/api/status'):
-                self.handle_server_status()
-            elif path.startswith('/api/lobbies'):
-                self.handle_lobby_list_enhanced()
-            else:
-                self.handle_pes_default()
+            rejected, retry_after = ADMISSION.admit(self.client_address[0], url.path, self.bearer_token())
+            if rejected:
+                route = 'rate_limited' if rejected == 429 else 'overloaded'
+                self.send_rejected(rejected, retry_after)
+                return
+            try:
+                if handler is None:
+                    route = 'method_not_allowed'
+                    self.handle_method_not_allowed(allowed)
+                else:
+                    getattr(self, handler)(**params)
+            finally:
+                ADMISSION.release()
         except Exception as e:
-            print(f"❌ Error handling PES GET request: {e}")
+            logger.exception("❌ Error handling PES %s request: %s", method, e)
             self.send_error(500, f"Internal server error: {e}")
+        finally:
+            self.discard_unread_body()
+            METRICS.observe('request', time.perf_counter() - started)
+            # Which redirected PES domain (if any) the client thought it was talking to
+            METRICS.count_request(method, route, self.response_status or 0,
+                                  REGISTRY.classify(self.headers.get('Host', '')))
+    
+    def send_rejected(self, status, retry_after):
+        """429 (this client is over its rate) or 503 (server at its in-flight limit), with Retry-After"""
+        error = 'Too many requests' if status == 429 else 'Server busy'
+        body = json.dumps({'error': error, 'retry_after': retry_after}).encode('utf-8')
+        self.send_buffered(status, [('Retry-After', str(retry_after)), ('Content-Type', 'application/json'),
+                                    *CORS_HEADERS], body)
+    
+    def discard_unread_body(self):
+        """Keep the connection in sync when a handler ignored the request body"""
+        if self.body_read:
+            return
+        if 'Transfer-Encoding' in self.headers:
+            # Chunked uploads are not supported: just don't reuse the connection
+            self.close_connection = True
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > 65536:
+            self.close_connection = True
+        elif length:
+            self.rfile.read(length)
+    
+    def handle_preflight(self):
+        """Answer CORS preflight for any path"""
+        self.send_buffered(200, CORS_HEADERS)
+    
+    def handle_method_not_allowed(self, allowed):
+        """Path exists but not for this method"""
+        body = json.dumps({'error': 'Method not allowed', 'allowed': allowed}).encode('utf-8')
+        self.send_buffered(405, [('Allow', ', '.join(allowed + ['OPTIONS'])),
+                                 ('Content-Type', 'application/json')], body)
+    
+    def handle_metrics(self):
+        """Expose Prometheus-style metrics"""
+        body = (METRICS.render() + '\n'.join(ADMISSION.render()) + '\n').encode('utf-8')
+        self.send_buffered(200, [('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')], body)
+    
+    def authorized_admin(self):
+        """Admin requests carry ``Authorization: Bearer $PES_ADMIN_TOKEN``; without that variable
+        set, only loopback clients are admins. Sends 403 and returns False otherwise."""
+        import hmac
+        import ipaddress
+        
+        admin_token = os.environ.get('PES_ADMIN_TOKEN')
+        if admin_token:
+            token = self.bearer_token() or ''
+            allowed = hmac.compare_digest(token.encode('utf-8'), admin_token.encode('utf-8'))
+        else:
+            try:
+                allowed = ipaddress.ip_address(self.client_address[0]).is_loopback
+            except ValueError:
+                allowed = False
+        if not allowed:
+            self.send_json_response({'error': 'Admin access required'}, 403)
+        return allowed
+    
+    def handle_profiler_toggle(self):
+        """Turn the sampling profiler on or off (admin only): {"enabled": true|false}"""
+        if not self.authorized_admin():
+            return
+        try:
+            body = self.read_json_body()
+        except ValueError as e:
+            self.send_json_response({'error': f'Invalid JSON: {e}'}, 400)
+            return
+        if not isinstance(body.get('enabled'), bool):
+            self.send_json_response({'error': 'enabled must be true or false'}, 400)
+            return
+        if body['enabled']:
+            METRICS.profiler.start()
+        else:
+            METRICS.profiler.stop()
+        self.send_json_response({'success': True, 'profiler': METRICS.profiler.running})
     
     def handle_pes_info_en(self):
         """Handle PES 2021 info file request (EN version) - CRITICAL FOR GAME"""
-        print("🎯 Handling PES 2021 info file request (EN VERSION) - GAME INTERCEPTION")
+        logger.debug("🎯 Handling PES 2021 info file request (EN VERSION) - GAME INTERCEPTION")
         
         # Get lobbies from WordPress API (FIXED VERSION)
         lobbies = self.database.get_lobbies_enhanced() if self.database else []
@@ -310,10 +1134,7 @@ class EnhancedPESGameHandler(BaseHTTPRequestHandler):
         lobby_details = ""
         if lobbies:
             for lobby in lobbies[:3]:  # Show first 3 lobbies
-                lobby_name = lobby.get('lobby_name', lobby.get('name', 'Unknown'))
-                current_players = lobby.get('current_players', 0)
-                max_players = lobby.get('max_players', 22)
-                lobby_details += f"Lobby: {lobby_name} ({current_players}/{max_players}) | "
+                lobby_details += f"Lobby: {lobby.name} ({lobby.current_players}/{lobby.max_players}) | "
         else:
             lobby_details = "No active lobbies found | "
         
@@ -342,11 +1163,11 @@ Connection: Stable and ready for gameplay
 """
         
         self.send_text_response(pes_info_content)
-        print(f"✅ PES 2021 EN info file served - Found {active_lobbies} lobbies from WordPress!")
+        logger.debug("✅ PES 2021 EN info file served - Found %d lobbies", active_lobbies)
     
     def handle_pes_info_us(self):
         """Handle PES 2021 info file request (US version) - CRITICAL FOR GAME"""
-        print("🎯 Handling PES 2021 info file request (US VERSION) - GAME INTERCEPTION")
+        logger.debug("🎯 Handling PES 2021 info file request (US VERSION) - GAME INTERCEPTION")
         
         # Get lobbies from WordPress API (FIXED VERSION)
         lobbies = self.database.get_lobbies_enhanced() if self.database else []
@@ -356,10 +1177,7 @@ Connection: Stable and ready for gameplay
         lobby_details = ""
         if lobbies:
             for lobby in lobbies[:3]:  # Show first 3 lobbies
-                lobby_name = lobby.get('lobby_name', lobby.get('name', 'Unknown'))
-                current_players = lobby.get('current_players', 0)
-                max_players = lobby.get('max_players', 22)
-                lobby_details += f"Lobby: {lobby_name} ({current_players}/{max_players}) | "
+                lobby_details += f"Lobby: {lobby.name} ({lobby.current_players}/{lobby.max_players}) | "
         else:
             lobby_details = "No active lobbies found | "
         
@@ -388,11 +1206,11 @@ Connection: Stable and ready for gameplay
 """
         
         self.send_text_response(pes_info_content)
-        print(f"✅ PES 2021 US info file served - Found {active_lobbies} lobbies from WordPress!")
+        logger.debug("✅ PES 2021 US info file served - Found %d lobbies", active_lobbies)
     
     def handle_server_status(self):
         """Handle server status request"""
-        print("📊 Handling server status request (PES Game Version)")
+        logger.debug("📊 Handling server status request (PES Game Version)")
         
         try:
             lobbies = self.database.get_lobbies_enhanced() if self.database else []
@@ -422,23 +1240,22 @@ Connection: Stable and ready for gameplay
             }
             
             self.send_json_response(status_data)
-            print("✅ Server status served successfully (PES Game Version)")
+            logger.debug("✅ Server status served successfully (PES Game Version)")
         except Exception as e:
-            print(f"❌ Error handling server status: {e}")
+            logger.error("❌ Error handling server status: %s", e)
             self.send_json_response({'error': f'Failed to get server status: {e}'}, 500)
     
     def handle_lobby_list_enhanced(self):
         """Handle enhanced lobby list request - FIXED VERSION"""
-        print("🏟️ Handling enhanced lobby list request (PES Game) - WordPress Integration")
+        logger.debug("🏟️ Handling enhanced lobby list request (PES Game) - WordPress Integration")
         
         try:
             # Get lobbies from WordPress API (FIXED)
             lobbies = self.database.get_lobbies_enhanced() if self.database else []
-            print(f"🔍 Found {len(lobbies)} lobbies from WordPress API")
+            logger.debug("🔍 Found %d lobbies", len(lobbies))
             
             response_data = {
                 'status': 'success',
-                'lobbies': lobbies,
                 'total_lobbies': len(lobbies),
                 'server_time': datetime.now().isoformat(),
                 'version': '2.0-enhanced-pes-game',
@@ -446,15 +1263,254 @@ Connection: Stable and ready for gameplay
                 'wordpress_integration': 'ACTIVE'
             }
             
-            self.send_json_response(response_data)
-            print(f"✅ Enhanced lobby list served: {len(lobbies)} lobbies from WordPress!")
+            # Lobbies are spliced in pre-encoded (each lobby renders its JSON once)
+            with METRICS.span('render'):
+                body = b'%s,"lobbies":%s}' % (json.dumps(response_data, separators=(',', ':')).encode('utf-8')[:-1],
+                                              encode_lobbies(lobbies))
+            with METRICS.span('write'):
+                self.send_buffered(200, [('Content-Type', 'application/json'), *CORS_HEADERS], body)
+            logger.debug("✅ Enhanced lobby list served: %d lobbies", len(lobbies))
         except Exception as e:
-            print(f"❌ Error handling enhanced lobby list: {e}")
+            logger.error("❌ Error handling enhanced lobby list: %s", e)
             self.send_json_response({'error': f'Failed to get lobbies: {e}'}, 500)
     
+    def handle_lobby_detail(self, lobby_id):
+        """Handle single lobby request (cached per lobby, supports If-None-Match)"""
+        entry = self.database.get_cached_lobby(lobby_id=lobby_id) if self.database else None
+        if entry is None:
+            self.send_json_response({'error': f'Lobby {lobby_id} not found'}, 404)
+            return
+        self.send_cached_json(*entry)
+    
+    def handle_player_detail(self, player_id):
+        """Handle single player request"""
+        player = self.database.get_player(player_id)
+        if player is None:
+            self.send_json_response({'error': f'Player {player_id} not found'}, 404)
+            return
+        self.send_json_response({'success': True, 'player': player})
+    
+    def handle_player_lobby(self, player_id):
+        """Handle lobby-of-player request (same cache entry as the lobby itself)"""
+        entry = self.database.get_cached_lobby(player_id=player_id) if self.database else None
+        if entry is None:
+            self.send_json_response({'error': f'Player {player_id} is not in a lobby'}, 404)
+            return
+        self.send_cached_json(*entry)
+    
+    def read_json_body(self):
+        """Parse the request body as a JSON object (empty body → {})"""
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body_read = True
+        if not length:
+            return {}
+        data = json.loads(self.rfile.read(length).decode('utf-8'))
+        if not isinstance(data, dict):
+            raise ValueError("JSON body must be an object")
+        return data
+    
+    @staticmethod
+    def match_payload_error(body):
+        """Error message when rosters / match_data in a match request have the wrong JSON type, else None"""
+        for key in ('team1_players', 'team2_players'):
+            if body.get(key) is not None and not isinstance(body[key], list):
+                return f'{key} must be a list'
+        if body.get('match_data') is not None and not isinstance(body['match_data'], dict):
+            return 'match_data must be an object'
+        return None
+    
+    def handle_match_create(self):
+        """Create a match in 'preparing' for a lobby"""
+        try:
+            body = self.read_json_body()
+        except ValueError as e:
+            self.send_json_response({'error': f'Invalid JSON: {e}'}, 400)
+            return
+        if not body.get('lobby_id'):
+            self.send_json_response({'error': 'lobby_id is required'}, 400)
+            return
+        error = self.match_payload_error(body)
+        if error:
+            self.send_json_response({'error': error}, 400)
+            return
+        # WordPress passes its own match id so launchers can report states under it
+        match_id = body.get('match_id')
+        if match_id is not None and not (isinstance(match_id, (str, int)) and str(match_id)):
+            self.send_json_response({'error': 'match_id must be a string or number'}, 400)
+            return
+        
+        try:
+            match_id = self.database.matches.create_match(body['lobby_id'], body.get('team1_players'),
+                                                          body.get('team2_players'), body.get('match_data'),
+                                                          match_id=str(match_id) if match_id is not None else None)
+        except sqlite3.IntegrityError:
+            self.send_json_response({'error': f'Match {match_id} already exists'}, 409)
+            return
+        logger.info("⚽ Match %s created for lobby %s", match_id, body['lobby_id'])
+        self.send_json_response({'success': True, 'match_id': match_id, 'status': 'preparing'}, 201)
+    
+    def handle_match_statuses(self):
+        """Bulk status lookup: ?ids=a,b,c (repeatable), or every active match"""
+        ids = [match_id for value in self.query_params.get('ids', [])
+               for match_id in value.split(',') if match_id]
+        statuses = self.database.matches.get_statuses(ids if 'ids' in self.query_params else None)
+        self.send_json_response({'success': True, 'count': len(statuses), 'matches': statuses})
+    
+    def handle_match_history(self):
+        """Match history across live and archived data: ?lobby_id=&status=&since=&until=&limit="""
+        params = {key: self.query_params[key][0] for key in ('lobby_id', 'status', 'since', 'until')
+                  if key in self.query_params}
+        try:
+            limit = min(int(self.query_params.get('limit', ['100'])[0]), 500)
+        except ValueError:
+            self.send_json_response({'error': 'limit must be a number'}, 400)
+            return
+        try:
+            matches = self.database.matches.archive.find_matches(limit=limit, **params)
+        except ValueError as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return
+        self.send_json_response({'success': True, 'count': len(matches), 'matches': matches})
+    
+    def handle_match_detail(self, match_id):
+        """Handle single match request"""
+        match = self.database.matches.get_match(match_id)
+        if match is None:
+            self.send_json_response({'error': f'Match {match_id} not found'}, 404)
+            return
+        self.send_json_response({'success': True, 'match': match})
+    
+    def handle_match_state(self, match_id):
+        """Move a match to a new state: {"status": ..., "score_team1": .., "score_team2": .., "match_data": ..}"""
+        try:
+            body = self.read_json_body()
+        except ValueError as e:
+            self.send_json_response({'error': f'Invalid JSON: {e}'}, 400)
+            return
+        status = body.get('status')
+        if status not in MATCH_STATES:
+            self.send_json_response({'error': f'status must be one of {list(MATCH_STATES)}'}, 400)
+            return
+        error = self.match_payload_error(body)
+        scores = {}
+        for key in ('score_team1', 'score_team2'):
+            value = body.get(key)
+            if value is None:
+                continue
+            try:
+                if isinstance(value, bool) or not isinstance(value, (int, str)):
+                    raise ValueError(value)
+                scores[key] = int(value)
+                if scores[key] < 0:
+                    raise ValueError(value)
+            except ValueError:
+                error = f'{key} must be a non-negative integer'
+        if error:
+            self.send_json_response({'error': error}, 400)
+            return
+        
+        try:
+            self.database.matches.transition(match_id, status, expected=body.get('expected'),
+                                             match_data=body.get('match_data'), **scores)
+        except KeyError:
+            self.send_json_response({'error': f'Match {match_id} not found'}, 404)
+            return
+        except InvalidTransition as e:
+            self.send_json_response({'error': str(e)}, 409)
+            return
+        logger.info("⚽ Match %s → %s", match_id, status)
+        self.send_json_response({'success': True, 'match_id': match_id, 'status': status})
+    
+    def bearer_token(self):
+        """Session token from ``Authorization: Bearer <token>``"""
+        scheme, _, token = self.headers.get('Authorization', '').partition(' ')
+        return token.strip() if scheme.lower() == 'bearer' else None
+    
+    def authenticated_player(self):
+        """Player id behind the request's token (verified-token cache first), or None after sending 401"""
+        player_id = self.database.auth.verify_token(self.bearer_token())
+        if player_id is None:
+            self.send_buffered(401, [('WWW-Authenticate', 'Bearer'), ('Content-Type', 'application/json'),
+                                     *CORS_HEADERS], b'{"error":"Invalid or expired session token"}')
+        return player_id
+    
+    def handle_login(self):
+        """Open a session: {"username": .., "password": ..} → token"""
+        try:
+            body = self.read_json_body()
+        except ValueError as e:
+            self.send_json_response({'error': f'Invalid JSON: {e}'}, 400)
+            return
+        if not isinstance(body.get('username'), str) or not isinstance(body.get('password'), str):
+            self.send_json_response({'error': 'username and password are required'}, 400)
+            return
+        
+        try:
+            player_id, token, expires_in = self.database.auth.login(body['username'], body['password'],
+                                                                     self.client_address[0])
+        except AuthenticationError as e:
+            logger.info("🔒 Failed login for %s from %s", body['username'], self.client_address[0])
+            self.send_json_response({'error': str(e)}, e.status)
+            return
+        logger.info("🔑 Player %s logged in", body['username'])
+        self.send_json_response({'success': True, 'player_id': player_id, 'token': token,
+                                 'expires_in': expires_in})
+    
+    def handle_logout(self):
+        """Revoke the request's session token"""
+        token = self.bearer_token()
+        if not token or not self.database.auth.logout(token):
+            self.send_json_response({'error': 'Unknown session token'}, 401)
+            return
+        self.send_json_response({'success': True})
+    
+    def handle_verify_token(self):
+        """Check a session token (served from the verified-token cache when possible)"""
+        player_id = self.authenticated_player()
+        if player_id is not None:
+            self.send_json_response({'success': True, 'player_id': player_id})
+    
+    def handle_lobby_join(self, lobby_id):
+        """Join a lobby as the authenticated player: {"password": .., "team": .., "position": ..}"""
+        player_id = self.authenticated_player()
+        if player_id is None:
+            return
+        try:
+            body = self.read_json_body()
+        except ValueError as e:
+            self.send_json_response({'error': f'Invalid JSON: {e}'}, 400)
+            return
+        team = body.get('team') or 0
+        position = body.get('position') or 'any'
+        # The team counters in the lobby triggers only know teams 1 and 2 (0 = unassigned)
+        if isinstance(team, bool) or str(team) not in ('0', '1', '2'):
+            self.send_json_response({'error': 'team must be 0, 1 or 2'}, 400)
+            return
+        if position not in POSITIONS:
+            self.send_json_response({'error': f"position must be one of {', '.join(POSITIONS)}"}, 400)
+            return
+        team = int(team)
+        
+        try:
+            self.database.auth.join_lobby(lobby_id, player_id, body.get('password'), team=team, position=position)
+            try:
+                # The local row survives lobby syncs until WordPress lists the player itself
+                synced = self.database.push_lobby_join(lobby_id, player_id, team, position)
+            except AuthenticationError:
+                self.database.auth.leave_lobby(lobby_id, player_id)
+                raise
+        except AuthenticationError as e:
+            self.send_json_response({'error': str(e)}, e.status)
+            return
+        finally:
+            self.database.lobby_cache.invalidate()
+        logger.info("🏟️ Player %s joined lobby %s", player_id, lobby_id)
+        self.send_json_response({'success': True, 'lobby_id': lobby_id, 'player_id': player_id,
+                                 'wordpress_synced': synced})
+    
     def handle_pes_default(self):
         """Handle unknown PES requests"""
-        print(f"❓ Unknown PES request: {self.path}")
+        logger.info("❓ Unknown PES request: %s", self.path)
         
         # For unknown PES requests, return a helpful response
         response_data = {
@@ -465,49 +1521,472 @@ Connection: Stable and ready for gameplay
                 '/XME994-E1/info/info_en.txt - PES Message (EN)',
                 '/XME994-E1/info/info_us.txt - PES Message (US)',
                 '/api/status - Server Status',
-                '/api/lobbies - Active Lobbies'
+                '/api/lobbies - Active Lobbies',
+                '/api/lobbies/<id> - Single Lobby',
+                '/api/players/<id> - Player Profile',
+                '/api/players/<id>/lobby - Lobby of Player',
+                '/api/matches?ids=a,b - Match Statuses',
+                '/api/matches/<id> - Single Match',
+                '/api/matches/history - Match History (incl. archive)',
+                'POST /api/auth/login - Login (returns a session token)',
+                '/api/auth/verify - Check Session Token',
+                'POST /api/lobbies/<id>/join - Join Lobby (private lobbies need the password)',
+                '/api/metrics - Prometheus Metrics'
             ],
             'status': 'Ready for PES 2021 Team Play'
         }
         
         self.send_json_response(response_data, 404)
 
+class GracefulHTTPServer(ThreadingHTTPServer):
+    """Threaded server that counts in-flight requests so shutdown can drain them.
+
+    ``listen_fd`` adopts an already-listening socket inherited from the
+    previous server process during a reload instead of binding a new one.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, listen_fd=None):
+        self.inflight = 0
+        self.inflight_cond = threading.Condition()
+        self.draining = False
+        self.idle_connections = set()
+        if listen_fd is None:
+            super().__init__(server_address, handler_class)
+            return
+        super().__init__(server_address, handler_class, bind_and_activate=False)
+        self.socket.close()
+        self.socket = socket.socket(fileno=listen_fd)
+        self.server_address = self.socket.getsockname()
+
+    def process_request(self, request, client_address):
+        with self.inflight_cond:
+            self.inflight += 1
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self._request_done()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._request_done()
+
+    def _request_done(self):
+        with self.inflight_cond:
+            self.inflight -= 1
+            self.inflight_cond.notify_all()
+
+    def mark_idle(self, connection):
+        """Keep-alive connection is waiting for its next request; False once draining"""
+        with self.inflight_cond:
+            if self.draining:
+                return False
+            self.idle_connections.add(connection)
+            return True
+    
+    def mark_busy(self, connection):
+        with self.inflight_cond:
+            self.idle_connections.discard(connection)
+    
+    def drain(self, timeout):
+        """Wait up to ``timeout`` seconds for in-flight requests; returns how many are left"""
+        with self.inflight_cond:
+            self.draining = True
+            # Idle keep-alive connections would otherwise hold the drain until their timeout
+            for connection in self.idle_connections:
+                try:
+                    connection.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+            self.idle_connections.clear()
+        deadline = time.monotonic() + timeout
+        # Connections already queued in our backlog would be reset on close, serve them too. The
+        # listening socket may be shared with the replacement process and keep receiving new
+        # connections, so take at most one backlog's worth, within the drain deadline.
+        for _ in range(self.request_queue_size):
+            if time.monotonic() >= deadline or not select.select([self.socket], [], [], 0)[0]:
+                break
+            self._handle_request_noblock()
+        with self.inflight_cond:
+            while self.inflight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.inflight_cond.wait(remaining)
+            return self.inflight
+
+class ReusePortHTTPServer(GracefulHTTPServer):
+    """GracefulHTTPServer that lets several worker processes bind the same port"""
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+def serve_until_signalled(server, drain_timeout, on_reload=None):
+    """Run ``server`` until SIGINT/SIGTERM (or a successful reload), then drain it.
+
+    serve_forever runs in a helper thread so signal handlers on the main
+    thread can stop it without deadlocking. ``on_reload`` is called for
+    SIGHUP and returns True once a replacement process owns the socket.
+    """
+    stop = threading.Event()
+    reload_requested = threading.Event()
+    
+    def request_stop(signum, frame):
+        logger.info("⏹️ Received %s, shutting down gracefully", signal.Signals(signum).name)
+        stop.set()
+    
+    for name in ('SIGINT', 'SIGTERM', 'SIGBREAK'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), request_stop)
+    if on_reload is not None and hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: reload_requested.set())
+    
+    thread = threading.Thread(target=server.serve_forever, name="pes-accept", daemon=True)
+    thread.start()
+    while not stop.wait(0.5):
+        if reload_requested.is_set():
+            reload_requested.clear()
+            if on_reload():
+                break
+    
+    # Stop accepting, then give in-flight requests until the deadline
+    server.shutdown()
+    left = server.drain(drain_timeout)
+    if left:
+        logger.warning("⚠️ Drain deadline reached with %d request(s) still in flight", left)
+    server.server_close()
+
+def spawn_replacement(server, args, ready_timeout=30.0):
+    """Start a new server process on the same listening socket and wait until it is warm"""
+    listen_fd = server.socket.fileno()
+    ready_r, ready_w = os.pipe()
+    command = [sys.executable, os.path.abspath(__file__),
+               '--port', str(args.port), '--drain-timeout', str(args.drain_timeout),
+               '--rate-limit', str(args.rate_limit), '--max-in-flight', str(args.max_in_flight),
+               '--inherit-fd', str(listen_fd), '--ready-fd', str(ready_w)]
+    logger.info("🔄 Reload requested, starting replacement server")
+    try:
+        process = subprocess.Popen(command, pass_fds=(listen_fd, ready_w))
+    except OSError as e:
+        logger.error("❌ Could not start replacement server: %s", e)
+        os.close(ready_r)
+        os.close(ready_w)
+        return False
+    os.close(ready_w)
+    try:
+        readable, _, _ = select.select([ready_r], [], [], ready_timeout)
+        ready = bool(readable) and os.read(ready_r, 1) == b'1'
+    finally:
+        os.close(ready_r)
+    if not ready:
+        logger.error("❌ Replacement server (pid %d) did not become ready, keeping this one", process.pid)
+        process.terminate()
+        return False
+    logger.info("✅ Replacement server (pid %d) is serving, draining this process", process.pid)
+    return True
+
+def make_handler(database):
+    """Bind the request handler class to a database instance"""
+    class Handler(EnhancedPESGameHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, database=database, **kwargs)
+    return Handler
+
+class WorkerSupervisor:
+    """Forks N SO_REUSEPORT workers, restarts crashed ones and publishes lobby snapshots.
+
+    The kernel load-balances accepted connections across the workers, so JSON
+    rendering scales past a single GIL. Only the supervisor talks to
+    WordPress; workers read the shared snapshot. The supervisor itself runs
+    no threads (it forks at any time), so the WordPress → SQLite lobby sync
+    runs in a forked child of its own, restarted like a worker.
+    """
+
+    LOBBY_SYNC_SLOT = 'lobby-sync'
+
+    def __init__(self, workers, host='0.0.0.0', port=80, poll_interval=2.0, drain_timeout=10.0):
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self.host = host
+        self.port = port
+        self.poll_interval = poll_interval
+        self.snapshot_path = LobbySnapshotStore.default_path(port)
+        self.children = {}
+        self.retiring = set()
+        self.running = False
+        self.reload_requested = False
+
+    @staticmethod
+    def supported():
+        return hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT')
+
+    def spawn(self, slot, ready_timeout=10.0):
+        """Fork a worker and wait until it has bound the port"""
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            code = 0
+            try:
+                self.worker_main(slot, ready_w)
+            except BaseException:
+                logger.exception("❌ Worker %d crashed", slot)
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(ready_w)
+        try:
+            readable, _, _ = select.select([ready_r], [], [], ready_timeout)
+            if not readable or os.read(ready_r, 1) != b'1':
+                logger.warning("⚠️ Worker %d (pid %d) did not report ready", slot, pid)
+        finally:
+            os.close(ready_r)
+        self.children[pid] = (slot, time.monotonic())
+        logger.info("🚀 Worker %d started (pid %d)", slot, pid)
+
+    def spawn_lobby_sync(self, database):
+        """Fork the lobby sync process; it runs the sync loop on its main thread"""
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                worker = LobbySyncWorker(database.db_path, database.wordpress_api_url)
+                for signum in (signal.SIGTERM, signal.SIGINT):
+                    signal.signal(signum, lambda signum, frame: worker.stop())
+                if hasattr(signal, 'SIGHUP'):
+                    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                worker.run()
+            except BaseException:
+                logger.exception("❌ Lobby sync process crashed")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = (self.LOBBY_SYNC_SLOT, time.monotonic())
+        logger.info("🔄 Lobby sync started (pid %d)", pid)
+
+    def worker_main(self, slot, ready_fd):
+        started = time.perf_counter()
+        listener = setup_logging()
+        try:
+            database = PESDatabase()
+            # Worker 0 owns startup recovery and archiving; the others only time matches they create
+            database.start_match_service(background=(slot == 0))
+            database.snapshot_store = LobbySnapshotStore(self.snapshot_path)
+            database.get_lobbies_enhanced()
+            server = ReusePortHTTPServer((self.host, self.port), make_handler(database))
+            logger.info("⏱️ Worker %d ready in %.1f ms", slot, (time.perf_counter() - started) * 1000)
+            os.write(ready_fd, b'1')
+            os.close(ready_fd)
+            serve_until_signalled(server, self.drain_timeout)
+            database.auth.shutdown()
+        finally:
+            listener.stop()
+
+    def stop(self, signum=None, frame=None):
+        self.running = False
+
+    def request_reload(self, signum=None, frame=None):
+        self.reload_requested = True
+
+    def rolling_restart(self):
+        """Replace workers one at a time; SO_REUSEPORT keeps the port served throughout"""
+        for pid, (slot, _) in list(self.children.items()):
+            if slot == self.LOBBY_SYNC_SLOT:
+                continue
+            self.spawn(slot)
+            del self.children[pid]
+            self.retiring.add(pid)
+            os.kill(pid, signal.SIGTERM)
+
+    def run(self):
+        """Supervisor loop: poll upstream, publish snapshot, reap and respawn workers"""
+        database = PESDatabase()
+        store = LobbySnapshotStore(self.snapshot_path)
+        store.publish(database.get_lobbies_enhanced())
+        
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.request_reload)
+        self.spawn_lobby_sync(database)
+        for slot in range(self.workers):
+            self.spawn(slot)
+        
+        restart_delay = {}
+        # slot → monotonic time of its restart; checked every tick so the snapshot keeps being published
+        restart_at = {}
+        try:
+            while self.running:
+                store.publish(database.get_lobbies_enhanced())
+                if self.reload_requested:
+                    self.reload_requested = False
+                    logger.info("🔄 Rolling restart of %d workers", len(self.children))
+                    self.rolling_restart()
+                while True:
+                    try:
+                        pid, status = os.waitpid(-1, os.WNOHANG)
+                    except ChildProcessError:
+                        # Every child is down, waiting for its restart
+                        break
+                    if pid == 0:
+                        break
+                    if pid in self.retiring:
+                        self.retiring.discard(pid)
+                        continue
+                    slot, started = self.children.pop(pid)
+                    # Back off if a worker keeps dying right after start
+                    delay = restart_delay.get(slot, 0.5) * 2 if time.monotonic() - started < 5 else 0.5
+                    restart_delay[slot] = min(delay, 30.0)
+                    restart_at[slot] = time.monotonic() + restart_delay[slot]
+                    logger.warning("⚠️ Worker %s (pid %d) exited with status %d, restarting in %.1fs",
+                                   slot, pid, status, restart_delay[slot])
+                now = time.monotonic()
+                for slot, deadline in list(restart_at.items()):
+                    if deadline <= now:
+                        del restart_at[slot]
+                        if slot == self.LOBBY_SYNC_SLOT:
+                            self.spawn_lobby_sync(database)
+                        else:
+                            self.spawn(slot)
+                time.sleep(self.poll_interval)
+        except (KeyboardInterrupt, ChildProcessError):
+            pass
+        finally:
+            for pid in self.children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            for pid in list(self.children) + list(self.retiring):
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+            self.children.clear()
+            self.retiring.clear()
+            try:
+                os.remove(self.snapshot_path)
+            except OSError:
+                pass
+            logger.info("✅ All workers stopped")
+
+ROUTES = RouteTable()
+# PES-critical info paths first; all static routes are exact dict lookups
+ROUTES.add('GET', '/XME994-E1/info/info_en.txt', 'handle_pes_info_en', 'info_en')
+ROUTES.add('GET', '/XME994-E1/info/info_us.txt', 'handle_pes_info_us', 'info_us')
+ROUTES.add('GET', '/api/status', 'handle_server_status', 'status')
+ROUTES.add('GET', '/api/metrics', 'handle_metrics', 'metrics')
+ROUTES.add('POST', '/api/metrics/profiler', 'handle_profiler_toggle', 'profiler_toggle')
+ROUTES.add('GET', '/api/lobbies', 'handle_lobby_list_enhanced', 'lobbies')
+ROUTES.add('GET', '/api/lobbies/<lobby_id>', 'handle_lobby_detail', 'lobby_detail')
+ROUTES.add('GET', '/api/players/<player_id>', 'handle_player_detail', 'player_detail')
+ROUTES.add('GET', '/api/players/<player_id>/lobby', 'handle_player_lobby', 'player_lobby')
+ROUTES.add('GET', '/api/matches', 'handle_match_statuses', 'match_statuses')
+ROUTES.add('POST', '/api/matches', 'handle_match_create', 'match_create')
+ROUTES.add('GET', '/api/matches/history', 'handle_match_history', 'match_history')
+ROUTES.add('GET', '/api/matches/<match_id>', 'handle_match_detail', 'match_detail')
+ROUTES.add('POST', '/api/matches/<match_id>/state', 'handle_match_state', 'match_state')
+ROUTES.add('POST', '/api/auth/login', 'handle_login', 'login')
+ROUTES.add('POST', '/api/auth/logout', 'handle_logout', 'logout')
+ROUTES.add('GET', '/api/auth/verify', 'handle_verify_token', 'verify_token')
+ROUTES.add('POST', '/api/lobbies/<lobby_id>/join', 'handle_lobby_join', 'lobby_join')
+ROUTES.fallback('GET', 'handle_pes_default')
+ROUTES.fallback('POST', 'handle_pes_default')
+ROUTES.fallback('OPTIONS', 'handle_preflight')
+
 def main():
     """Main server entry point for PES GAME"""
-    print("🎮 PES 2021 ENHANCED SERVER V2 - FOR REAL PES GAME")
-    print("PHASE 6: Protocol Expansion - PES 2021 Game Integration")
-    print("=" * 60)
-    print()
+    parser = argparse.ArgumentParser(description="PES 2021 Enhanced Server V2")
+    parser.add_argument('--port', type=int, default=80, help="listen port (PES expects 80)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of SO_REUSEPORT worker processes (Linux only)")
+    parser.add_argument('--drain-timeout', type=float, default=10.0,
+                        help="seconds to let in-flight requests finish on shutdown/reload")
+    parser.add_argument('--rate-limit', type=float, default=20.0,
+                        help="requests/s per client IP (bursts of twice that; PES info files have their own "
+                             "budget); 0 disables")
+    parser.add_argument('--max-in-flight', type=int, default=64,
+                        help="requests handled at once per process before shedding with 503; 0 disables")
+    parser.add_argument('--inherit-fd', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--ready-fd', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--check-lobbies', action='store_true',
+                        help="verify lobby occupancy counters against rosters, rebuild wrong ones and exit")
+    args = parser.parse_args()
+    ADMISSION.configure(rate=args.rate_limit, burst=max(1, 2 * args.rate_limit), max_in_flight=args.max_in_flight)
+    
+    if args.check_lobbies:
+        setup_logging(queued=False)
+        mismatches = PESDatabase().check_lobby_aggregates(repair=True)
+        for lobby_id, stored, actual in mismatches:
+            print(f"🔧 Lobby {lobby_id}: players/ready/team1/team2 {stored} → {actual}")
+        print(f"✅ Lobby counters consistent ({len(mismatches)} rebuilt)")
+        return
+    
+    if args.inherit_fd is None:
+        print("🎮 PES 2021 ENHANCED SERVER V2 - FOR REAL PES GAME")
+        print("PHASE 6: Protocol Expansion - PES 2021 Game Integration")
+        print("=" * 60)
+        print()
     
+    if args.workers > 1:
+        if WorkerSupervisor.supported():
+            setup_logging(queued=False)
+            print(f"🎮 PES Game Server: {args.workers} workers sharing 0.0.0.0:{args.port}")
+            WorkerSupervisor(args.workers, port=args.port, drain_timeout=args.drain_timeout).run()
+            return
+        print("⚠️ Multi-worker mode needs fork and SO_REUSEPORT, running a single process")
+    
+    log_listener = setup_logging()
+    database_started = time.perf_counter()
     database = PESDatabase()
+    recovered = len(database.start_match_service().get_statuses())
+    if recovered:
+        logger.info("⚽ Re-armed timeouts for %d active matches", recovered)
+    
+    database.start_lobby_sync()
+    
+    # Warm the lobby cache before the first PES client is served
+    warmup_started = time.perf_counter()
+    database.get_lobbies_enhanced()
+    server = GracefulHTTPServer(('0.0.0.0', args.port), make_handler(database), listen_fd=args.inherit_fd)
+    ready = time.perf_counter()
+    logger.info("⏱️ Cold start %.1f ms: imports %.1f ms, database %.1f ms, lobby warm-up %.1f ms",
+                (ready - STARTED) * 1000, (IMPORTED - STARTED) * 1000,
+                (warmup_started - database_started) * 1000, (ready - warmup_started) * 1000)
     
-    def create_handler():
-        class Handler(EnhancedPESGameHandler):
-            def __init__(self, *args, **kwargs):
-                super().__init__(*args, database=database, **kwargs)
-        return Handler
-    
-    server = HTTPServer(('0.0.0.0', 80), create_handler())
-    
-    print(f"🎮 PES Game Server listening on 0.0.0.0:80")
-    print(f"🗄️ Database: Enhanced SQLite with 11vs11 support")
-    print(f"🎯 PES Message Interception: ACTIVE")
-    print(f"💡 Critical PES Endpoints:")
-    print(f"   - /XME994-E1/info/info_en.txt")
-    print(f"   - /XME994-E1/info/info_us.txt")
-    print()
-    print("🎮 READY FOR REAL PES 2021 GAME CONNECTIONS!")
-    print("=" * 60)
-    print()
+    if args.ready_fd is not None:
+        # Reloaded process: tell the old one we are serving, it will drain and exit
+        os.write(args.ready_fd, b'1')
+        os.close(args.ready_fd)
+        logger.info("🔄 Took over listening socket from previous server (pid %d)", os.getppid())
+    else:
+        print(f"🎮 PES Game Server listening on 0.0.0.0:{args.port}")
+        print(f"🗄️ Database: Enhanced SQLite with 11vs11 support")
+        print(f"🎯 PES Message Interception: ACTIVE")
+        print(f"💡 Critical PES Endpoints:")
+        print(f"   - /XME994-E1/info/info_en.txt")
+        print(f"   - /XME994-E1/info/info_us.txt")
+        print(f"📈 Metrics: /api/metrics (profiler: POST /api/metrics/profiler, admin only)")
+        if hasattr(signal, 'SIGHUP'):
+            print(f"🔄 Graceful reload: kill -HUP {os.getpid()}")
+        print()
+        print("🎮 READY FOR REAL PES 2021 GAME CONNECTIONS!")
+        print("=" * 60)
+        print()
     
     try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        print("\n⏹️ PES Game Server shutdown requested")
-        server.shutdown()
+        serve_until_signalled(server, args.drain_timeout, on_reload=lambda: spawn_replacement(server, args))
         print("✅ PES 2021 Enhanced Server V2 (Game Version) stopped")
     except Exception as e:
         print(f"❌ Server error: {e}")
+    finally:
+        database.auth.shutdown()
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+PES 2021 Admission Control
+Token-bucket rate limits per client IP and per session token, plus a
+global in-flight cap that sheds load before the server falls over
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+PRIORITY_PREFIXES = ('/XME994-E1/info/',)
+
+
+class TokenBucketTable:
+    """One token bucket per key, ``rate`` tokens/s up to ``burst``.
+
+    Buckets are kept in least-recently-used order, so expiry only ever
+    looks at the front: a bucket idle long enough to have refilled is
+    indistinguishable from a new one and is dropped. ``max_entries`` caps
+    the table when many distinct clients show up at once. Every operation
+    is O(1) amortized and memory does not grow with the number of IPs seen.
+    """
+
+    def __init__(self, rate, burst, max_entries=10000):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_entries = max_entries
+        self.idle_ttl = self.burst / self.rate if self.rate > 0 else 0.0
+        self.buckets = OrderedDict()
+
+    def acquire(self, key, now, cost=1.0):
+        """Take ``cost`` tokens; returns 0.0 when allowed, otherwise seconds until it would be"""
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now]
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        self.expire(now)
+
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0.0
+        return (cost - bucket[0]) / self.rate
+
+    def expire(self, now):
+        buckets = self.buckets
+        while buckets:
+            key, (_, last) = next(iter(buckets.items()))
+            if len(buckets) <= self.max_entries and now - last < self.idle_ttl:
+                break
+            del buckets[key]
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+class AdmissionController:
+    """Decides per request: admit, 429 (client over its rate) or 503 (server full).
+
+    Two classes of traffic. PES info files (``PRIORITY_PREFIXES``) have
+    their own per-IP buckets, so an API loop from the same machine cannot
+    use up the game's budget, and they may use the ``priority_reserve``
+    in-flight slots that other requests are not allowed to take. All other
+    requests are charged to the client IP, and also to the session token
+    when there is one. Limits are per server process.
+    """
+
+    def __init__(self, rate=20.0, burst=40, session_rate=10.0, session_burst=20, priority_rate=5.0,
+                 priority_burst=20, max_in_flight=64, priority_reserve=8, max_entries=10000):
+        self.configure(rate, burst, session_rate, session_burst, priority_rate, priority_burst, max_in_flight,
+                       priority_reserve, max_entries)
+
+    def configure(self, rate=20.0, burst=40, session_rate=10.0, session_burst=20, priority_rate=5.0,
+                  priority_burst=20, max_in_flight=64, priority_reserve=8, max_entries=10000):
+        """(Re)build the limiter; ``rate=0`` disables the rate limits, ``max_in_flight=0`` the in-flight cap"""
+        self.lock = threading.Lock()
+        self.enabled = rate > 0
+        self.per_ip = TokenBucketTable(rate, burst, max_entries) if rate > 0 else None
+        self.per_session = TokenBucketTable(session_rate, session_burst, max_entries) if rate > 0 else None
+        self.priority = TokenBucketTable(priority_rate, priority_burst, max_entries) if rate > 0 else None
+        self.max_in_flight = max_in_flight
+        # Small caps keep at least three quarters of the slots for regular requests
+        self.priority_reserve = min(priority_reserve, max_in_flight // 4)
+        self.in_flight = 0
+        self.rejected = {429: 0, 503: 0}
+
+    @staticmethod
+    def is_priority(path):
+        return path.startswith(PRIORITY_PREFIXES)
+
+    def admit(self, client_ip, path, token=None):
+        """Returns ``(None, 0)`` when admitted (call ``release`` afterwards), else ``(status, retry_after)``"""
+        priority = self.is_priority(path)
+        now = time.monotonic()
+        with self.lock:
+            limit = self.max_in_flight if priority else self.max_in_flight - self.priority_reserve
+            if self.max_in_flight and self.in_flight >= limit:
+                self.rejected[503] += 1
+                return 503, 1
+
+            if self.enabled:
+                if priority:
+                    wait = self.priority.acquire(client_ip, now)
+                else:
+                    wait = self.per_ip.acquire(client_ip, now)
+                    if not wait and token:
+                        wait = self.per_session.acquire(token, now)
+                if wait:
+                    self.rejected[429] += 1
+                    return 429, max(1, math.ceil(wait))
+
+            self.in_flight += 1
+            return None, 0
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'in_flight': self.in_flight,
+                'tracked_clients': len(self.per_ip) + len(self.priority) if self.enabled else 0,
+                'tracked_sessions': len(self.per_session) if self.enabled else 0,
+                'rejected_429': self.rejected[429],
+                'rejected_503': self.rejected[503],
+            }
+
+    def render(self):
+        """Prometheus lines for /api/metrics"""
+        stats = self.stats()
+        return [
+            '# HELP pes_admission_in_flight Requests currently being handled',
+            '# TYPE pes_admission_in_flight gauge',
+            f"pes_admission_in_flight {stats['in_flight']}",
+            '# HELP pes_admission_tracked_keys Live token buckets',
+            '# TYPE pes_admission_tracked_keys gauge',
+            f"pes_admission_tracked_keys{{kind=\"client\"}} {stats['tracked_clients']}",
+            f"pes_admission_tracked_keys{{kind=\"session\"}} {stats['tracked_sessions']}",
+            '# HELP pes_admission_rejected_total Requests refused by admission control',
+            '# TYPE pes_admission_rejected_total counter',
+            f"pes_admission_rejected_total{{status=\"429\"}} {stats['rejected_429']}",
+            f"pes_admission_rejected_total{{status=\"503\"}} {stats['rejected_503']}",
+        ]
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+PES 2021 Authentication
+Player login, session tokens and private lobby passwords
+Password hashing runs in a process pool so request threads never block on it
+Hashing and pool modules are imported on first use, off the server's startup path
+"""
+
+import argparse
+import base64
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+HASH_ALGORITHM = 'pbkdf2_sha256'
+HASH_ITERATIONS = 260000
+SESSION_TTL = 24 * 3600
+HASH_TIMEOUT = 10.0
+
+
+def hash_password(password, iterations=HASH_ITERATIONS, salt=None):
+    """``pbkdf2_sha256$<iterations>$<salt>$<hash>`` (runs in a pool worker)"""
+    import hashlib
+    import secrets
+
+    salt = salt or secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('ascii'), iterations)
+    return f"{HASH_ALGORITHM}${iterations}${salt}${base64.b64encode(digest).decode('ascii')}"
+
+
+def verify_password(password, encoded):
+    """Constant-time check of ``password`` against a stored hash; unknown formats never match"""
+    import hmac
+
+    try:
+        algorithm, iterations, salt, _ = encoded.split('$')
+        iterations = int(iterations)
+    except (AttributeError, ValueError):
+        return False
+    if algorithm != HASH_ALGORITHM:
+        return False
+    return hmac.compare_digest(hash_password(password, iterations, salt), encoded)
+
+
+def needs_rehash(encoded):
+    """Stored with fewer iterations than we use today"""
+    try:
+        return int(encoded.split('$')[1]) < HASH_ITERATIONS
+    except (AttributeError, IndexError, ValueError):
+        return True
+
+
+# Hash of a random throwaway password: checked when the username does not exist,
+# so unknown and known usernames take the same time
+DUMMY_HASH = 'pbkdf2_sha256$260000$4d80c5575dd7eafea1363bab2fdd8ec6$JVJkKDg33s/1Hr8nbU4vGgxhufu9r1aoNEDjAb1jvVA='
+
+
+class AuthenticationError(Exception):
+    """Wrong credentials, or not allowed to do this; ``status`` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=401):
+        super().__init__(message)
+        self.status = status
+
+
+class TokenCache:
+    """Verified session tokens → player id, LRU-bounded, each entry valid for ``ttl`` seconds.
+
+    Entries never outlive the session itself (``expires_at``). ``revoke``
+    only reaches this process; other server workers drop a revoked token
+    when its entry expires, so ``ttl`` bounds how long that can take.
+    """
+
+    def __init__(self, ttl=60.0, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, token):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                return None
+            player_id, expires_at = entry
+            if expires_at <= now:
+                del self.entries[token]
+                return None
+            self.entries.move_to_end(token)
+            return player_id
+
+    def put(self, token, player_id, session_expires_at):
+        with self.lock:
+            self.entries[token] = (player_id, min(time.time() + self.ttl, session_expires_at))
+            self.entries.move_to_end(token)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def revoke(self, token):
+        with self.lock:
+            return self.entries.pop(token, None) is not None
+
+    def revoke_player(self, player_id):
+        with self.lock:
+            for token in [token for token, (owner, _) in self.entries.items() if owner == player_id]:
+                del self.entries[token]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class AuthService:
+    """Logins, token checks and private lobby joins against the server database.
+
+    One session per player (``player_sessions`` is keyed by player): a new
+    login replaces the previous token. The hashing pool is started on first
+    use with the spawn method, which is safe from a threaded server and
+    works the same on Windows.
+    """
+
+    def __init__(self, db_path, workers=2, session_ttl=SESSION_TTL, cache_ttl=60.0, cache_size=10000):
+        self.db_path = db_path
+        self.workers = workers
+        self.session_ttl = session_ttl
+        self.tokens = TokenCache(cache_ttl, cache_size)
+        self.pool = None
+        self.pool_lock = threading.Lock()
+
+    def get_connection(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def run_hasher(self, function, *args):
+        """Run a hashing function in the process pool and wait for it"""
+        if self.pool is None:
+            with self.pool_lock:
+                if self.pool is None:
+                    import multiprocessing
+                    from concurrent.futures import ProcessPoolExecutor
+
+                    self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.pool.submit(function, *args).result(timeout=HASH_TIMEOUT)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def set_password(self, username, password):
+        encoded = self.run_hasher(hash_password, password)
+        conn = self.get_connection()
+        try:
+            with conn:
+                updated = conn.execute('UPDATE players SET password_hash = ? WHERE username = ?',
+                                       (encoded, username)).rowcount
+        finally:
+            conn.close()
+        if not updated:
+            raise KeyError(username)
+
+    def set_lobby_password(self, lobby_id, password):
+        """Make a local lobby private (``password=None`` opens it again)"""
+        encoded = self.run_hasher(hash_password, password) if password else None
+        conn = self.get_connection()
+        try:
+            with conn:
+                updated = conn.execute('UPDATE lobbies SET password_hash = ? WHERE id = ?',
+                                       (encoded, lobby_id)).rowcount
+        finally:
+            conn.close()
+        if not updated:
+            raise KeyError(lobby_id)
+
+    def login(self, username, password, ip_address=None):
+        """Check the password and open a session; returns ``(player_id, token, expires_in)``"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute('SELECT id, password_hash FROM players WHERE username = ?', (username,)).fetchone()
+        finally:
+            conn.close()
+        player_id, encoded = row if row else (None, None)
+        if not self.run_hasher(verify_password, password, encoded or DUMMY_HASH) or not encoded:
+            raise AuthenticationError('Invalid username or password')
+
+        import secrets
+
+        token = secrets.token_urlsafe(32)
+        rehashed = self.run_hasher(hash_password, password) if needs_rehash(encoded) else encoded
+        conn = self.get_connection()
+        try:
+            with conn:
+                conn.execute('''
+                    UPDATE players SET session_token = ?, password_hash = ?, last_login = CURRENT_TIMESTAMP,
+                                       ip_address = COALESCE(?, ip_address)
+                    WHERE id = ?
+                ''', (token, rehashed, ip_address, player_id))
+                conn.execute('''
+                    INSERT INTO player_sessions (player_id, session_token, ip_address, created_at, last_heartbeat,
+                                                 status)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, 'online')
+                    ON CONFLICT(player_id) DO UPDATE SET
+                        session_token = excluded.session_token, ip_address = excluded.ip_address,
+                        created_at = excluded.created_at, last_heartbeat = excluded.last_heartbeat,
+                        status = 'online'
+                ''', (player_id, token, ip_address))
+        finally:
+            conn.close()
+        # The previous session of this player is gone
+        self.tokens.revoke_player(player_id)
+        self.tokens.put(token, player_id, time.time() + self.session_ttl)
+        return player_id, token, self.session_ttl
+
+    def verify_token(self, token):
+        """Player id for a live session token, or None (cached; the database is only hit on a miss)"""
+        if not token:
+            return None
+        player_id = self.tokens.get(token)
+        if player_id is not None:
+            return player_id
+
+        conn = self.get_connection()
+        try:
+            row = conn.execute('''
+                SELECT player_id, CAST(strftime('%s', created_at) AS INTEGER) FROM player_sessions
+                WHERE session_token = ? AND status != 'offline'
+            ''', (token,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        expires_at = (row[1] or 0) + self.session_ttl
+        if expires_at <= time.time():
+            return None
+        self.tokens.put(token, row[0], expires_at)
+        return row[0]
+
+    def logout(self, token):
+        self.tokens.revoke(token)
+        conn = self.get_connection()
+        try:
+            with conn:
+                row = conn.execute('SELECT player_id FROM player_sessions WHERE session_token = ?',
+                                   (token,)).fetchone()
+                if row:
+                    conn.execute("UPDATE player_sessions SET status = 'offline', session_token = NULL "
+                                 "WHERE player_id = ?", (row[0],))
+                    conn.execute('UPDATE players SET session_token = NULL WHERE id = ?', (row[0],))
+        finally:
+            conn.close()
+        return row is not None
+
+    def join_lobby(self, lobby_id, player_id, password=None, team=0, position='any'):
+        """Add a player to a lobby, checking its password when it is private"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute('SELECT password_hash, current_players, max_players, status, has_password '
+                               'FROM lobbies WHERE id = ?', (lobby_id,)).fetchone()
+            if row is None or row[3] == 'closed':
+                raise AuthenticationError(f'Lobby {lobby_id} not found', 404)
+            encoded, current_players, max_players, _, private = row
+            if private and not encoded:
+                # Private on WordPress: the password can only be checked there
+                raise AuthenticationError(f'Lobby {lobby_id} is private, join it on the website', 403)
+            if encoded and not (password and self.run_hasher(verify_password, password, encoded)):
+                raise AuthenticationError('Wrong lobby password', 403)
+
+            with conn:
+                joined = conn.execute('''
+                    INSERT INTO lobby_players (lobby_id, player_id, team, position, local_join)
+                    SELECT ?, ?, ?, ?, 1
+                    WHERE (SELECT COALESCE(current_players, 0) < COALESCE(max_players, 22) FROM lobbies WHERE id = ?)
+                       OR EXISTS (SELECT 1 FROM lobby_players WHERE lobby_id = ? AND player_id = ?)
+                    ON CONFLICT(lobby_id, player_id) DO UPDATE SET team = excluded.team, position = excluded.position
+                ''', (lobby_id, player_id, team, position, lobby_id, lobby_id, player_id)).rowcount
+                if joined:
+                    conn.execute('UPDATE player_sessions SET current_lobby = ? WHERE player_id = ?',
+                                 (lobby_id, player_id))
+        finally:
+            conn.close()
+        if not joined:
+            raise AuthenticationError(f'Lobby {lobby_id} is full ({current_players}/{max_players})', 409)
+
+    def leave_lobby(self, lobby_id, player_id):
+        """Undo a local join (rows WordPress lists are left to the lobby sync)"""
+        conn = self.get_connection()
+        try:
+            with conn:
+                if conn.execute('DELETE FROM lobby_players WHERE lobby_id = ? AND player_id = ? AND local_join = 1',
+                                (lobby_id, player_id)).rowcount:
+                    conn.execute('UPDATE player_sessions SET current_lobby = NULL '
+                                 'WHERE player_id = ? AND current_lobby = ?', (player_id, lobby_id))
+        finally:
+            conn.close()
+
+
+def main():
+    """Set a player or lobby password: pes_auth.py (--player USERNAME | --lobby LOBBY_ID) [db_path]"""
+    parser = argparse.ArgumentParser(description="Set PES player / private lobby passwords")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--player')
+    target.add_argument('--lobby')
+    parser.add_argument('db_path', nargs='?', default='pes_server.db')
+    args = parser.parse_args()
+
+    import getpass
+
+    auth = AuthService(args.db_path)
+    password = getpass.getpass('🔑 New password (empty = public lobby): ' if args.lobby else '🔑 New password: ')
+    try:
+        if args.player:
+            auth.set_password(args.player, password)
+            print(f"✅ Password set for player {args.player}")
+        else:
+            auth.set_lobby_password(args.lobby, password or None)
+            print(f"✅ Lobby {args.lobby} is now {'private' if password else 'public'}")
+    except KeyError as e:
+        print(f"❌ Not found: {e}")
+    finally:
+        auth.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,50 +5,154 @@ Uses PES 2019 data to understand patterns and create complete redirect
 """
 
 import os
+import sys
+import ipaddress
+import shutil
 import subprocess
 import socket
-import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from pes_registry import load_registry
+
+
+class HostsFileManager:
+    """Owns one marked section of the hosts file and rewrites it only when it changes"""
+    
+    BEGIN_MARKER = "# BEGIN PES Custom Server Redirect"
+    END_MARKER = "# END PES Custom Server Redirect"
+    # Blocks appended by older versions of this tool on every run
+    LEGACY_BEGIN = "# PES 2021 Custom Server Redirect - Complete"
+    LEGACY_END = "# End PES Custom Server Redirect"
+    
+    def __init__(self, hosts_path=None):
+        self.hosts_path = hosts_path or self.default_hosts_path()
+    
+    @staticmethod
+    def default_hosts_path():
+        if sys.platform == 'win32':
+            return os.path.join(os.environ.get('SystemRoot', r'C:\Windows'), 'System32', 'drivers', 'etc', 'hosts')
+        return '/etc/hosts'
+    
+    def read(self):
+        try:
+            with open(self.hosts_path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return ""
+    
+    def parse(self, text):
+        """Split hosts text into (lines outside our section, lines inside it, legacy blocks found)"""
+        outside, managed = [], []
+        current = None
+        legacy_blocks = 0
+        for line in text.splitlines():
+            marker = line.strip()
+            if current is None and marker in (self.BEGIN_MARKER, self.LEGACY_BEGIN):
+                current = self.END_MARKER if marker == self.BEGIN_MARKER else self.LEGACY_END
+                legacy_blocks += marker == self.LEGACY_BEGIN
+            elif current is not None and marker == current:
+                current = None
+            elif current == self.END_MARKER:
+                managed.append(line)
+            elif current is None:
+                outside.append(line)
+        
+        # Legacy blocks started with a blank line; drop what they left behind
+        while legacy_blocks and outside and not outside[-1].strip():
+            outside.pop()
+        return outside, managed, legacy_blocks
+    
+    def apply(self, section_lines):
+        """Make the managed section equal ``section_lines``; returns True if the file changed"""
+        outside, managed, legacy_blocks = self.parse(self.read())
+        if managed == section_lines and not legacy_blocks:
+            return False
+        
+        lines = outside + [self.BEGIN_MARKER] + section_lines + [self.END_MARKER] if section_lines else outside
+        self.write('\n'.join(lines) + '\n')
+        return True
+    
+    def remove(self):
+        """Drop the managed section (and legacy blocks); returns True if the file changed"""
+        return self.apply([])
+    
+    def write(self, content):
+        """Atomic replace: write a temp file next to the hosts file, then rename over it"""
+        directory = os.path.dirname(os.path.abspath(self.hosts_path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.hosts-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(content)
+            if os.path.exists(self.hosts_path):
+                shutil.copymode(self.hosts_path, tmp_path)
+            os.replace(tmp_path, self.hosts_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    
+    @staticmethod
+    def flush_dns_cache():
+        """Flush the OS resolver cache; returns False where there is nothing to flush"""
+        if sys.platform == 'win32':
+            command = ['ipconfig', '/flushdns']
+        elif shutil.which('resolvectl'):
+            command = ['resolvectl', 'flush-caches']
+        else:
+            return False
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+        except (OSError, subprocess.CalledProcessError):
+            return False
+        return True
+
+
+def resolve_all(domains, timeout=2.0, max_workers=32):
+    """Resolve domains concurrently; maps domain → IPv4 address, or an error/'timeout' string"""
+    results = {}
+    if not domains:
+        return results
+    
+    def resolve(domain):
+        return socket.getaddrinfo(domain, None, socket.AF_INET)[0][4][0]
+    
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(domains)))
+    try:
+        futures = {executor.submit(resolve, domain): domain for domain in domains}
+        done, _ = wait(futures, timeout=timeout)
+        for future, domain in futures.items():
+            if future not in done:
+                results[domain] = 'timeout'
+            elif future.exception() is not None:
+                results[domain] = f"error: {future.exception()}"
+            else:
+                results[domain] = future.result()
+    finally:
+        # Resolver calls cannot be interrupted; do not wait for stragglers
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
 
 class PESCompleteRedirect:
     """Complete redirection system for PES to custom server"""
     
-    def __init__(self):
-        # PES 2019 server data (found by user) - this gives us patterns!
-        self.pes2019_ips = [
-            '34.209.179.167', '34.218.118.205', '35.165.128.235', 
-            '35.197.63.107', '35.197.250.120', '35.198.57.112',
-            '35.199.30.185', '35.204.253.149', '35.234.95.118',
-            '35.240.164.139', '52.17.173.247', '52.18.94.153',
-            '52.49.218.253', '52.208.162.2', '52.208.190.137',
-            '54.214.158.254', '72.247.153.153', '104.125.7.33',
-            '210.148.52.94', '210.148.52.95'
-        ]
+    def __init__(self, hosts_path=None):
+        self.hosts = HostsFileManager(hosts_path)
         
-        self.pes2019_domains = [
-            'srv01.codefusion.technology',
-            'srv02.codefusion.technology', 
-            'srv03.codefusion.technology',
-            'support.codefusion.technology',
-            'ntl.service.konami.net',
-            'ntleu.service.konami.net',
-            'pes19-x64-gate.cs.konami.net',
-            'legal.konami.com',
-            'pes2019-dl.akamaized.net',
-            'pes19-x64-stun.cs.konami.net'
-        ]
+        # All domains/IPs live in pes_registry.json (shared with the interceptor and server)
+        self.registry = load_registry()
+        
+        # PES 2019 server data (found by user) - this gives us patterns!
+        self.pes2019_ips = self.registry.ips('pes2019')
+        self.pes2019_domains = self.registry.domains('pes2019')
         
         # PES 2021 equivalents (discovered from our analysis)
-        self.pes2021_domains = [
-            'pes21-x64-gate.cs.konami.net',
-            'pes21-x64-stun.cs.konami.net',
-            'info.service.konami.net',
-            'cs.konami.net',
-            'ntl.service.konami.net',
-            'ntleu.service.konami.net'
-        ]
+        self.pes2021_domains = self.registry.domains('pes2021')
         
         # Our server endpoints
-        self.local_server_ip = '127.0.0.1'
+        self.local_server_ip = self.registry.local_server_ip
         self.server_ports = {
             'http': 80,
             'https': 443,
@@ -58,72 +162,43 @@ class PESCompleteRedirect:
         }
     
     def create_complete_hosts_redirect(self):
-        """Create complete hosts file redirect using all discovered data"""
+        """Build the hosts section lines for every discovered PES domain"""
         print("🔧 CREATING COMPLETE HOSTS REDIRECT")
         print("=" * 60)
         
-        # Read current hosts file
-        hosts_path = r'C:\Windows\System32\drivers\etc\hosts'
-        
-        try:
-            with open(hosts_path, 'r', encoding='utf-8') as f:
-                current_hosts = f.read()
-        except:
-            current_hosts = ""
-        
-        # Build new hosts entries
-        new_entries = []
-        new_entries.append("\n# PES 2021 Custom Server Redirect - Complete")
-        new_entries.append(f"# Generated: {time.strftime('%Y-%m-%d %H:%M:%S')}")
-        new_entries.append("")
-        
-        # Redirect all PES 2021 domains
-        new_entries.append("# PES 2021 Game Servers")
-        for domain in self.pes2021_domains:
-            new_entries.append(f"{self.local_server_ip} {domain}")
-        
-        # Also redirect PES 2019 domains (in case game uses them)
-        new_entries.append("")
-        new_entries.append("# PES 2019 Compatibility")
-        for domain in self.pes2019_domains:
-            new_entries.append(f"{self.local_server_ip} {domain}")
-        
-        # Add AWS endpoints from our analysis
-        new_entries.append("")
-        new_entries.append("# AWS Endpoints")
-        new_entries.append(f"{self.local_server_ip} ec2-35-174-175-11.compute-1.amazonaws.com")
-        new_entries.append(f"{self.local_server_ip} server-18-244-79-54.sof50.r.cloudfront.net")
-        
-        # Add discovered endpoints
-        new_entries.append("")
-        new_entries.append("# Additional Game Endpoints")
-        additional_domains = [
-            "cf-revalidation-1750743123.eu-west-1.elb.amazonaws.com",
-            "pes21-dl.akamaized.net",
-            "pes2021-dl.akamaized.net",
-            "codefusion.technology",
-            "legal.konami.com"
+        groups = [
+            ('pes2021', "# PES 2021 Game Servers"),
+            ('pes2019', "# PES 2019 Compatibility"),
+            ('aws', "# AWS Endpoints"),
+            ('additional', "# Additional Game Endpoints"),
         ]
+        # Any other group added to the registry is redirected too
+        groups += [(group, f"# {group}") for group in self.registry.config.get('domains', {})
+                   if group not in dict(groups)]
         
-        for domain in additional_domains:
-            new_entries.append(f"{self.local_server_ip} {domain}")
-        
-        new_entries.append("")
-        new_entries.append("# End PES Custom Server Redirect")
-        new_entries.append("")
-        
-        # Combine with existing hosts
-        new_hosts_content = current_hosts + '\n'.join(new_entries)
+        new_entries = []
+        seen = set()
+        for group, title in groups:
+            # A domain is only listed once even if it appears in several groups
+            domains = [domain for domain in self.registry.domains(group) if domain not in seen]
+            if not domains:
+                continue
+            if new_entries:
+                new_entries.append("")
+            new_entries.append(title)
+            for domain in domains:
+                new_entries.append(f"{self.local_server_ip} {domain}")
+                seen.add(domain)
         
         # Show what we're adding
-        print("📝 ADDING THESE REDIRECTS:")
+        print("📝 REDIRECT ENTRIES:")
         for entry in new_entries:
             if entry.strip() and not entry.startswith('#'):
                 print(f"   {entry}")
         
-        print(f"\n💾 Total redirects: {len([e for e in new_entries if e.strip() and not e.startswith('#')])}")
+        print(f"\n💾 Total redirects: {len(seen)}")
         
-        return new_hosts_content, hosts_path
+        return new_entries
     
     def create_ip_route_redirects(self):
         """Create IP-level redirects for discovered IPs"""
@@ -134,16 +209,11 @@ class PESCompleteRedirect:
         route_commands = []
         
         # Redirect known PES 2019 IPs (they might be reused in PES 2021)
-        important_ips = [
-            '35.197.63.107',    # Google Cloud (similar to our 35.174.175.11)
-            '35.234.95.118',    # Google Cloud
-            '52.208.162.2',     # AWS Ireland
-            '54.214.158.254',   # AWS Oregon
-        ]
-        
-        for ip in important_ips:
+        for entry in self.registry.ips('important'):
+            network = ipaddress.ip_network(entry, strict=False)
             # Route traffic to our local server
-            route_commands.append(f'route add {ip} mask 255.255.255.255 {self.local_server_ip} metric 1')
+            route_commands.append(f'route add {network.network_address} mask {network.netmask} '
+                                  f'{self.local_server_ip} metric 1')
         
         return route_commands
     
@@ -153,19 +223,21 @@ class PESCompleteRedirect:
         print("=" * 80)
         
         try:
-            # 1. Create hosts redirect
-            new_hosts, hosts_path = self.create_complete_hosts_redirect()
-            
-            # Write hosts file
-            with open(hosts_path, 'w', encoding='utf-8') as f:
-                f.write(new_hosts)
-            
-            print("✅ Hosts file updated successfully")
+            # 1. Create hosts redirect (only rewrites the file if our section changed)
+            section = self.create_complete_hosts_redirect()
+            changed = self.hosts.apply(section)
             
-            # 2. Flush DNS cache
-            print("\n🔄 Flushing DNS cache...")
-            subprocess.run(['ipconfig', '/flushdns'], check=True, capture_output=True)
-            print("✅ DNS cache flushed")
+            if changed:
+                print(f"✅ Hosts file updated successfully: {self.hosts.hosts_path}")
+                
+                # 2. Flush DNS cache
+                print("\n🔄 Flushing DNS cache...")
+                if self.hosts.flush_dns_cache():
+                    print("✅ DNS cache flushed")
+                else:
+                    print("💡 No DNS cache to flush on this system")
+            else:
+                print(f"✅ Hosts file already up to date: {self.hosts.hosts_path}")
             
             # 3. Create route redirects (optional)
             route_commands = self.create_ip_route_redirects()
@@ -182,15 +254,15 @@ class PESCompleteRedirect:
                 'cs.konami.net'
             ]
             
+            results = resolve_all(test_domains)
             for domain in test_domains:
-                try:
-                    ip = socket.gethostbyname(domain)
-                    if ip == self.local_server_ip:
-                        print(f"   ✅ {domain} → {ip}")
-                    else:
-                        print(f"   ❌ {domain} → {ip} (should be {self.local_server_ip})")
-                except Exception as e:
-                    print(f"   ⚠️ {domain} → Error: {e}")
+                ip = results[domain]
+                if ip == self.local_server_ip:
+                    print(f"   ✅ {domain} → {ip}")
+                elif ip == 'timeout' or ip.startswith('error'):
+                    print(f"   ⚠️ {domain} → {ip}")
+                else:
+                    print(f"   ❌ {domain} → {ip} (should be {self.local_server_ip})")
             
             print("\n🎯 REDIRECT COMPLETE!")
             print("=" * 80)
@@ -215,7 +287,8 @@ def main():
     print("Using PES 2019 data patterns for maximum compatibility")
     print()
     
-    redirecter = PESCompleteRedirect()
+    # Optional argument: hosts file to manage (for testing against a copy)
+    redirecter = PESCompleteRedirect(sys.argv[1] if len(sys.argv) > 1 else None)
     
     if redirecter.apply_complete_redirect():
         print("\n✅ SUCCESS! Redirect system is active!")
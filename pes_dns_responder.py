@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+PES 2021 Embedded DNS Responder
+Answers PES domains from memory instead of rewriting the hosts file
+Everything else is forwarded to a real resolver with a TTL cache
+"""
+
+import argparse
+import asyncio
+import random
+import socket
+import struct
+import time
+from collections import Counter, OrderedDict
+
+from pes_registry import DomainSuffixTrie, load_registry
+
+TYPE_A = 1
+TYPE_AAAA = 28
+CLASS_IN = 1
+FLAG_QR = 0x8000
+FLAG_AA = 0x0400
+FLAG_RD = 0x0100
+FLAG_RA = 0x0080
+RCODE_FORMERR = 1
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+
+
+def read_name(data, offset):
+    """Decode a (possibly compressed) domain name; returns (name, offset after it)"""
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if jumps > 16:
+                raise ValueError("DNS name compression loop")
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            jumps += 1
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(data[offset:offset + length].decode('ascii', errors='replace'))
+        offset += length
+    return '.'.join(labels).lower(), end if end is not None else offset
+
+
+def encode_name(name):
+    """Encode a domain name without compression"""
+    out = bytearray()
+    for label in name.rstrip('.').split('.'):
+        if label:
+            out.append(len(label))
+            out += label.encode('ascii')
+    out.append(0)
+    return bytes(out)
+
+
+def parse_query(data):
+    """Return (txid, flags, qname, qtype, qclass, end of question) for a DNS query"""
+    if len(data) < 12:
+        raise ValueError("DNS packet too short")
+    txid, flags, qdcount = struct.unpack('!HHH', data[:6])
+    if qdcount != 1:
+        raise ValueError("only single-question queries are supported")
+    qname, offset = read_name(data, 12)
+    qtype, qclass = struct.unpack('!HH', data[offset:offset + 4])
+    return txid, flags, qname, qtype, qclass, offset + 4
+
+
+def min_answer_ttl(data):
+    """Smallest TTL among the answer records of a DNS response, or None"""
+    ancount = struct.unpack('!H', data[6:8])[0]
+    qdcount = struct.unpack('!H', data[4:6])[0]
+    offset = 12
+    for _ in range(qdcount):
+        _, offset = read_name(data, offset)
+        offset += 4
+    ttls = []
+    for _ in range(ancount):
+        _, offset = read_name(data, offset)
+        _, _, ttl, rdlength = struct.unpack('!HHIH', data[offset:offset + 10])
+        ttls.append(ttl)
+        offset += 10 + rdlength
+    return min(ttls) if ttls else None
+
+
+class RedirectTable:
+    """Name → IPv4 answers, decided by the PES registry's domain trie.
+
+    Names the registry knows (``registry.domain_group``) resolve to its
+    ``local_server_ip``, so the responder and every other tool agree on what
+    a PES name is. ``set`` adds overrides on top (exact or ``*.suffix``),
+    matched with the same DomainSuffixTrie rules and checked first.
+    """
+
+    def __init__(self, registry=None, entries=None):
+        self.registry = registry
+        self.entries = {}
+        self.overrides = DomainSuffixTrie()
+        for name, ip in (entries or {}).items():
+            self.set(name, ip)
+
+    def set(self, name, ip):
+        """Add or change an override; takes effect on the next query"""
+        socket.inet_aton(ip)
+        self.entries[name.lower().rstrip('.')] = ip
+        self.rebuild()
+
+    def remove(self, name):
+        self.entries.pop(name.lower().rstrip('.'), None)
+        self.rebuild()
+
+    def rebuild(self):
+        # Overrides change rarely; a fresh trie keeps lookups free of bookkeeping
+        overrides = DomainSuffixTrie()
+        for name, ip in self.entries.items():
+            overrides.insert(name, ip)
+        self.overrides = overrides
+
+    def lookup(self, name):
+        """IP for ``name``: an override first, then the registry's local server for PES names"""
+        ip = self.overrides.lookup(name)
+        if ip is None and self.registry is not None and self.registry.domain_group(name):
+            ip = self.registry.local_server_ip
+        return ip
+
+    def __len__(self):
+        return len(self.entries) + (len(self.registry.domains()) if self.registry is not None else 0)
+
+
+class UpstreamResolver(asyncio.DatagramProtocol):
+    """Shared UDP socket to the real resolver, matching replies by transaction id"""
+
+    def __init__(self):
+        self.transport = None
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 2:
+            return
+        future = self.pending.pop(struct.unpack('!H', data[:2])[0], None)
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self.pending.clear()
+
+    async def query(self, packet, timeout):
+        """Send ``packet`` with a fresh id; returns the reply carrying the original id"""
+        loop = asyncio.get_running_loop()
+        original_id = packet[:2]
+        upstream_id = random.randrange(0x10000)
+        while upstream_id in self.pending:
+            upstream_id = random.randrange(0x10000)
+        future = loop.create_future()
+        self.pending[upstream_id] = future
+        self.transport.sendto(struct.pack('!H', upstream_id) + packet[2:])
+        try:
+            reply = await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(upstream_id, None)
+        return original_id + reply[2:]
+
+
+class PESDNSResponder(asyncio.DatagramProtocol):
+    """Authoritative for redirected PES names, caching forwarder for the rest.
+
+    Forwarded replies live in an LRU cache of ``cache_size`` entries. Per-name
+    hit counts are kept only for redirected names, at most ``max_tracked_names``
+    of them, so random lookups cannot grow memory.
+    """
+
+    def __init__(self, table, upstream=('8.8.8.8', 53), answer_ttl=60,
+                 upstream_timeout=2.0, negative_ttl=30, cache_size=4096, max_tracked_names=1024):
+        self.table = table
+        self.upstream_addr = upstream
+        self.answer_ttl = answer_ttl
+        self.upstream_timeout = upstream_timeout
+        self.negative_ttl = negative_ttl
+        self.cache_size = cache_size
+        self.max_tracked_names = max_tracked_names
+        self.cache = OrderedDict()
+        self.hits = Counter()
+        self.stats = Counter()
+        self.transport = None
+        self.upstream = None
+        # The event loop only keeps weak references to tasks
+        self.tasks = set()
+
+    async def start(self, host='127.0.0.1', port=53):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=(host, port))
+        _, self.upstream = await loop.create_datagram_endpoint(UpstreamResolver,
+                                                               remote_addr=self.upstream_addr)
+        return self.transport.get_extra_info('sockname')
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+        if self.upstream is not None and self.upstream.transport is not None:
+            self.upstream.transport.close()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            txid, flags, qname, qtype, qclass, question_end = parse_query(data)
+        except (ValueError, IndexError, struct.error):
+            self.stats['malformed'] += 1
+            if len(data) >= 12:
+                self.transport.sendto(self.error_reply(data, RCODE_FORMERR), addr)
+            return
+
+        ip = self.table.lookup(qname) if qclass == CLASS_IN else None
+        if ip is not None:
+            self.stats['redirected'] += 1
+            if qname in self.hits or len(self.hits) < self.max_tracked_names:
+                self.hits[qname] += 1
+            self.transport.sendto(self.local_reply(data[:question_end], qtype, ip), addr)
+            return
+
+        key = (qname, qtype, qclass)
+        cached = self.cache.get(key)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                self.stats['cache_hits'] += 1
+                self.cache.move_to_end(key)
+                self.transport.sendto(data[:2] + cached[1][2:], addr)
+                return
+            del self.cache[key]
+
+        self.stats['forwarded'] += 1
+        task = asyncio.ensure_future(self.forward(data, addr, key))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def local_reply(self, question, qtype, ip):
+        """Authoritative answer for a redirected name (empty NOERROR for non-A types)"""
+        flags = struct.unpack('!H', question[2:4])[0]
+        answers = b''
+        if qtype == TYPE_A:
+            answers = (b'\xc0\x0c' + struct.pack('!HHIH', TYPE_A, CLASS_IN, self.answer_ttl, 4)
+                       + socket.inet_aton(ip))
+        header = struct.pack('!HHHHHH', struct.unpack('!H', question[:2])[0],
+                             FLAG_QR | FLAG_AA | FLAG_RA | (flags & FLAG_RD),
+                             1, 1 if answers else 0, 0, 0)
+        return header + question[12:] + answers
+
+    @staticmethod
+    def error_reply(data, rcode):
+        txid, flags = struct.unpack('!HH', data[:4])
+        return struct.pack('!HHHHHH', txid, FLAG_QR | FLAG_RA | (flags & FLAG_RD) | rcode, 0, 0, 0, 0)
+
+    async def forward(self, data, addr, key):
+        try:
+            reply = await self.upstream.query(data, self.upstream_timeout)
+        except (asyncio.TimeoutError, OSError):
+            self.stats['upstream_errors'] += 1
+            self.transport.sendto(self.error_reply(data, RCODE_SERVFAIL), addr)
+            return
+
+        try:
+            rcode = struct.unpack('!H', reply[2:4])[0] & 0x000F
+            ttl = min_answer_ttl(reply)
+        except (ValueError, IndexError, struct.error):
+            rcode, ttl = None, None
+        if ttl is None:
+            # Only real negative answers (NXDOMAIN, or NOERROR without records) are cached;
+            # SERVFAIL, REFUSED and unparseable replies are retried on the next query
+            ttl = self.negative_ttl if rcode in (0, RCODE_NXDOMAIN) else 0
+        if ttl > 0:
+            self.store(key, time.monotonic() + ttl, reply)
+        self.transport.sendto(reply, addr)
+
+    def store(self, key, expires, reply):
+        """Cache a reply, dropping the least recently used entry when full"""
+        cache = self.cache
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            while len(cache) >= self.cache_size:
+                cache.popitem(last=False)
+        cache[key] = (expires, reply)
+
+    def print_summary(self):
+        print("\n📊 DNS RESPONDER SUMMARY")
+        print("=" * 60)
+        for name, count in self.stats.most_common():
+            print(f"   {name}: {count}")
+        print("\n🔝 Most queried PES names:")
+        for name, count in self.hits.most_common(20):
+            print(f"   🎯 {name}: {count}")
+
+
+def build_redirect_table(registry=None):
+    """Redirect table answering every domain (and wildcard) in the PES registry"""
+    return RedirectTable(registry or load_registry())
+
+
+def default_upstream():
+    """First nameserver from resolv.conf that is not ourselves, else a public resolver"""
+    try:
+        with open('/etc/resolv.conf', 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == 'nameserver' and not parts[1].startswith('127.'):
+                    return parts[1]
+    except OSError:
+        pass
+    return '8.8.8.8'
+
+
+async def serve(args):
+    table = build_redirect_table()
+    for wildcard in args.wildcard:
+        table.set(wildcard, table.registry.local_server_ip)
+    responder = PESDNSResponder(table, upstream=(args.upstream, 53))
+    host, port = (await responder.start(args.host, args.port))[:2]
+
+    print(f"🎯 Answering {len(table)} PES names from memory")
+    print(f"🌐 Forwarding everything else to {args.upstream}:53")
+    print(f"📡 Listening on {host}:{port} (UDP)")
+    print("Point the network adapter's DNS server at this address, then start PES 2021")
+    print("Press Ctrl+C to stop")
+    print()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        responder.close()
+        responder.print_summary()
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="PES 2021 embedded DNS responder")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=53)
+    parser.add_argument('--upstream', default=default_upstream(), help="resolver for non-PES names")
+    parser.add_argument('--wildcard', action='append', default=[],
+                        help="extra wildcard redirect, e.g. '*.konami.net' (repeatable)")
+    args = parser.parse_args()
+
+    print("🔥 PES 2021 EMBEDDED DNS RESPONDER")
+    print("=" * 60)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("\n⏹️ DNS responder stopped")
+    except PermissionError:
+        print(f"❌ Permission denied binding port {args.port}! Run as Administrator!")
+
+
+if __name__ == "__main__":
+    main()
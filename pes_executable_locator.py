@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+PES 2021 Executable Locator
+Finds PES2021.exe in every Steam library (libraryfolders.vdf + appmanifest)
+Remembers the result and revalidates it by file mtime
+"""
+
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+PES2021_APP_ID = "1259970"
+PES2021_EXE = "PES2021.exe"
+PES2021_INSTALL_DIR = "eFootball PES 2021"
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pes_launcher_cache.json")
+
+
+def parse_vdf(text):
+    """Parse Valve KeyValues text (libraryfolders.vdf, appmanifest_*.acf) into nested dicts"""
+    tokens = []
+    i, length = 0, len(text)
+    while i < length:
+        char = text[i]
+        if char.isspace():
+            i += 1
+        elif char == '/' and text.startswith('//', i):
+            newline = text.find('\n', i)
+            i = length if newline == -1 else newline + 1
+        elif char in '{}':
+            tokens.append(char)
+            i += 1
+        elif char == '"':
+            value = []
+            i += 1
+            while i < length and text[i] != '"':
+                if text[i] == '\\' and i + 1 < length:
+                    i += 1
+                value.append(text[i])
+                i += 1
+            tokens.append(('str', ''.join(value)))
+            i += 1
+        else:
+            start = i
+            while i < length and not text[i].isspace() and text[i] not in '{}"':
+                i += 1
+            tokens.append(('str', text[start:i]))
+
+    root = {}
+    stack = [root]
+    key = None
+    for token in tokens:
+        if token == '{':
+            child = {}
+            stack[-1][key if key is not None else ''] = child
+            stack.append(child)
+            key = None
+        elif token == '}':
+            if len(stack) > 1:
+                stack.pop()
+            key = None
+        elif key is None:
+            key = token[1]
+        else:
+            stack[-1][key] = token[1]
+            key = None
+    return root
+
+
+def get_ci(mapping, key, default=None):
+    """Case-insensitive dict lookup (Valve files mix 'LibraryFolders'/'libraryfolders')"""
+    for name, value in mapping.items():
+        if name.lower() == key.lower():
+            return value
+    return default
+
+
+def steam_roots():
+    """Candidate Steam installation directories for this platform"""
+    roots = []
+    if os.environ.get('STEAM_PATH'):
+        roots.append(os.environ['STEAM_PATH'])
+    if sys.platform == 'win32':
+        try:
+            import winreg
+            with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Valve\Steam") as key:
+                roots.append(winreg.QueryValueEx(key, "SteamPath")[0])
+        except OSError:
+            pass
+        roots += ["C:/Program Files (x86)/Steam", "C:/Program Files/Steam"]
+    else:
+        home = os.path.expanduser('~')
+        roots += [os.path.join(home, '.steam', 'steam'), os.path.join(home, '.local', 'share', 'Steam')]
+
+    unique, seen = [], set()
+    for root in roots:
+        normalized = os.path.normcase(os.path.abspath(root))
+        if normalized not in seen:
+            seen.add(normalized)
+            unique.append(root)
+    return unique
+
+
+def library_folders(steam_root):
+    """All Steam library directories known to ``steam_root``, libraries listing PES first"""
+    libraries = [steam_root]
+    with_pes = []
+    vdf_path = os.path.join(steam_root, 'steamapps', 'libraryfolders.vdf')
+    try:
+        with open(vdf_path, 'r', encoding='utf-8', errors='replace') as f:
+            data = parse_vdf(f.read())
+    except OSError:
+        return libraries
+
+    folders = get_ci(data, 'libraryfolders', {})
+    for key, entry in folders.items():
+        if not key.isdigit():
+            continue
+        if isinstance(entry, dict):
+            # Current format: {"path": ..., "apps": {appid: size}}
+            path = get_ci(entry, 'path')
+            if path and PES2021_APP_ID in get_ci(entry, 'apps', {}):
+                with_pes.append(path)
+        else:
+            # Old format: "1" "D:\\SteamLibrary"
+            path = entry
+        if path and path not in libraries:
+            libraries.append(path)
+    return with_pes + [library for library in libraries if library not in with_pes]
+
+
+def find_in_library(library):
+    """PES2021.exe inside one library, using its appmanifest for the install dir"""
+    steamapps = os.path.join(library, 'steamapps')
+    install_dir = PES2021_INSTALL_DIR
+    manifest = os.path.join(steamapps, f'appmanifest_{PES2021_APP_ID}.acf')
+    try:
+        with open(manifest, 'r', encoding='utf-8', errors='replace') as f:
+            app_state = get_ci(parse_vdf(f.read()), 'AppState', {})
+        install_dir = get_ci(app_state, 'installdir', install_dir)
+    except OSError:
+        pass
+
+    exe_path = os.path.join(steamapps, 'common', install_dir, PES2021_EXE)
+    return exe_path if os.path.isfile(exe_path) else None
+
+
+class PESExecutableLocator:
+    """Finds PES2021.exe and caches the answer until the file changes"""
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, roots=None, extra_paths=None):
+        self.cache_path = cache_path
+        self.roots = roots
+        self.extra_paths = extra_paths if extra_paths is not None else [PES2021_EXE]
+
+    def load_cached(self):
+        """Cached path if the executable is still there with the same mtime"""
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if os.stat(cached['path']).st_mtime_ns == cached['mtime_ns']:
+                return cached['path']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def store(self, path):
+        try:
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump({'path': path, 'mtime_ns': os.stat(path).st_mtime_ns}, f)
+        except OSError:
+            pass
+
+    def search(self):
+        """Search every Steam library in parallel; first library in priority order wins"""
+        libraries = []
+        for root in (self.roots if self.roots is not None else steam_roots()):
+            if os.path.isdir(root):
+                for library in library_folders(root):
+                    if library not in libraries:
+                        libraries.append(library)
+
+        if libraries:
+            with ThreadPoolExecutor(max_workers=min(8, len(libraries))) as executor:
+                for found in executor.map(find_in_library, libraries):
+                    if found:
+                        return os.path.abspath(found)
+
+        for path in self.extra_paths:
+            if os.path.isfile(path):
+                return os.path.abspath(path)
+        return None
+
+    def find(self, refresh=False):
+        """Path to PES2021.exe or None"""
+        if not refresh:
+            cached = self.load_cached()
+            if cached:
+                return cached
+        path = self.search()
+        if path:
+            self.store(path)
+        return path
+
+
+def main():
+    """Print where PES 2021 is installed"""
+    path = PESExecutableLocator().find(refresh='--refresh' in sys.argv)
+    if path:
+        print(f"🎯 PES 2021 found: {path}")
+    else:
+        print("⚠️ PES 2021 executable not found in any Steam library")
+
+
+if __name__ == "__main__":
+    main()
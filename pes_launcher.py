@@ -13,21 +13,221 @@ import subprocess
 import threading
 import os
 import sys
+import queue
+import random
+import logging
+import logging.handlers
 import webbrowser
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from pes_executable_locator import PESExecutableLocator
+
+class BackgroundIO:
+    """Runs blocking network calls on worker threads and hands results back to Tk.
+
+    Worker threads never touch widgets: completions are queued and the Tk
+    loop runs them from ``pump`` (scheduled with ``root.after``). A task is
+    dropped if its generation was cancelled before it finished.
+    """
+    
+    PUMP_INTERVAL_MS = 50
+    
+    def __init__(self, root, max_workers=4):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="launcher-io")
+        self.ui_calls = queue.SimpleQueue()
+        self.generations = {}
+        self.root.after(self.PUMP_INTERVAL_MS, self.pump)
+    
+    def submit(self, key, func, on_done, *args):
+        """Run ``func(*args)`` in the background; ``on_done(result, error)`` runs on the Tk thread.
+        
+        Submitting again with the same ``key`` cancels the earlier task's callback.
+        """
+        generation = self.generations.get(key, 0) + 1
+        self.generations[key] = generation
+        
+        def run():
+            try:
+                result, error = func(*args), None
+            except Exception as e:
+                result, error = None, e
+            self.call_soon(lambda: self.generations.get(key) == generation and on_done(result, error))
+        
+        self.executor.submit(run)
+    
+    def cancel(self, key):
+        self.generations[key] = self.generations.get(key, 0) + 1
+    
+    def call_soon(self, callback):
+        """Thread-safe: schedule ``callback`` on the Tk thread"""
+        self.ui_calls.put(callback)
+    
+    def pump(self):
+        try:
+            while True:
+                self.ui_calls.get_nowait()()
+        except queue.Empty:
+            pass
+        self.root.after(self.PUMP_INTERVAL_MS, self.pump)
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class LogSink:
+    """Thread-safe activity log for the Tk ``Text`` widget.
+
+    Any thread may call ``write``; lines are queued and the Tk loop inserts
+    them in one batch per frame. The widget keeps only the last
+    ``max_lines`` lines, and every line is mirrored to a rotating file.
+    """
+    
+    FRAME_INTERVAL_MS = 100
+    
+    def __init__(self, root, text_widget, max_lines=500, log_path=None):
+        self.root = root
+        self.text = text_widget
+        self.max_lines = max_lines
+        self.pending = queue.SimpleQueue()
+        
+        self.file_logger = logging.getLogger("pes_launcher")
+        self.file_logger.propagate = False
+        self.file_logger.setLevel(logging.INFO)
+        if not self.file_logger.handlers:
+            log_path = log_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "pes_launcher.log")
+            try:
+                handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=1024 * 1024,
+                                                               backupCount=3, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                self.file_logger.addHandler(handler)
+            except OSError as e:
+                print(f"⚠️ Could not open launcher log file: {e}")
+        
+        self.root.after(self.FRAME_INTERVAL_MS, self.drain)
+    
+    def write(self, message):
+        """Queue one line (safe from any thread)"""
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        self.pending.put(f"[{timestamp}] {message}\n")
+        self.file_logger.info(message)
+    
+    def drain(self):
+        """Insert everything queued since the last frame, then trim (Tk thread)"""
+        lines = []
+        try:
+            while True:
+                lines.append(self.pending.get_nowait())
+        except queue.Empty:
+            pass
+        
+        if lines:
+            # A burst larger than the window only needs its tail rendered
+            self.text.insert(tk.END, ''.join(lines[-self.max_lines:]))
+            line_count = int(self.text.index('end-1c').split('.')[0]) - 1
+            if line_count > self.max_lines:
+                self.text.delete('1.0', f'{line_count - self.max_lines + 1}.0')
+            self.text.see(tk.END)
+        self.root.after(self.FRAME_INTERVAL_MS, self.drain)
+
+class AdaptivePoller:
+    """Polls one JSON endpoint at a rate that follows the match state.
+    
+    - idle: every IDLE_INTERVAL seconds, pending match: every PENDING_INTERVAL
+    - failures: exponential backoff with jitter, capped at MAX_BACKOFF
+    - sends If-None-Match so an unchanged answer costs a 304 with no body
+    - ``stop()`` wakes the poller immediately instead of after a sleep
+    """
+    
+    IDLE_INTERVAL = 15.0
+    PENDING_INTERVAL = 2.0
+    MAX_BACKOFF = 120.0
+    
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.etag = None
+        self.last_data = None
+        self.failures = 0
+        self.stop_event = threading.Event()
+        self.stats = Counter()
+        self.total_latency = 0.0
+    
+    def poll_once(self):
+        """One conditional GET; returns the (possibly cached) JSON body"""
+        headers = {'If-None-Match': self.etag} if self.etag and self.last_data is not None else {}
+        started = time.monotonic()
+        try:
+            response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+        finally:
+            self.stats['polls'] += 1
+            self.total_latency += time.monotonic() - started
+        
+        if response.status_code == 304:
+            self.stats['not_modified'] += 1
+            return self.last_data
+        response.raise_for_status()
+        self.stats['changed'] += 1
+        self.etag = response.headers.get('ETag')
+        self.last_data = response.json()
+        return self.last_data
+    
+    def next_delay(self, data, failed):
+        if failed:
+            self.failures += 1
+            ceiling = min(self.MAX_BACKOFF, self.PENDING_INTERVAL * 2 ** self.failures)
+            return random.uniform(ceiling / 2, ceiling)
+        self.failures = 0
+        return self.PENDING_INTERVAL if data.get('match_pending') else self.IDLE_INTERVAL
+    
+    def run(self, on_data, on_error):
+        """Poll until stopped or ``on_data`` returns True"""
+        while not self.stop_event.is_set():
+            try:
+                data = self.poll_once()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self.stats['errors'] += 1
+                delay = self.next_delay(None, True)
+                on_error(e, delay)
+            else:
+                if on_data(data):
+                    return
+                delay = self.next_delay(data, False)
+            self.stop_event.wait(delay)
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def summary(self):
+        polls = self.stats['polls']
+        average = self.total_latency / polls * 1000 if polls else 0.0
+        return (f"{polls} polls, {self.stats['not_modified']} unchanged (304), "
+                f"{self.stats['errors']} errors, avg {average:.0f} ms")
+
 class EnhancedPESLauncher:
     """Enhanced PES Launcher с Web Integration"""
     
+    # Automatic re-check backoff while something is offline (seconds)
+    RECHECK_MIN_DELAY = 5
+    RECHECK_MAX_DELAY = 120
+    
     def __init__(self):
         self.wordpress_api = "http://localhost:8080/wp-json/pes/v1/"
+        self.game_server_api = "http://localhost/api/"
         self.web_lobby_url = "http://localhost:8080/wordpress/wp-content/plugins/pes-teamplay-launcher-api/pes-lobby-interface.html"
         self.player_id = None
         self.player_name = None
         self.monitoring = False
+        self.poller = None
+        self.pes_locator = PESExecutableLocator()
+        self.recheck_delay = self.RECHECK_MIN_DELAY
+        self.recheck_job = None
         
         # GUI Setup
         self.setup_gui()
+        self.io = BackgroundIO(self.root)
         
         # Check connections
         self.check_all_connections()
@@ -65,10 +265,10 @@ class EnhancedPESLauncher:
         self.player_entry.pack(anchor="w", pady=5)
         self.player_entry.bind('<Return>', self.register_player)
         
-        register_btn = tk.Button(player_frame, text="✅ Register Player", 
+        self.register_btn = tk.Button(player_frame, text="✅ Register Player", 
                                command=self.register_player, bg="#28a745", fg="white",
                                font=("Arial", 10, "bold"))
-        register_btn.pack(anchor="w", pady=5)
+        self.register_btn.pack(anchor="w", pady=5)
         
         # Web lobby frame
         web_frame = tk.LabelFrame(self.root, text="🌐 Web Lobby Management", padx=10, pady=10)
@@ -120,6 +320,7 @@ class EnhancedPESLauncher:
         self.log_text.pack(side="left", fill="both", expand=True)
         self.log_text.config(yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.log_text.yview)
+        self.log_sink = LogSink(self.root, self.log_text)
         
         # Footer
         footer = tk.Label(self.root, text="Enhanced PES TeamPlay Launcher v2.0 - Web Integration", 
@@ -127,40 +328,44 @@ class EnhancedPESLauncher:
         footer.pack(side="bottom", pady=5)
     
     def log(self, message):
-        """Add message to log"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        log_message = f"[{timestamp}] {message}\n"
-        
-        self.log_text.insert(tk.END, log_message)
-        self.log_text.see(tk.END)
+        """Add message to log (safe from any thread)"""
+        self.log_sink.write(message)
         print(f"LOG: {message}")
     
+    @staticmethod
+    def probe(url):
+        """Blocking health probe (runs on an I/O thread)"""
+        try:
+            response = requests.get(url, timeout=5)
+            return "Online" if response.status_code == 200 else "Error"
+        except requests.exceptions.RequestException:
+            return "Offline"
+    
     def check_all_connections(self):
-        """Check all required connections"""
+        """Check all required connections (in the background, both in parallel)"""
+        if self.recheck_job is not None:
+            self.root.after_cancel(self.recheck_job)
+            self.recheck_job = None
         self.log("🔍 Checking all connections...")
+        self.status_label.config(text="Checking connections...", fg="orange")
         
-        # Test WordPress API
-        try:
-            response = requests.get(f"{self.wordpress_api}status", timeout=5)
-            if response.status_code == 200:
-                wp_status = "✅ WordPress API: Online"
-                wp_color = "green"
-            else:
-                wp_status = "❌ WordPress API: Error"
-                wp_color = "red"
-        except:
-            wp_status = "❌ WordPress API: Offline"
-            wp_color = "red"
+        results = {}
         
-        # Test PES Server
-        try:
-            response = requests.get("http://localhost/api/status", timeout=5)
-            if response.status_code == 200:
-                pes_status = "✅ PES Server: Online"
-            else:
-                pes_status = "❌ PES Server: Error"
-        except:
-            pes_status = "❌ PES Server: Offline"
+        def collect(name):
+            def on_done(status, error):
+                results[name] = status or "Offline"
+                if len(results) == 2:
+                    self.show_connection_status(results['wp'], results['pes'])
+            return on_done
+        
+        self.io.submit('check-wp', self.probe, collect('wp'), f"{self.wordpress_api}status")
+        self.io.submit('check-pes', self.probe, collect('pes'), "http://localhost/api/status")
+    
+    def show_connection_status(self, wp_result, pes_result):
+        """Update status widgets with probe results (Tk thread)"""
+        wp_status = f"{'✅' if wp_result == 'Online' else '❌'} WordPress API: {wp_result}"
+        pes_status = f"{'✅' if pes_result == 'Online' else '❌'} PES Server: {pes_result}"
+        wp_color = "green" if wp_result == 'Online' else "red"
         
         # Update status
         status_text = f"{wp_status} | {pes_status}"
@@ -169,9 +374,12 @@ class EnhancedPESLauncher:
         
         if "✅" in wp_status and "✅" in pes_status:
             self.log("🎉 All systems ready for 11vs11 matches!")
+            self.recheck_delay = self.RECHECK_MIN_DELAY
             return True
         else:
-            self.log("⚠️ Some systems offline - check XAMPP and PES server")
+            self.log(f"⚠️ Some systems offline - check XAMPP and PES server (retry in {self.recheck_delay}s)")
+            self.recheck_job = self.root.after(self.recheck_delay * 1000, self.check_all_connections)
+            self.recheck_delay = min(self.recheck_delay * 2, self.RECHECK_MAX_DELAY)
             return False
     
     def register_player(self, event=None):
@@ -181,32 +389,39 @@ class EnhancedPESLauncher:
             messagebox.showerror("Error", "Please enter player name")
             return
         
-        try:
-            # Register player via WordPress API
-            data = {
-                "name": player_name,
-                "launcher_version": "2.0-web-enhanced",
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            response = requests.post(f"{self.wordpress_api}player/register", 
-                                   json=data, timeout=10)
+        # Register player via WordPress API
+        data = {
+            "name": player_name,
+            "launcher_version": "2.0-web-enhanced",
+            "timestamp": datetime.now().isoformat()
+        }
+        
+        def post():
+            return requests.post(f"{self.wordpress_api}player/register", json=data, timeout=10)
+        
+        self.register_btn.config(state="disabled")
+        self.log(f"⏳ Registering {player_name}...")
+        self.io.submit('register', post, lambda response, error: self.on_registered(player_name, response, error))
+    
+    def on_registered(self, player_name, response, error):
+        """Registration result (Tk thread)"""
+        self.register_btn.config(state="normal")
+        if error is not None:
+            self.log(f"❌ Registration error: {error}")
+            messagebox.showerror("Error", f"Connection error: {error}")
+            return
+        
+        if response.status_code == 200:
+            result = response.json()
+            self.player_id = result.get('player_id')
+            self.player_name = player_name
             
-            if response.status_code == 200:
-                result = response.json()
-                self.player_id = result.get('player_id')
-                self.player_name = player_name
-                
-                self.log(f"✅ Player registered: {player_name} (ID: {self.player_id})")
-                self.monitor_btn.config(state="normal")
-                messagebox.showinfo("Success", f"Player {player_name} registered!\n\nNow you can:\n1. Open web lobby\n2. Start monitoring\n3. Join matches")
-            else:
-                self.log(f"❌ Registration failed: {response.text}")
-                messagebox.showerror("Error", "Player registration failed")
-                
-        except requests.exceptions.RequestException as e:
-            self.log(f"❌ Registration error: {e}")
-            messagebox.showerror("Error", f"Connection error: {e}")
+            self.log(f"✅ Player registered: {player_name} (ID: {self.player_id})")
+            self.monitor_btn.config(state="normal")
+            messagebox.showinfo("Success", f"Player {player_name} registered!\n\nNow you can:\n1. Open web lobby\n2. Start monitoring\n3. Join matches")
+        else:
+            self.log(f"❌ Registration failed: {response.text}")
+            messagebox.showerror("Error", "Player registration failed")
     
     def open_web_lobby(self):
         """Open web lobby interface"""
@@ -237,58 +452,55 @@ class EnhancedPESLauncher:
         self.log("🔍 Started monitoring for matches")
         
         # Start monitoring thread
-        monitor_thread = threading.Thread(target=self.monitor_matches, daemon=True)
+        self.poller = AdaptivePoller(f"{self.wordpress_api}player/{self.player_id}/pending-matches")
+        monitor_thread = threading.Thread(target=self.monitor_matches, args=(self.poller,), daemon=True)
         monitor_thread.start()
     
     def stop_monitoring(self):
         """Stop match monitoring"""
         self.monitoring = False
+        if self.poller is not None:
+            self.poller.stop()
         self.monitor_btn.config(text="🔍 Start Match Monitoring", bg="#17a2b8")
         self.match_status.config(text="⏸️ Monitoring stopped", fg="gray")
         
         self.log("⏸️ Stopped monitoring")
     
-    def monitor_matches(self):
+    def monitor_matches(self, poller):
         """Monitor for pending matches (runs in thread)"""
-        while self.monitoring:
-            try:
-                # Check for pending matches
-                response = requests.get(f"{self.wordpress_api}player/{self.player_id}/pending-matches", 
-                                      timeout=5)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    
-                    if data.get('match_ready'):
-                        self.handle_match_ready(data['match'])
-                        break
-                    elif data.get('match_pending'):
-                        pending_info = data['match_pending']
-                        players_count = pending_info.get('current_players', 0)
-                        max_players = pending_info.get('max_players', 22)
-                        
-                        status_text = f"⏳ Match pending: {players_count}/{max_players} players"
-                        self.root.after(0, lambda: self.match_status.config(text=status_text, fg="orange"))
-                    else:
-                        self.root.after(0, lambda: self.match_status.config(text="🔍 Waiting for match...", fg="blue"))
+        def on_data(data):
+            if data.get('match_ready'):
+                self.handle_match_ready(data['match'])
+                return True
+            elif data.get('match_pending'):
+                pending_info = data['match_pending']
+                players_count = pending_info.get('current_players', 0)
+                max_players = pending_info.get('max_players', 22)
                 
-            except requests.exceptions.RequestException as e:
-                self.log(f"⚠️ Monitoring error: {e}")
-            
-            time.sleep(5)  # Check every 5 seconds
+                status_text = f"⏳ Match pending: {players_count}/{max_players} players"
+                self.io.call_soon(lambda: self.match_status.config(text=status_text, fg="orange"))
+            else:
+                self.io.call_soon(lambda: self.match_status.config(text="🔍 Waiting for match...", fg="blue"))
+            return False
+        
+        def on_error(error, delay):
+            self.log(f"⚠️ Monitoring error: {error} (retry in {delay:.0f}s)")
+        
+        poller.run(on_data, on_error)
+        self.log(f"📊 Match polling: {poller.summary()}")
     
     def handle_match_ready(self, match_data):
         """Handle match ready signal"""
         self.log("🎉 MATCH READY! Preparing to launch PES...")
         
         # Update GUI
-        self.root.after(0, lambda: self.match_status.config(text="🚀 MATCH READY - Launching PES!", fg="green"))
+        self.io.call_soon(lambda: self.match_status.config(text="🚀 MATCH READY - Launching PES!", fg="green"))
         
         # Show match info
         players_count = len(match_data.get('players', []))
         match_info = f"🎮 Match ready with {players_count} players!\n\nPES will launch automatically."
         
-        self.root.after(0, lambda: messagebox.showinfo("🎉 Match Ready", match_info))
+        self.io.call_soon(lambda: messagebox.showinfo("🎉 Match Ready", match_info))
         
         # Launch PES with match data
         self.launch_pes_with_match(match_data)
@@ -299,7 +511,16 @@ class EnhancedPESLauncher:
             self.log("🚀 Launching PES 2021 with match data...")
             
             # Launch PES
-            self.launch_pes_manual()
+            process = self.launch_pes_manual()
+            
+            # Game is starting: preparing → ready → in_progress (the server aborts matches stuck in either)
+            match_id = match_data.get('id') or match_data.get('match_id')
+            if process and match_id:
+                self.io.call_soon(lambda: self.io.submit(f'match-state-{match_id}', self.report_match_state,
+                                                         self.on_match_state_reported, match_id,
+                                                         'ready', 'in_progress'))
+                threading.Thread(target=self.watch_match, args=(process, match_id),
+                                 name=f"pes-match-{match_id}", daemon=True).start()
             
             # TODO: Implement P2P coordination
             # For now, players coordinate manually in PES
@@ -308,41 +529,72 @@ class EnhancedPESLauncher:
             
         except Exception as e:
             self.log(f"❌ Error launching PES: {e}")
-            messagebox.showerror("Error", f"Failed to launch PES: {e}")
+            self.io.call_soon(lambda error=e: messagebox.showerror("Error", f"Failed to launch PES: {error}"))
     
     def launch_pes_manual(self):
         """Manual PES launch"""
         try:
-            # Try to find PES executable
-            pes_paths = [
-                "C:/Program Files (x86)/Steam/steamapps/common/eFootball PES 2021/PES2021.exe",
-                "C:/Program Files/Steam/steamapps/common/eFootball PES 2021/PES2021.exe",
-                "PES2021.exe"
-            ]
-            
-            pes_path = None
-            for path in pes_paths:
-                if os.path.exists(path):
-                    pes_path = path
-                    break
+            # Steam libraries are parsed once; later launches use the cached path
+            pes_path = self.pes_locator.find()
             
             if pes_path:
                 self.log(f"🎯 Launching PES from: {pes_path}")
-                subprocess.Popen([pes_path])
+                process = subprocess.Popen([pes_path])
                 self.log("✅ PES 2021 launched successfully")
+                return process
             else:
-                self.log("⚠️ PES executable not found in common locations")
-                messagebox.showwarning("Warning", "PES 2021 executable not found!\n\nPlease launch PES manually.")
+                self.log("⚠️ PES executable not found in any Steam library")
+                self.io.call_soon(lambda: messagebox.showwarning(
+                    "Warning", "PES 2021 executable not found!\n\nPlease launch PES manually."))
                 
         except Exception as e:
             self.log(f"❌ Error launching PES: {e}")
-            messagebox.showerror("Error", f"Failed to launch PES: {e}")
+            self.io.call_soon(lambda error=e: messagebox.showerror("Error", f"Failed to launch PES: {error}"))
+        return None
+    
+    def watch_match(self, process, match_id):
+        """Mark the match finished once PES exits (the first launcher to report it ends the match)"""
+        process.wait()
+        self.log(f"🏁 PES closed, finishing match {match_id}")
+        # The earlier states are repeated in case PES exited before they were reported; 409s are skipped
+        self.io.call_soon(lambda: self.io.submit(f'match-finish-{match_id}', self.report_match_state,
+                                                 self.on_match_state_reported, match_id,
+                                                 'ready', 'in_progress', 'finished'))
+    
+    def report_match_state(self, match_id, *statuses):
+        """Tell the game server about match state changes, in order (runs on an I/O thread)
+        
+        409 means another player's launcher already moved the match on; the
+        next state is still reported.
+        """
+        for status in statuses:
+            response = requests.post(f"{self.game_server_api}matches/{match_id}/state",
+                                     json={'status': status}, timeout=5)
+            if response.status_code not in (200, 409):
+                break
+        return match_id, status, response.status_code
+    
+    def on_match_state_reported(self, result, error):
+        if error is not None:
+            self.log(f"⚠️ Could not report match state: {error}")
+            return
+        match_id, status, code = result
+        if code == 200:
+            self.log(f"⚽ Match {match_id} marked {status}")
+        else:
+            self.log(f"⚠️ Server refused match {match_id} → {status} (HTTP {code})")
     
     def run(self):
         """Start launcher GUI"""
         self.log("🎮 Enhanced PES TeamPlay Launcher started")
         self.log("💡 Register player → Open web lobby → Start monitoring → Play!")
-        self.root.mainloop()
+        try:
+            self.root.mainloop()
+        finally:
+            self.monitoring = False
+            if self.poller is not None:
+                self.poller.stop()
+            self.io.shutdown()
 
 def main():
     """Start Enhanced PES Launcher"""
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+PES 2021 Server Load Generator
+Hammers one endpoint from several threads, with persistent connections
+or a new connection per request, and reports throughput and latency
+"""
+
+import argparse
+import http.client
+import threading
+import time
+import urllib.parse
+
+
+class LoadGenerator:
+    """Runs ``requests`` GETs against ``url`` from ``concurrency`` threads"""
+
+    def __init__(self, url, requests=2000, concurrency=8, keep_alive=True):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path or '/'
+        if parsed.query:
+            self.path += '?' + parsed.query
+        self.requests = requests
+        self.concurrency = concurrency
+        self.keep_alive = keep_alive
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.connections = 0
+        self.errors = 0
+
+    def worker(self, count):
+        latencies = []
+        connections = errors = 0
+        conn = None
+        for _ in range(count):
+            started = time.perf_counter()
+            try:
+                if conn is None:
+                    conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+                    connections += 1
+                headers = {} if self.keep_alive else {'Connection': 'close'}
+                conn.request('GET', self.path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                if not self.keep_alive or response.will_close:
+                    conn.close()
+                    conn = None
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                if conn is not None:
+                    conn.close()
+                conn = None
+                continue
+            latencies.append(time.perf_counter() - started)
+        if conn is not None:
+            conn.close()
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.connections += connections
+            self.errors += errors
+
+    def run(self):
+        """Returns a result dict (requests/s, connections opened, latency percentiles in ms)"""
+        per_thread = [self.requests // self.concurrency] * self.concurrency
+        per_thread[0] += self.requests % self.concurrency
+        threads = [threading.Thread(target=self.worker, args=(count,)) for count in per_thread]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+        return {
+            'mode': 'keep-alive' if self.keep_alive else 'close',
+            'requests': len(latencies),
+            'errors': self.errors,
+            'connections': self.connections,
+            'seconds': elapsed,
+            'rps': len(latencies) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(0.50),
+            'p99_ms': percentile(0.99),
+        }
+
+
+def print_result(result):
+    print(f"   {result['mode']:>10}: {result['rps']:8.0f} req/s | {result['connections']:6d} connections | "
+          f"p50 {result['p50_ms']:6.2f} ms | p99 {result['p99_ms']:6.2f} ms | {result['errors']} errors")
+
+
+def main():
+    """Compare persistent connections against a connection per request"""
+    parser = argparse.ArgumentParser(description="PES 2021 server load generator")
+    parser.add_argument('url', nargs='?', default='http://127.0.0.1/XME994-E1/info/info_en.txt')
+    parser.add_argument('-n', '--requests', type=int, default=2000)
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('--mode', choices=('both', 'keep-alive', 'close'), default='both')
+    args = parser.parse_args()
+
+    print(f"🔥 {args.requests} requests, {args.concurrency} threads → {args.url}")
+    results = {}
+    for keep_alive in (True, False):
+        mode = 'keep-alive' if keep_alive else 'close'
+        if args.mode in ('both', mode):
+            results[mode] = LoadGenerator(args.url, args.requests, args.concurrency, keep_alive).run()
+            print_result(results[mode])
+
+    if len(results) == 2:
+        saved = results['close']['connections'] - results['keep-alive']['connections']
+        speedup = results['keep-alive']['rps'] / results['close']['rps'] if results['close']['rps'] else 0.0
+        print(f"📊 Keep-alive saved {saved} TCP handshakes, throughput ×{speedup:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+PES 2021 Lobby Model
+One normalized Lobby / LobbyPlayer shape for WordPress and SQLite data
+Slotted objects with a direct-to-JSON encoder (no per-object dicts)
+"""
+
+import json
+import sys
+import time
+from json.encoder import encode_basestring_ascii
+
+
+def encode_value(value):
+    """JSON text for a scalar"""
+    if value is None:
+        return 'null'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return encode_basestring_ascii(str(value))
+
+
+def as_int(value, default=0):
+    """WordPress sends numbers as strings; normalize once at ingest"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+class LobbyPlayer:
+    __slots__ = ('player_id', 'username', 'team', 'ready', 'position')
+
+    def __init__(self, player_id, username, team=0, ready=False, position='any'):
+        self.player_id = player_id
+        self.username = username
+        self.team = team
+        self.ready = ready
+        self.position = position
+
+    @classmethod
+    def from_dict(cls, data):
+        """From a WordPress player entry or our own JSON"""
+        player_id = data.get('player_id', data.get('id'))
+        return cls(as_int(player_id, player_id),
+                   data.get('username') or data.get('player_name') or data.get('name') or 'Unknown',
+                   as_int(data.get('team')), as_bool(data.get('ready')), data.get('position') or 'any')
+
+    def to_json(self):
+        return (f'{{"player_id":{encode_value(self.player_id)},"username":{encode_value(self.username)},'
+                f'"team":{encode_value(self.team)},"ready":{encode_value(self.ready)},'
+                f'"position":{encode_value(self.position)}}}')
+
+
+class Lobby:
+    """Normalized lobby; built once at ingest and treated as immutable afterwards"""
+
+    __slots__ = ('id', 'name', 'host_player_id', 'host_username', 'max_players', 'current_players',
+                 'ready_players', 'team1_size', 'team2_size', 'status', 'created_at', 'game_mode',
+                 'has_password', 'players', '_json')
+
+    def __init__(self, id, name, host_player_id=None, host_username='Unknown', max_players=22, current_players=0,
+                 ready_players=0, team1_size=0, team2_size=0, status='waiting', created_at=None,
+                 game_mode='team_play', has_password=False, players=()):
+        self.id = id
+        self.name = name
+        self.host_player_id = host_player_id
+        self.host_username = host_username
+        self.max_players = max_players
+        self.current_players = current_players
+        self.ready_players = ready_players
+        self.team1_size = team1_size
+        self.team2_size = team2_size
+        self.status = status
+        self.created_at = created_at
+        self.game_mode = game_mode
+        self.has_password = has_password
+        self.players = tuple(players)
+        self._json = None
+
+    @classmethod
+    def from_dict(cls, data):
+        """From a WordPress lobby (``lobby_name``) or our own JSON (``name``)"""
+        players = [LobbyPlayer.from_dict(player) for player in data.get('players') or ()]
+        return cls(
+            id=data.get('id'),
+            name=data.get('lobby_name') or data.get('name') or 'Unknown',
+            host_player_id=as_int(data.get('host_player_id', data.get('host_id')), None),
+            host_username=data.get('host_username') or data.get('host_name') or 'Unknown',
+            max_players=as_int(data.get('max_players'), 22),
+            current_players=as_int(data.get('current_players'), len(players)),
+            ready_players=as_int(data.get('ready_players'), sum(player.ready for player in players)),
+            team1_size=as_int(data.get('team1_size'), sum(player.team == 1 for player in players)),
+            team2_size=as_int(data.get('team2_size'), sum(player.team == 2 for player in players)),
+            status=data.get('status') or 'waiting',
+            created_at=data.get('created_at'),
+            game_mode=data.get('game_mode') or 'team_play',
+            has_password=(as_bool(data.get('has_password')) or as_bool(data.get('is_private'))
+                          or bool(data.get('password_hash'))),
+            players=players,
+        )
+
+    def to_json(self):
+        """JSON object text, rendered once per lobby"""
+        if self._json is None:
+            self._json = (
+                f'{{"id":{encode_value(self.id)},"name":{encode_value(self.name)},'
+                f'"host_player_id":{encode_value(self.host_player_id)},'
+                f'"host_username":{encode_value(self.host_username)},'
+                f'"max_players":{encode_value(self.max_players)},'
+                f'"current_players":{encode_value(self.current_players)},'
+                f'"ready_players":{encode_value(self.ready_players)},'
+                f'"team1_size":{encode_value(self.team1_size)},"team2_size":{encode_value(self.team2_size)},'
+                f'"status":{encode_value(self.status)},"created_at":{encode_value(self.created_at)},'
+                f'"game_mode":{encode_value(self.game_mode)},"has_password":{encode_value(self.has_password)},'
+                f'"players":[{",".join(player.to_json() for player in self.players)}]}}'
+            )
+        return self._json
+
+
+def encode_lobbies(lobbies):
+    """JSON array bytes for a lobby list"""
+    return f'[{",".join(lobby.to_json() for lobby in lobbies)}]'.encode('ascii')
+
+
+def decode_lobbies(items):
+    """Lobby objects from a list of dicts (WordPress response or our own snapshot)"""
+    return [Lobby.from_dict(item) for item in items]
+
+
+def sample_wordpress_lobbies(count=1000, players=11):
+    return [{'id': str(i), 'lobby_name': f'Lobby {i}', 'host_player_id': str(i * 100), 'host_username': f'host{i}',
+             'max_players': '22', 'current_players': str(players), 'status': 'waiting',
+             'created_at': '2026-10-19 20:00:00', 'game_mode': 'team_play',
+             'players': [{'player_id': str(i * 100 + j), 'username': f'player{i}_{j}', 'team': str(1 + j % 2),
+                          'ready': '1' if j % 3 else '0', 'position': 'CMF'} for j in range(players)]}
+            for i in range(count)]
+
+
+def benchmark(count=1000):
+    """Compare plain dicts + json.dumps against the slotted model + direct encoder"""
+    import tracemalloc
+
+    raw = sample_wordpress_lobbies(count)
+
+    tracemalloc.start()
+    dicts = json.loads(json.dumps(raw))
+    dict_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    lobbies = decode_lobbies(raw)
+    model_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    rounds = 20
+    started = time.perf_counter()
+    for _ in range(rounds):
+        json.dumps(dicts, separators=(',', ':')).encode('utf-8')
+    dict_time = (time.perf_counter() - started) / rounds
+    started = time.perf_counter()
+    for _ in range(rounds):
+        encode_lobbies(lobbies)
+    model_time = (time.perf_counter() - started) / rounds
+
+    print(f"📊 {count} lobbies with 11 players each")
+    print(f"   dicts: {dict_memory / 1024:8.0f} KB | listing {dict_time * 1000:6.2f} ms")
+    print(f"   model: {model_memory / 1024:8.0f} KB | listing {model_time * 1000:6.2f} ms (rendered once per lobby)")
+
+
+def main():
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+PES 2021 Lobby Sync
+Keeps the local SQLite lobbies / lobby_players copy in step with WordPress
+Pulls only lobbies changed since the last cursor, full resync as fallback
+"""
+
+import logging
+import sqlite3
+import sys
+import threading
+import time
+
+from pes_lobby_model import as_bool
+
+CURSOR_KEY = 'wordpress_lobbies_cursor'
+FULL_SYNC_KEY = 'wordpress_lobbies_full_sync_at'
+
+logger = logging.getLogger("pes_server.lobby_sync")
+
+
+class LobbySyncWorker:
+    """Pulls ``lobbies?updated_since=<cursor>`` from WordPress and upserts the changes.
+
+    Change feed contract: the response carries the changed lobbies, an
+    optional ``deleted_ids`` list and the ``cursor`` to send next time. A
+    response without ``cursor`` (older plugin, or first run) is treated as
+    the full lobby list: everything in it is upserted and local lobbies
+    missing from it are closed. A full resync also runs every
+    ``full_resync_interval`` seconds and whenever the cursor is rejected.
+
+    Local state is left alone: lobbies that never came from WordPress
+    (``synced = 0``) are not closed, and roster rows added by a local join
+    (``local_join = 1``) are kept until WordPress lists the player too.
+    """
+
+    def __init__(self, db_path, api_url, interval=5.0, full_resync_interval=600.0, batch_size=200):
+        self.db_path = db_path
+        self.api_url = api_url
+        self.interval = interval
+        self.full_resync_interval = full_resync_interval
+        self.batch_size = batch_size
+        self.session = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def get_connection(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def load_state(self, conn):
+        state = dict(conn.execute('SELECT key, value FROM sync_state WHERE key IN (?, ?)',
+                                  (CURSOR_KEY, FULL_SYNC_KEY)))
+        return state.get(CURSOR_KEY), float(state.get(FULL_SYNC_KEY) or 0)
+
+    def fetch(self, cursor):
+        """One request to WordPress; returns the decoded JSON, or None if the cursor was rejected"""
+        import requests  # deferred like the server's own WordPress calls
+
+        if self.session is None:
+            self.session = requests.Session()
+        params = {'updated_since': cursor} if cursor else {}
+        response = self.session.get(f"{self.api_url}lobbies", params=params, timeout=10)
+        if cursor and response.status_code in (400, 410):
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def sync_once(self, force_full=False):
+        """Pull and apply one batch of changes; returns a stats dict"""
+        conn = self.get_connection()
+        try:
+            cursor, last_full = self.load_state(conn)
+            full = force_full or cursor is None or time.time() - last_full >= self.full_resync_interval
+            data = self.fetch(None if full else cursor)
+            if data is None or (not full and data.get('cursor') is None):
+                # Cursor rejected, or no change feed support: only a plain full list can be trusted
+                full = True
+                data = self.fetch(None)
+
+            lobbies = data.get('lobbies') or []
+            next_cursor = data.get('cursor')
+            stats = self.apply(conn, lobbies, data.get('deleted_ids') or [], full, next_cursor)
+        finally:
+            conn.close()
+        stats['full'] = full
+        return stats
+
+    def apply(self, conn, lobbies, deleted_ids, full, next_cursor):
+        """Upsert ``lobbies`` in batched transactions, then record the new cursor"""
+        stats = {'upserted': 0, 'closed': 0}
+        for start in range(0, len(lobbies), self.batch_size):
+            with conn:
+                for lobby in lobbies[start:start + self.batch_size]:
+                    if self.upsert_lobby(conn, lobby):
+                        stats['upserted'] += 1
+
+        with conn:
+            to_close = [str(lobby_id) for lobby_id in deleted_ids]
+            if full:
+                seen = {str(lobby.get('id')) for lobby in lobbies}
+                to_close += [row[0] for row in conn.execute("SELECT id FROM lobbies WHERE status != 'closed' "
+                                                            "AND synced = 1")
+                             if row[0] not in seen]
+            for lobby_id in to_close:
+                # Emptying the roster lets the triggers zero the counters
+                conn.execute('DELETE FROM lobby_players WHERE lobby_id = ?', (lobby_id,))
+                stats['closed'] += conn.execute("UPDATE lobbies SET status = 'closed' WHERE id = ? "
+                                                "AND status != 'closed'", (lobby_id,)).rowcount
+
+            state = []
+            if next_cursor is not None:
+                state.append((CURSOR_KEY, str(next_cursor)))
+            if full:
+                state.append((FULL_SYNC_KEY, str(time.time())))
+            conn.executemany('INSERT INTO sync_state (key, value) VALUES (?, ?) '
+                             'ON CONFLICT(key) DO UPDATE SET value = excluded.value', state)
+        return stats
+
+    def upsert_lobby(self, conn, lobby):
+        """Write one WordPress lobby and (if included) its roster; returns whether anything changed"""
+        if lobby.get('id') is None:
+            return False
+        lobby_id = str(lobby['id'])
+        changes = conn.total_changes
+        # The WHERE guard leaves unchanged rows alone, so the triggers and the lobby list ETag stay put
+        conn.execute('''
+            INSERT INTO lobbies (id, name, host_player_id, max_players, status, game_mode, match_type, created_at,
+                                 has_password, synced)
+            VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, 1)
+            ON CONFLICT(id) DO UPDATE SET
+                name = excluded.name, host_player_id = excluded.host_player_id,
+                max_players = excluded.max_players, status = excluded.status,
+                game_mode = excluded.game_mode, match_type = excluded.match_type,
+                has_password = excluded.has_password, synced = 1
+            WHERE name IS NOT excluded.name OR host_player_id IS NOT excluded.host_player_id
+               OR max_players IS NOT excluded.max_players OR status IS NOT excluded.status
+               OR game_mode IS NOT excluded.game_mode OR match_type IS NOT excluded.match_type
+               OR has_password IS NOT excluded.has_password OR synced IS NOT 1
+        ''', (lobby_id, lobby.get('lobby_name') or lobby.get('name') or f'Lobby {lobby_id}',
+              lobby.get('host_player_id') or lobby.get('host_id'), lobby.get('max_players') or 22,
+              lobby.get('status') or 'waiting', lobby.get('game_mode') or 'team_play',
+              lobby.get('match_type') or '11vs11', lobby.get('created_at'),
+              1 if as_bool(lobby.get('has_password')) or as_bool(lobby.get('is_private'))
+              or lobby.get('password_hash') else 0))
+
+        players = lobby.get('players')
+        if players is None:
+            return conn.total_changes != changes
+
+        roster = []
+        for player in players:
+            player_id = player.get('player_id', player.get('id'))
+            if player_id is None:
+                continue
+            username = player.get('username') or player.get('player_name') or player.get('name')
+            conn.execute('INSERT OR IGNORE INTO players (id, username) VALUES (?, ?)',
+                         (player_id, username or f'Player {player_id}'))
+            if username:
+                conn.execute('UPDATE OR IGNORE players SET username = ? WHERE id = ? AND username != ?',
+                             (username, player_id, username))
+            roster.append((lobby_id, player_id, player.get('team') or 0, 1 if player.get('ready') else 0,
+                           player.get('position') or 'any'))
+
+        placeholders = ','.join('?' * len(roster))
+        conn.execute(f'DELETE FROM lobby_players WHERE lobby_id = ? AND local_join = 0 '
+                     f'AND player_id NOT IN ({placeholders})',
+                     [lobby_id] + [row[1] for row in roster])
+        # ON CONFLICT DO UPDATE (not OR REPLACE) so the counter triggers see the change;
+        # a local join WordPress now lists becomes a regular synced row
+        conn.executemany('''
+            INSERT INTO lobby_players (lobby_id, player_id, team, ready, position) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(lobby_id, player_id) DO UPDATE SET
+                team = excluded.team, ready = excluded.ready, position = excluded.position, local_join = 0
+            WHERE team IS NOT excluded.team OR ready IS NOT excluded.ready OR position IS NOT excluded.position
+               OR local_join != 0
+        ''', roster)
+        return conn.total_changes != changes
+
+    def run(self):
+        failures = 0
+        while not self.stop_event.is_set():
+            try:
+                stats = self.sync_once()
+                failures = 0
+                if stats['upserted'] or stats['closed']:
+                    logger.debug("🔄 Lobby sync (%s): %d updated, %d closed",
+                                 'full' if stats['full'] else 'incremental', stats['upserted'], stats['closed'])
+            except Exception as e:
+                failures += 1
+                if failures == 1:
+                    logger.warning("⚠️ Lobby sync failed, keeping local copy: %s", e)
+            # Back off while WordPress is down
+            self.stop_event.wait(min(self.interval * 2 ** min(failures, 4), 120))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="pes-lobby-sync", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def main():
+    """Run one sync: pes_lobby_sync.py [--full] [db_path]"""
+    from enhanced_pes_server_v2_for_pes_game import PESDatabase
+
+    args = [arg for arg in sys.argv[1:] if arg != '--full']
+    database = PESDatabase(args[0] if args else 'pes_server.db')
+    worker = LobbySyncWorker(database.db_path, database.wordpress_api_url)
+    stats = worker.sync_once(force_full='--full' in sys.argv)
+    print(f"✅ {'Full' if stats['full'] else 'Incremental'} lobby sync: "
+          f"{stats['upserted']} updated, {stats['closed']} closed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+PES 2021 Match Archive
+Moves old finished matches and expired sessions out of pes_server.db
+into monthly archive databases, and queries across hot + archived data
+"""
+
+import argparse
+import glob
+import os
+import re
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+from pes_match_service import MATCH_COLUMNS, match_from_row
+
+MATCH_RETENTION_DAYS = 30
+SESSION_RETENTION_DAYS = 7
+
+ARCHIVE_PATTERN = re.compile(r'pes_archive_(\d{4})_(\d{2})\.db$')
+
+# What gets archived, and which timestamp decides the partition
+ARCHIVED_TABLES = {
+    'matches': {
+        'timestamp': 'COALESCE(ended_at, created_at)',
+        'where': "status IN ('finished', 'aborted')",
+        'indexes': ('id', 'lobby_id'),
+    },
+    'player_sessions': {
+        'timestamp': 'last_heartbeat',
+        'where': '1',
+        'indexes': ('player_id',),
+    },
+}
+
+
+def cutoff_timestamp(days):
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def check_timestamp(name, value):
+    """``value`` if it is a zero-padded 'YYYY-MM[-DD[ HH:MM[:SS]]]' (compares like the stored timestamps)"""
+    for pattern in ('%Y-%m', '%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S'):
+        try:
+            if len(value) == len(datetime(2000, 1, 1).strftime(pattern)):
+                datetime.strptime(value, pattern)
+                return value
+        except (TypeError, ValueError):
+            continue
+    raise ValueError(f"{name} must look like YYYY-MM-DD or YYYY-MM-DD HH:MM:SS, got {value!r}")
+
+
+def sync_columns(conn, table, schema='archive'):
+    """Add the hot table's columns missing from its archived copy; returns the hot table's column names.
+
+    Schema migrations only ever add columns, so this keeps old partitions
+    readable with the current column list.
+    """
+    archived = {row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})')}
+    columns = []
+    for _, name, declared, _, _, _ in conn.execute(f'PRAGMA main.table_info({table})'):
+        if name not in archived:
+            conn.execute(f'ALTER TABLE {schema}.{table} ADD COLUMN {name} {declared}')
+        columns.append(name)
+    return columns
+
+
+class MatchArchive:
+    """Time-partitioned cold storage next to the hot database.
+
+    One SQLite file per month (``archive/pes_archive_YYYY_MM.db``). Rows are
+    moved with ATTACH + INSERT ... SELECT + DELETE, ``batch_size`` rows per
+    transaction, so the hot database is never locked for long and a crash
+    leaves every row in exactly one place.
+    """
+
+    def __init__(self, db_path, archive_dir=None, batch_size=500,
+                 match_retention_days=MATCH_RETENTION_DAYS, session_retention_days=SESSION_RETENTION_DAYS):
+        self.db_path = db_path
+        self.archive_dir = archive_dir or os.path.join(os.path.dirname(os.path.abspath(db_path)), 'archive')
+        self.batch_size = batch_size
+        self.retention_days = {'matches': match_retention_days, 'player_sessions': session_retention_days}
+
+    def partition_path(self, partition):
+        return os.path.join(self.archive_dir, f'pes_archive_{partition}.db')
+
+    def partitions(self, since=None, until=None):
+        """Archive partitions ('YYYY_MM', path), newest first, limited to the months overlapping since/until"""
+        found = []
+        for path in glob.glob(os.path.join(self.archive_dir, 'pes_archive_*.db')):
+            match = ARCHIVE_PATTERN.search(path)
+            if not match:
+                continue
+            month = f'{match.group(1)}-{match.group(2)}'
+            if since and month < since[:7]:
+                continue
+            if until and month > until[:7]:
+                continue
+            found.append((f'{match.group(1)}_{match.group(2)}', path))
+        return sorted(found, reverse=True)
+
+    def migrate_partitions(self):
+        """Bring every partition's tables up to the hot schema (run after the hot database migrated)"""
+        conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+        try:
+            for _, path in self.partitions():
+                conn.execute('ATTACH DATABASE ? AS archive', (path,))
+                try:
+                    for table in ARCHIVED_TABLES:
+                        if conn.execute("SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = ?",
+                                        (table,)).fetchone():
+                            sync_columns(conn, table)
+                finally:
+                    conn.execute('DETACH DATABASE archive')
+        finally:
+            conn.close()
+
+    def archive(self):
+        """Move everything past retention; returns {table: rows moved}"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+        moved = {}
+        try:
+            for table, spec in ARCHIVED_TABLES.items():
+                cutoff = cutoff_timestamp(self.retention_days[table])
+                eligible = f"{spec['where']} AND {spec['timestamp']} < ?"
+                months = [row[0] for row in conn.execute(
+                    f"SELECT DISTINCT strftime('%Y_%m', {spec['timestamp']}) FROM {table} WHERE {eligible}",
+                    (cutoff,)) if row[0]]
+                moved[table] = 0
+                for partition in months:
+                    moved[table] += self._move_partition(conn, table, spec, eligible, cutoff, partition)
+        finally:
+            conn.close()
+        return moved
+
+    def _move_partition(self, conn, table, spec, eligible, cutoff, partition):
+        conn.execute('ATTACH DATABASE ? AS archive', (self.partition_path(partition),))
+        try:
+            # Same columns as the hot table; no constraints (a player has many archived sessions)
+            conn.execute(f'CREATE TABLE IF NOT EXISTS archive.{table} AS SELECT * FROM main.{table} WHERE 0')
+            columns = ', '.join(sync_columns(conn, table))
+            for column in spec['indexes']:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS archive.idx_{table}_{column} ON {table} ({column})')
+
+            moved = 0
+            while True:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    rowids = [row[0] for row in conn.execute(
+                        f"SELECT rowid FROM main.{table} WHERE {eligible} "
+                        f"AND strftime('%Y_%m', {spec['timestamp']}) = ? LIMIT ?",
+                        (cutoff, partition, self.batch_size))]
+                    if rowids:
+                        placeholders = ','.join('?' * len(rowids))
+                        conn.execute(f'INSERT INTO archive.{table} ({columns}) SELECT {columns} FROM main.{table} '
+                                     f'WHERE rowid IN ({placeholders})', rowids)
+                        conn.execute(f'DELETE FROM main.{table} WHERE rowid IN ({placeholders})', rowids)
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+                moved += len(rowids)
+                if len(rowids) < self.batch_size:
+                    return moved
+        finally:
+            conn.execute('DETACH DATABASE archive')
+
+    def _query_partitions(self, sql, params, since=None, until=None):
+        """Run ``sql`` against every archive partition in range, newest first"""
+        for _, path in self.partitions(since, until):
+            conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+            try:
+                yield from conn.execute(sql, params)
+            except sqlite3.OperationalError:
+                # Partition without this table (e.g. sessions only)
+                continue
+            finally:
+                conn.close()
+
+    def get_match(self, match_id):
+        for row in self._query_partitions(f'SELECT {MATCH_COLUMNS} FROM matches WHERE id = ?', (match_id,)):
+            return match_from_row(row)
+        return None
+
+    def get_statuses(self, match_ids):
+        statuses = {}
+        remaining = list(match_ids)
+        for _, path in self.partitions():
+            if not remaining:
+                break
+            conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+            try:
+                for start in range(0, len(remaining), 500):
+                    chunk = remaining[start:start + 500]
+                    statuses.update(conn.execute(
+                        f"SELECT id, status FROM matches WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+            except sqlite3.OperationalError:
+                continue
+            finally:
+                conn.close()
+            remaining = [match_id for match_id in remaining if match_id not in statuses]
+        return statuses
+
+    def find_matches(self, lobby_id=None, status=None, since=None, until=None, limit=100):
+        """Matches from the hot database and every archive partition in range, newest first.
+
+        Raises ValueError for a malformed ``since`` / ``until``.
+        """
+        since = None if since is None else check_timestamp('since', since)
+        until = None if until is None else check_timestamp('until', until)
+        conditions, params = [], []
+        if lobby_id is not None:
+            conditions.append('lobby_id = ?')
+            params.append(lobby_id)
+        if status is not None:
+            conditions.append('status = ?')
+            params.append(status)
+        if since is not None:
+            conditions.append('created_at >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('created_at <= ?')
+            params.append(until)
+        sql = (f"SELECT {MATCH_COLUMNS} FROM matches WHERE {' AND '.join(conditions) or '1'} "
+               f"ORDER BY created_at DESC LIMIT ?")
+        params.append(limit)
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        # Partitions are by end time, so a match can sit one month after its creation
+        archive_until = None
+        if until is not None:
+            archive_until = (datetime.strptime(until[:7], '%Y-%m') + timedelta(days=32)).strftime('%Y-%m')
+        for row in self._query_partitions(sql, params, since, archive_until):
+            rows.append(row)
+
+        rows.sort(key=lambda row: row[5] or '', reverse=True)
+        return [match_from_row(row) for row in rows[:limit]]
+
+
+def main():
+    """Archive once and list partitions"""
+    parser = argparse.ArgumentParser(description="Archive old PES matches and sessions")
+    parser.add_argument('db_path', nargs='?', default='pes_server.db')
+    parser.add_argument('--match-days', type=int, default=MATCH_RETENTION_DAYS)
+    parser.add_argument('--session-days', type=int, default=SESSION_RETENTION_DAYS)
+    args = parser.parse_args()
+
+    archive = MatchArchive(args.db_path, match_retention_days=args.match_days,
+                           session_retention_days=args.session_days)
+    moved = archive.archive()
+    print(f"📦 Archived {moved['matches']} matches and {moved['player_sessions']} sessions")
+    for partition, path in archive.partitions():
+        print(f"   🗄️ {partition}: {os.path.getsize(path) / 1024:.0f} KB ({path})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+PES 2021 Match Codec
+Versioned compact binary format for match rosters and match events
+Replaces JSON text in matches.team1_players / team2_players / match_data
+"""
+
+import json
+import random
+import sqlite3
+import struct
+import sys
+import time
+
+ROSTER_KIND = b'R'
+MATCH_DATA_KIND = b'M'
+ROSTER_VERSION = 2
+MATCH_DATA_VERSION = 2
+
+POSITIONS = ('any', 'GK', 'CB', 'LB', 'RB', 'DMF', 'CMF', 'LMF', 'RMF', 'AMF', 'LWF', 'RWF', 'SS', 'CF')
+POSITION_CODES = {name: code for code, name in enumerate(POSITIONS)}
+
+EVENT_TYPES = ('goal', 'own_goal', 'penalty_goal', 'yellow_card', 'red_card', 'substitution', 'injury')
+EVENT_CODES = {name: code for code, name in enumerate(EVENT_TYPES)}
+
+
+class RecordFormat:
+    """Dict records as fixed-size structs led by a presence mask.
+
+    Bit ``i`` of the mask says field ``i`` is in the dict, bit ``i + 4``
+    that its value is None, so dicts with any subset of the fields come
+    back exactly. ``fields`` are ``(key, struct code, names)`` where
+    ``names`` maps codes to strings (None for plain integers).
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.struct = struct.Struct('<B' + ''.join(code for _, code, _ in fields))
+        self.codes = [None if names is None else {name: code for code, name in enumerate(names)}
+                      for _, _, names in fields]
+        self.encode_layouts = {}
+        self.decode_layouts = {}
+
+    def encode_layout(self, keys):
+        layout = self.encode_layouts.get(keys)
+        if layout is None:
+            names = [name for name, _, _ in self.fields]
+            if set(keys) - set(names) or len(set(keys)) != len(keys):
+                raise ValueError("entry has fields the binary format does not store")
+            fields = [(name, bit + 1, 1 << (bit + 4), self.codes[bit]) for bit, name in enumerate(names) if name in keys]
+            layout = self.encode_layouts[keys] = (sum(1 << (index - 1) for _, index, _, _ in fields), fields)
+        return layout
+
+    def encode(self, entry):
+        """``[presence mask, *codes]`` for one dict"""
+        if not isinstance(entry, dict):
+            raise ValueError("entry is not an object")
+        mask, layout = self.encode_layout(tuple(entry))
+        record = [mask] + [0] * len(self.fields)
+        for name, index, null, codes in layout:
+            value = entry[name]
+            if value is None:
+                record[0] |= null
+            elif codes is not None:
+                code = codes.get(value) if isinstance(value, str) else None
+                if code is None:
+                    raise ValueError(f"unknown {name} {value!r}")
+                record[index] = code
+            elif value.__class__ is int:
+                record[index] = value
+            else:
+                raise ValueError(f"{name} {value!r} is not an integer")
+        return record
+
+    def pack(self, entries):
+        values = []
+        for entry in entries:
+            values += self.encode(entry)
+        try:
+            return struct.pack('<' + self.struct.format[1:] * len(entries), *values)
+        except struct.error as e:
+            raise ValueError(str(e)) from None
+
+    def decode_layout(self, mask):
+        layout = self.decode_layouts.get(mask)
+        if layout is None:
+            layout = self.decode_layouts[mask] = [
+                (name, None if mask >> (bit + 4) & 1 else bit + 1, names)
+                for bit, (name, _, names) in enumerate(self.fields) if mask >> bit & 1]
+        return layout
+
+    def unpack(self, blob):
+        """Dicts from ``blob``, a run of records"""
+        decoded = []
+        for record in self.struct.iter_unpack(blob):
+            entry = {}
+            for name, index, names in self.decode_layout(record[0]):
+                if index is None:
+                    entry[name] = None
+                elif names is None:
+                    entry[name] = record[index]
+                else:
+                    entry[name] = names[record[index]]
+            decoded.append(entry)
+        return decoded
+
+
+# kind, version, item count
+HEADER = struct.Struct('<cBH')
+# v2: header flags
+FLAGS = struct.Struct('<B')
+ROSTER_IDS_ONLY = 0x01
+MATCH_HAS_EVENTS = 0x01
+ROSTER_ENTRY = RecordFormat((('player_id', 'I', None), ('position', 'B', POSITIONS), ('rating', 'B', None)))
+EVENT_ENTRY = RecordFormat((('minute', 'H', None), ('type', 'B', EVENT_TYPES), ('team', 'B', None),
+                            ('player_id', 'I', None)))
+# v1 records: player_id, position code, rating (0 = unknown) / minute, event type code, team, player_id (0 = none)
+PLAYER_V1 = struct.Struct('<IBB')
+EVENT_V1 = struct.Struct('<HBBI')
+
+
+def encode_header(kind, version, count, flags):
+    try:
+        return HEADER.pack(kind, version, count) + FLAGS.pack(flags)
+    except struct.error as e:
+        raise ValueError(str(e)) from None
+
+
+def encode_roster(players):
+    """Pack a roster: a list of player ids, or of {'player_id', 'position', 'rating'} dicts (any subset).
+
+    Raises ValueError for anything the binary format cannot hold exactly
+    (non-integer ids, unknown positions, mixed lists); callers fall back
+    to JSON then.
+    """
+    players = players or []
+    if all(player.__class__ is int for player in players):
+        header = encode_header(ROSTER_KIND, ROSTER_VERSION, len(players), ROSTER_IDS_ONLY)
+        try:
+            return header + struct.pack(f'<{len(players)}I', *players)
+        except struct.error as e:
+            raise ValueError(str(e)) from None
+    return encode_header(ROSTER_KIND, ROSTER_VERSION, len(players), 0) + ROSTER_ENTRY.pack(players)
+
+
+def decode_roster(blob):
+    """Roster in the shape it was packed in (v1 blobs: {'player_id', 'position', 'rating'} dicts)"""
+    kind, version, count = HEADER.unpack_from(blob, 0)
+    if kind != ROSTER_KIND or version not in (1, ROSTER_VERSION):
+        raise ValueError(f"unsupported roster format {kind!r} v{version}")
+    if version == 1:
+        end = HEADER.size + count * PLAYER_V1.size
+        return [{'player_id': player_id, 'position': POSITIONS[position], 'rating': rating or None}
+                for player_id, position, rating in PLAYER_V1.iter_unpack(blob[HEADER.size:end])]
+    flags, = FLAGS.unpack_from(blob, HEADER.size)
+    start = HEADER.size + FLAGS.size
+    if flags & ROSTER_IDS_ONLY:
+        return list(struct.unpack_from(f'<{count}I', blob, start))
+    return ROSTER_ENTRY.unpack(blob[start:start + count * ROSTER_ENTRY.struct.size])
+
+
+def encode_match_data(match_data):
+    """Pack ``match_data['events']`` as fixed-size records; other keys ride along as compact JSON"""
+    match_data = dict(match_data or {})
+    has_events = 'events' in match_data
+    events = match_data.pop('events', None)
+    if has_events and not isinstance(events, list):
+        raise ValueError("match events are not a list")
+    events = events or []
+    out = (encode_header(MATCH_DATA_KIND, MATCH_DATA_VERSION, len(events), MATCH_HAS_EVENTS if has_events else 0)
+           + EVENT_ENTRY.pack(events))
+    if match_data:
+        out += json.dumps(match_data, separators=(',', ':')).encode('utf-8')
+    return out
+
+
+def decode_match_data(blob):
+    kind, version, count = HEADER.unpack_from(blob, 0)
+    if kind != MATCH_DATA_KIND or version not in (1, MATCH_DATA_VERSION):
+        raise ValueError(f"unsupported match data format {kind!r} v{version}")
+    if version == 1:
+        end = HEADER.size + count * EVENT_V1.size
+        match_data = json.loads(blob[end:]) if len(blob) > end else {}
+        if count:
+            match_data['events'] = [{'minute': minute, 'type': EVENT_TYPES[code], 'team': team,
+                                     'player_id': player_id or None}
+                                    for minute, code, team, player_id in EVENT_V1.iter_unpack(blob[HEADER.size:end])]
+        return match_data
+    flags, = FLAGS.unpack_from(blob, HEADER.size)
+    start = HEADER.size + FLAGS.size
+    end = start + count * EVENT_ENTRY.struct.size
+    match_data = json.loads(blob[end:]) if len(blob) > end else {}
+    if flags & MATCH_HAS_EVENTS:
+        match_data['events'] = EVENT_ENTRY.unpack(blob[start:end])
+    return match_data
+
+
+def pack_roster(players):
+    """Column value for a roster: binary when it decodes back to exactly ``players``, JSON text otherwise"""
+    players = players or []
+    try:
+        encoded = encode_roster(players)
+        if decode_roster(encoded) == players:
+            return encoded
+    except (TypeError, ValueError):
+        pass
+    return json.dumps(players)
+
+
+def unpack_roster(value):
+    """Roster from a column value in either format"""
+    if not value:
+        return []
+    if isinstance(value, bytes):
+        return decode_roster(value)
+    return json.loads(value)
+
+
+def pack_match_data(match_data):
+    """Column value for match data: binary when it decodes back to exactly ``match_data``, JSON text otherwise"""
+    if match_data is None:
+        return None
+    try:
+        encoded = encode_match_data(match_data)
+        if decode_match_data(encoded) == match_data:
+            return encoded
+    except (TypeError, ValueError):
+        pass
+    return json.dumps(match_data)
+
+
+def unpack_match_data(value):
+    if not value:
+        return None
+    if isinstance(value, bytes):
+        return decode_match_data(value)
+    return json.loads(value)
+
+
+def migrate_matches(conn, batch_size=500, commit=True):
+    """Rewrite JSON text rosters / match data as binary; returns the number of rows converted.
+
+    Rows are converted in batches, each committed on its own unless
+    ``commit`` is False (the caller owns the transaction). Values that do
+    not parse or do not fit the binary format stay as they are.
+    """
+    converted = 0
+    last_rowid = 0
+    while True:
+        rows = conn.execute('''
+            SELECT rowid, team1_players, team2_players, match_data FROM matches
+            WHERE rowid > ? AND (typeof(team1_players) = 'text' OR typeof(team2_players) = 'text'
+                                 OR typeof(match_data) = 'text')
+            ORDER BY rowid LIMIT ?
+        ''', (last_rowid, batch_size)).fetchall()
+        if not rows:
+            return converted
+
+        updates = []
+        for rowid, *values in rows:
+            packed = []
+            for value, pack in zip(values, (pack_roster, pack_roster, pack_match_data)):
+                if isinstance(value, str):
+                    try:
+                        value = pack(json.loads(value)) if value else value
+                    except ValueError:
+                        pass
+                packed.append(value)
+            if packed != values:
+                updates.append(packed + [rowid])
+        conn.executemany('UPDATE matches SET team1_players = ?, team2_players = ?, match_data = ? '
+                         'WHERE rowid = ?', updates)
+        if commit:
+            conn.commit()
+        converted += len(updates)
+        last_rowid = rows[-1][0]
+
+
+def sample_roster(size=11, rng=random):
+    """A roster in one of the shapes seen in the matches table: ids only, without ratings, or full"""
+    shape = rng.randrange(3)
+    if shape == 0:
+        return [rng.randrange(1, 10 ** 6) for _ in range(size)]
+    if shape == 1:
+        return [{'player_id': rng.randrange(1, 10 ** 6), 'position': rng.choice(POSITIONS[1:])} for _ in range(size)]
+    return [{'player_id': rng.randrange(1, 10 ** 6), 'position': rng.choice(POSITIONS[1:]),
+             'rating': rng.randrange(60, 99)} for _ in range(size)]
+
+
+def sample_match_data(rng=random):
+    return {'events': [{'minute': rng.randrange(1, 95), 'type': rng.choice(EVENT_TYPES), 'team': rng.randrange(1, 3),
+                        'player_id': rng.randrange(1, 10 ** 6)} for _ in range(12)],
+            'stadium': 'Konami Stadium'}
+
+
+def benchmark(matches=20000):
+    """Compare JSON text and binary columns for a match history of ``matches`` rows"""
+    rng = random.Random(2021)
+    rows = [(str(i), sample_roster(rng=rng), sample_roster(rng=rng), sample_match_data(rng)) for i in range(matches)]
+    formats = {
+        'json': (json.dumps, json.loads, json.dumps, json.loads),
+        # The column values the match service really stores, round-trip check included
+        'binary': (pack_roster, unpack_roster, pack_match_data, unpack_match_data),
+    }
+
+    print(f"📊 {matches} matches, 2 × 11-player rosters (mixed shapes) and 12 events each")
+    for name, (pack, unpack, pack_data, unpack_data) in formats.items():
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE TABLE matches (id TEXT PRIMARY KEY, team1_players TEXT, team2_players TEXT, '
+                     'match_data TEXT)')
+
+        started = time.perf_counter()
+        encoded = [(match_id, pack(team1), pack(team2), pack_data(data)) for match_id, team1, team2, data in rows]
+        encode_time = time.perf_counter() - started
+        with conn:
+            conn.executemany('INSERT INTO matches VALUES (?, ?, ?, ?)', encoded)
+        write_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        decoded = [(unpack(team1), unpack(team2), unpack_data(data))
+                   for team1, team2, data in conn.execute('SELECT team1_players, team2_players, match_data '
+                                                          'FROM matches')]
+        read_time = time.perf_counter() - started
+
+        size = sum(len(team1) + len(team2) + len(data) for _, team1, team2, data in encoded)
+        stored_binary = sum(isinstance(value, bytes) for row in encoded for value in row[1:])
+        assert decoded == [row[1:] for row in rows]
+        print(f"   {name:>6}: {size / matches:7.1f} bytes/match | encode {encode_time * 1000:7.1f} ms | "
+              f"write {write_time * 1000:7.1f} ms | read+decode {read_time * 1000:7.1f} ms | "
+              f"{stored_binary / (3 * matches):4.0%} binary")
+        conn.close()
+
+
+def main():
+    """Benchmark the codec, or migrate a database: pes_match_codec.py --migrate [pes_server.db]"""
+    if '--migrate' in sys.argv:
+        args = [arg for arg in sys.argv[1:] if arg != '--migrate']
+        db_path = args[0] if args else 'pes_server.db'
+        conn = sqlite3.connect(db_path)
+        try:
+            print(f"✅ Converted {migrate_matches(conn)} match rows in {db_path} to the binary format")
+        finally:
+            conn.close()
+        return
+    benchmark()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+PES 2021 Match Lifecycle Service
+preparing → ready → in_progress → finished / aborted, persisted in the matches table
+All state timeouts share one heap-based timer thread
+"""
+
+import heapq
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from pes_match_codec import pack_match_data, pack_roster, unpack_match_data, unpack_roster
+
+MATCH_STATES = ('preparing', 'ready', 'in_progress', 'finished', 'aborted')
+ACTIVE_STATES = ('preparing', 'ready', 'in_progress')
+
+logger = logging.getLogger("pes_server.matches")
+
+TRANSITIONS = {
+    'preparing': ('ready', 'aborted'),
+    'ready': ('in_progress', 'aborted'),
+    'in_progress': ('finished', 'aborted'),
+    'finished': (),
+    'aborted': (),
+}
+
+MATCH_COLUMNS = ('id, lobby_id, team1_players, team2_players, status, created_at, started_at, ended_at, '
+                 'score_team1, score_team2, match_data')
+
+# Seconds a match may stay in a state before it is aborted
+STATE_TIMEOUTS = {
+    'preparing': 10 * 60,
+    'ready': 5 * 60,
+    'in_progress': 3 * 60 * 60,
+}
+
+
+class InvalidTransition(Exception):
+    """Requested state change is not allowed from the match's current state"""
+
+
+class TimerScheduler:
+    """One thread, one heap: cost per timer is O(log n) regardless of how many matches exist.
+
+    There is no cancel: a timer stays queued and its callback checks on
+    firing whether the state it was armed for still holds.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="pes-match-timers", daemon=True)
+        self.thread.start()
+
+    def call_at(self, deadline, callback, *args):
+        """Run ``callback(*args)`` at ``deadline`` (time.monotonic based)"""
+        with self.condition:
+            heapq.heappush(self.heap, (deadline, next(self.counter), callback, args))
+            if self.heap[0][0] == deadline:
+                self.condition.notify()
+
+    def call_later(self, delay, callback, *args):
+        self.call_at(time.monotonic() + delay, callback, *args)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and (not self.heap or self.heap[0][0] > time.monotonic()):
+                    self.condition.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                if not self.running:
+                    return
+                _, _, callback, args = heapq.heappop(self.heap)
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.exception("❌ Match timer callback failed: %s", e)
+
+
+def utc_timestamp():
+    """Timestamp in SQLite CURRENT_TIMESTAMP format"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def match_from_row(row):
+    """Match dict from a row selected with MATCH_COLUMNS"""
+    return {
+        'id': row[0],
+        'lobby_id': row[1],
+        'team1_players': unpack_roster(row[2]),
+        'team2_players': unpack_roster(row[3]),
+        'status': row[4],
+        'created_at': row[5],
+        'started_at': row[6],
+        'ended_at': row[7],
+        'score_team1': row[8],
+        'score_team2': row[9],
+        'match_data': unpack_match_data(row[10]),
+    }
+
+
+class MatchLifecycleService:
+    """Creates matches and moves them through their states with per-state timeouts.
+
+    SQLite is the source of truth: every transition is a conditional
+    ``UPDATE ... WHERE status = <expected>``, so concurrent callers (or
+    several server workers sharing the database) cannot apply conflicting
+    transitions, and a stale timer firing late is a no-op.
+    """
+
+    def __init__(self, db_path, scheduler=None, timeouts=None, archive=None, recover=True):
+        self.db_path = db_path
+        self.archive = archive
+        self.scheduler = scheduler or TimerScheduler()
+        self.timeouts = dict(STATE_TIMEOUTS, **(timeouts or {}))
+        if recover:
+            self.recover()
+
+    def get_connection(self):
+        return sqlite3.connect(self.db_path)
+
+    def recover(self):
+        """Re-arm timeouts for matches that were active when the server stopped"""
+        conn = self.get_connection()
+        try:
+            rows = conn.execute(
+                f"SELECT id, status FROM matches WHERE status IN ({','.join('?' * len(ACTIVE_STATES))})",
+                ACTIVE_STATES).fetchall()
+        finally:
+            conn.close()
+        for match_id, status in rows:
+            self._arm_timeout(match_id, status)
+        return len(rows)
+
+    def _arm_timeout(self, match_id, status):
+        timeout = self.timeouts.get(status)
+        if timeout:
+            self.scheduler.call_later(timeout, self._expire, match_id, status)
+
+    def schedule_archiving(self, interval=3600, first_delay=60):
+        """Run the archive pass every ``interval`` seconds on its own thread"""
+        self.scheduler.call_later(first_delay, self._start_archiving, interval)
+
+    def _start_archiving(self, interval):
+        # Archiving can take a while; keep the timer thread free for match timeouts
+        threading.Thread(target=self._archive, args=(interval,), name="pes-match-archive", daemon=True).start()
+
+    def _archive(self, interval):
+        try:
+            moved = self.archive.archive()
+            if any(moved.values()):
+                logger.info("📦 Archived %d matches and %d sessions", moved['matches'], moved['player_sessions'])
+        except sqlite3.Error as e:
+            logger.error("❌ Match archiving failed: %s", e)
+        finally:
+            self.scheduler.call_later(interval, self._start_archiving, interval)
+
+    def _expire(self, match_id, status):
+        try:
+            self.transition(match_id, 'aborted', expected=status)
+            logger.info("⏱️ Match %s aborted after timeout in '%s'", match_id, status)
+        except (InvalidTransition, KeyError):
+            # Already moved on; the timer was for an old state
+            pass
+
+    def create_match(self, lobby_id, team1_players=None, team2_players=None, match_data=None, match_id=None):
+        """Insert a new match in 'preparing' and arm its timeout; returns the match id"""
+        match_id = match_id or str(uuid.uuid4())
+        conn = self.get_connection()
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT INTO matches (id, lobby_id, team1_players, team2_players, status, created_at, match_data)
+                    VALUES (?, ?, ?, ?, 'preparing', ?, ?)
+                ''', (match_id, lobby_id, pack_roster(team1_players), pack_roster(team2_players),
+                      utc_timestamp(), pack_match_data(match_data)))
+        finally:
+            conn.close()
+        self._arm_timeout(match_id, 'preparing')
+        return match_id
+
+    def transition(self, match_id, new_status, expected=None, score_team1=None, score_team2=None,
+                   match_data=None):
+        """Move a match to ``new_status``; raises KeyError / InvalidTransition"""
+        if new_status not in MATCH_STATES:
+            raise InvalidTransition(f"Unknown match state '{new_status}'")
+
+        conn = self.get_connection()
+        try:
+            with conn:
+                row = conn.execute('SELECT status FROM matches WHERE id = ?', (match_id,)).fetchone()
+                if row is None:
+                    raise KeyError(match_id)
+                current = row[0]
+                if expected is not None and current != expected:
+                    raise InvalidTransition(f"Match is '{current}', expected '{expected}'")
+                if new_status not in TRANSITIONS.get(current, ()):
+                    raise InvalidTransition(f"Cannot go from '{current}' to '{new_status}'")
+
+                assignments = ['status = ?']
+                values = [new_status]
+                if new_status == 'in_progress':
+                    assignments.append('started_at = ?')
+                    values.append(utc_timestamp())
+                if new_status in ('finished', 'aborted'):
+                    assignments.append('ended_at = ?')
+                    values.append(utc_timestamp())
+                if score_team1 is not None:
+                    assignments.append('score_team1 = ?')
+                    values.append(int(score_team1))
+                if score_team2 is not None:
+                    assignments.append('score_team2 = ?')
+                    values.append(int(score_team2))
+                if match_data is not None:
+                    assignments.append('match_data = ?')
+                    values.append(pack_match_data(match_data))
+
+                cursor = conn.execute(f"UPDATE matches SET {', '.join(assignments)} WHERE id = ? AND status = ?",
+                                      values + [match_id, current])
+                if cursor.rowcount != 1:
+                    raise InvalidTransition(f"Match {match_id} changed concurrently")
+        finally:
+            conn.close()
+
+        self._arm_timeout(match_id, new_status)
+        return new_status
+
+    def get_match(self, match_id):
+        """Full match record as a dict (archived matches included), or None"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute(f'SELECT {MATCH_COLUMNS} FROM matches WHERE id = ?', (match_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return self.archive.get_match(match_id) if self.archive is not None else None
+        return match_from_row(row)
+
+    def get_statuses(self, match_ids=None):
+        """{match_id: status} for the given ids, or for all active matches"""
+        conn = self.get_connection()
+        try:
+            if match_ids is None:
+                rows = conn.execute(
+                    f"SELECT id, status FROM matches WHERE status IN ({','.join('?' * len(ACTIVE_STATES))})",
+                    ACTIVE_STATES).fetchall()
+                return dict(rows)
+            statuses = {}
+            match_ids = list(match_ids)
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(match_ids), 500):
+                chunk = match_ids[start:start + 500]
+                statuses.update(conn.execute(
+                    f"SELECT id, status FROM matches WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+            missing = [match_id for match_id in match_ids if match_id not in statuses]
+            if missing and self.archive is not None:
+                statuses.update(self.archive.get_statuses(missing))
+            return statuses
+        finally:
+            conn.close()
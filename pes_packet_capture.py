@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+PES 2021 Passive Packet Capture
+Linux AF_PACKET capture through a memory-mapped TPACKET_V3 RX ring,
+with an optional classic BPF filter on TCP/UDP ports
+"""
+
+import ctypes
+import mmap
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+SO_ATTACH_FILTER = 26
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+PACKET_OUTGOING = 4
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# struct tpacket_req3
+TPACKET_REQ3 = struct.Struct('7I')
+# struct tpacket_block_desc: version, offset_to_priv, then tpacket_hdr_v1 (block_status, num_pkts,
+# offset_to_first_pkt, ...)
+BLOCK_HEADER = struct.Struct('IIIII')
+BLOCK_STATUS_OFFSET = 8
+# struct tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len, tp_status, tp_mac, tp_net
+PACKET_HEADER = struct.Struct('IIIIIIHH')
+# struct sockaddr_ll follows the (16-byte aligned) tpacket3_hdr: family, protocol, ifindex, hatype, pkttype
+SOCKADDR_LL = struct.Struct('HHiHB')
+SOCKADDR_LL_OFFSET = 48
+# struct tpacket_stats_v3: packets, drops, freeze_q_cnt
+PACKET_STATS = struct.Struct('III')
+
+# Classic BPF opcodes
+BPF_LD_H_ABS = 0x28
+BPF_LD_B_ABS = 0x30
+BPF_LD_H_IND = 0x48
+BPF_LDX_B_MSH = 0xB1
+BPF_JEQ_K = 0x15
+BPF_JSET_K = 0x45
+BPF_RET_K = 0x06
+BPF_INSTRUCTION = struct.Struct('HBBI')
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+
+def compile_port_filter(ports, snaplen=0x40000):
+    """Classic BPF for "(tcp or udp) and (src or dst port in ports)" over IPv4 / IPv6 on Ethernet framing.
+
+    Returns a list of ``(code, jt, jf, k)``; jumps are resolved from labels
+    so the program stays readable. Non-first IPv4 fragments are dropped
+    (they carry no port numbers).
+    """
+    ports = sorted(set(ports))
+    if not ports or len(ports) > 60:
+        raise ValueError("port filter needs between 1 and 60 ports")
+
+    program = []  # (code, jt label, jf label, k) or a label string
+
+    def compare_ports(offset_code, offset):
+        program.append((offset_code, None, None, offset))
+        for port in ports:
+            program.append((BPF_JEQ_K, 'accept', None, port))
+
+    program += [
+        (BPF_LD_H_ABS, None, None, 12),
+        (BPF_JEQ_K, None, 'not_ipv4', ETH_P_IP),
+        (BPF_LD_B_ABS, None, None, 23),
+        (BPF_JEQ_K, 'ipv4_l4', None, IPPROTO_TCP),
+        (BPF_JEQ_K, 'ipv4_l4', 'drop', IPPROTO_UDP),
+        'ipv4_l4',
+        (BPF_LD_H_ABS, None, None, 20),
+        (BPF_JSET_K, 'drop', None, 0x1FFF),
+        (BPF_LDX_B_MSH, None, None, 14),
+    ]
+    compare_ports(BPF_LD_H_IND, 14)
+    compare_ports(BPF_LD_H_IND, 16)
+    program += [
+        (BPF_RET_K, None, None, 0),
+        'not_ipv4',
+        (BPF_JEQ_K, None, 'drop', ETH_P_IPV6),
+        (BPF_LD_B_ABS, None, None, 20),
+        (BPF_JEQ_K, 'ipv6_l4', None, IPPROTO_TCP),
+        (BPF_JEQ_K, 'ipv6_l4', 'drop', IPPROTO_UDP),
+        'ipv6_l4',
+    ]
+    compare_ports(BPF_LD_H_ABS, 54)
+    compare_ports(BPF_LD_H_ABS, 56)
+    program += [
+        'drop',
+        (BPF_RET_K, None, None, 0),
+        'accept',
+        (BPF_RET_K, None, None, snaplen),
+    ]
+
+    labels, instructions = {}, []
+    for item in program:
+        if isinstance(item, str):
+            labels[item] = len(instructions)
+        else:
+            instructions.append(item)
+
+    resolved = []
+    for index, (code, jt, jf, k) in enumerate(instructions):
+        offsets = []
+        for label in (jt, jf):
+            offset = labels[label] - index - 1 if label else 0
+            if not 0 <= offset <= 255:
+                raise ValueError("BPF jump out of range, too many ports")
+            offsets.append(offset)
+        resolved.append((code, offsets[0], offsets[1], k))
+    return resolved
+
+
+def attach_filter(sock, instructions):
+    """SO_ATTACH_FILTER with a struct sock_fprog {len, pointer} built through ctypes"""
+    code = b''.join(BPF_INSTRUCTION.pack(*instruction) for instruction in instructions)
+    buffer = ctypes.create_string_buffer(code, len(code))
+    fprog = struct.pack('HL', len(instructions), ctypes.addressof(buffer))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+    # The kernel copies the program during setsockopt
+    return buffer
+
+
+def parse_frame(frame):
+    """``(source, destination, protocol, payload)`` for a TCP/UDP over IPv4/IPv6 Ethernet frame, else None"""
+    if len(frame) < 34:
+        return None
+    ethertype = (frame[12] << 8) | frame[13]
+    if ethertype == ETH_P_IP:
+        ihl = (frame[14] & 0x0F) * 4
+        protocol = frame[23]
+        total_length = (frame[16] << 8) | frame[17]
+        if (frame[20] & 0x1F) | frame[21]:
+            return None  # non-first fragment
+        src_ip = socket.inet_ntop(socket.AF_INET, frame[26:30])
+        dst_ip = socket.inet_ntop(socket.AF_INET, frame[30:34])
+        l4 = 14 + ihl
+        end = min(len(frame), 14 + total_length)
+    elif ethertype == ETH_P_IPV6:
+        if len(frame) < 54:
+            return None
+        protocol = frame[20]
+        src_ip = f"[{socket.inet_ntop(socket.AF_INET6, frame[22:38])}]"
+        dst_ip = f"[{socket.inet_ntop(socket.AF_INET6, frame[38:54])}]"
+        l4 = 54
+        end = min(len(frame), 54 + ((frame[18] << 8) | frame[19]))
+    else:
+        return None
+
+    if protocol == IPPROTO_TCP:
+        if end < l4 + 20:
+            return None
+        payload_start = l4 + (frame[l4 + 12] >> 4) * 4
+        name = 'TCP'
+    elif protocol == IPPROTO_UDP:
+        if end < l4 + 8:
+            return None
+        payload_start = l4 + 8
+        name = 'UDP'
+    else:
+        return None
+    src_port = (frame[l4] << 8) | frame[l4 + 1]
+    dst_port = (frame[l4 + 2] << 8) | frame[l4 + 3]
+    return f"{src_ip}:{src_port}", f"{dst_ip}:{dst_port}", name, frame[payload_start:end]
+
+
+class PacketRingCapture:
+    """Passive capture from a TPACKET_V3 memory-mapped RX ring.
+
+    The kernel fills whole blocks of frames in the shared ring; we walk a
+    block in place (no ``recv`` per frame) and hand it back by resetting its
+    status. Needs Linux and CAP_NET_RAW. ``interface=None`` captures on
+    every interface; on loopback each packet is seen twice (out and in), so
+    outgoing copies there are skipped.
+    """
+
+    def __init__(self, interface=None, ports=None, block_size=1 << 20, block_count=16, frame_size=2048,
+                 block_timeout_ms=50):
+        self.interface = interface
+        self.ports = ports
+        self.block_size = block_size
+        self.block_count = block_count
+        self.frame_size = frame_size
+        self.block_timeout_ms = block_timeout_ms
+        self.sock = None
+        self.ring = None
+        self.filter_buffer = None
+        self.running = False
+        self.loopback_index = None
+        self.frames = 0
+
+    @staticmethod
+    def supported():
+        return sys.platform.startswith('linux') and hasattr(socket, 'AF_PACKET')
+
+    def open(self):
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            if self.ports:
+                # Before the ring exists, so no unfiltered frame is ever queued
+                self.filter_buffer = attach_filter(sock, compile_port_filter(self.ports))
+            sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            sock.setsockopt(SOL_PACKET, PACKET_RX_RING, TPACKET_REQ3.pack(
+                self.block_size, self.block_count, self.frame_size,
+                self.block_size // self.frame_size * self.block_count, self.block_timeout_ms, 0, 0))
+            self.ring = mmap.mmap(sock.fileno(), self.block_size * self.block_count, mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+            if self.interface:
+                sock.bind((self.interface, ETH_P_ALL))
+            try:
+                self.loopback_index = socket.if_nametoindex('lo')
+            except OSError:
+                self.loopback_index = None
+        except BaseException:
+            sock.close()
+            raise
+        self.sock = sock
+        return self
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def stats(self):
+        """Kernel counters since the last call: ``{'packets', 'drops', 'freeze_q_cnt'}``"""
+        raw = self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, PACKET_STATS.size)
+        return dict(zip(('packets', 'drops', 'freeze_q_cnt'), PACKET_STATS.unpack(raw)))
+
+    def read_block(self, index, on_frame):
+        """Walk one block handed to user space, then give it back to the kernel"""
+        ring = self.ring
+        base = index * self.block_size
+        _, _, status, num_packets, offset = BLOCK_HEADER.unpack_from(ring, base)
+        if not status & TP_STATUS_USER:
+            return False
+        view = memoryview(ring)
+        try:
+            position = base + offset
+            for _ in range(num_packets):
+                next_offset, sec, nsec, snaplen, _, _, mac, _ = PACKET_HEADER.unpack_from(ring, position)
+                _, _, ifindex, _, pkttype = SOCKADDR_LL.unpack_from(ring, position + SOCKADDR_LL_OFFSET)
+                if not (pkttype == PACKET_OUTGOING and ifindex == self.loopback_index):
+                    self.frames += 1
+                    on_frame(view[position + mac:position + mac + snaplen], sec + nsec / 1e9)
+                position += next_offset
+        finally:
+            view.release()
+            struct.pack_into('I', ring, base + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+        return True
+
+    def run(self, on_frame, poll_timeout=0.5):
+        """Call ``on_frame(frame_view, timestamp)`` for every captured frame until ``stop``.
+
+        ``frame_view`` points into the ring and is only valid during the
+        call: copy what you keep.
+        """
+        if self.sock is None:
+            self.open()
+        poller = select.poll()
+        poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+        self.running = True
+        block = 0
+        try:
+            while self.running:
+                if not self.read_block(block, on_frame):
+                    poller.poll(poll_timeout * 1000)
+                    continue
+                block = (block + 1) % self.block_count
+        finally:
+            self.close()
+
+    def stop(self):
+        self.running = False
+
+
+def main():
+    """Print TCP/UDP flows on PES ports: pes_packet_capture.py [interface] [seconds]"""
+    from pes_registry import load_registry
+
+    interface = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] != 'any' else None
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    ports = [port for port, _, _ in load_registry().ports()]
+    capture = PacketRingCapture(interface, ports).open()
+    print(f"🔬 TPACKET_V3 ring on {interface or 'all interfaces'}, ports {ports}, {seconds:.0f}s")
+
+    def on_frame(frame, timestamp):
+        parsed = parse_frame(frame)
+        if parsed:
+            source, destination, protocol, payload = parsed
+            print(f"📦 {protocol} {source} → {destination} | {len(payload)} bytes")
+
+    threading.Timer(seconds, capture.stop).start()
+    started = time.time()
+    capture.run(on_frame)
+    print(f"✅ {capture.frames} frames in {time.time() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+PES 2021 Payload Analysis
+Offline binary protocol inference over captured payloads with NumPy:
+per-offset entropy and constancy, length fields, n-grams, message clusters
+Needs numpy (pip install numpy); the capture tools themselves do not
+"""
+
+import argparse
+import json
+import struct
+import sys
+import time
+
+import numpy as np
+
+from pes_packet_capture import parse_frame
+
+PCAP_MAGIC = {b'\xd4\xc3\xb2\xa1': '<', b'\xa1\xb2\xc3\xd4': '>',
+              b'\x4d\x3c\xb2\xa1': '<', b'\xa1\xb2\x3c\x4d': '>'}
+LINKTYPE_ETHERNET = 1
+
+
+def load_interceptor_log(path):
+    """``(payload prefixes, sizes)`` from a pes_traffic_log_*.json (the log keeps the first 64 bytes)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        packets = [packet for packet in json.load(f) if packet.get('hex_dump')]
+    payloads = [bytes.fromhex(packet['hex_dump']) for packet in packets]
+    return payloads, [packet.get('size', len(payload)) for packet, payload in zip(packets, payloads)]
+
+
+def load_pcap(path):
+    """``(payloads, sizes)`` of TCP/UDP packets in a classic pcap file (tcpdump -w / Wireshark "pcap"), Ethernet link type"""
+    with open(path, 'rb') as f:
+        blob = f.read()
+    endian = PCAP_MAGIC.get(blob[:4])
+    if endian is None:
+        raise ValueError(f"{path}: not a classic pcap file (pcapng is not supported)")
+    linktype = struct.unpack_from(endian + 'I', blob, 20)[0]
+    if linktype != LINKTYPE_ETHERNET:
+        raise ValueError(f"{path}: link type {linktype}, only Ethernet captures are supported")
+
+    record = struct.Struct(endian + 'IIII')
+    view = memoryview(blob)
+    payloads = []
+    offset = 24
+    while offset + record.size <= len(blob):
+        _, _, captured, _ = record.unpack_from(blob, offset)
+        offset += record.size
+        parsed = parse_frame(view[offset:offset + captured])
+        offset += captured
+        if parsed and len(parsed[3]):
+            payloads.append(bytes(parsed[3]))
+    return payloads, [len(payload) for payload in payloads]
+
+
+def load_payloads(paths):
+    payloads, sizes = [], []
+    for path in paths:
+        loaded, loaded_sizes = load_interceptor_log(path) if path.endswith('.json') else load_pcap(path)
+        payloads += loaded
+        sizes += loaded_sizes
+    return payloads, sizes
+
+
+class PayloadMatrix:
+    """Captured payloads as one zero-padded ``(messages, width)`` uint8 matrix.
+
+    ``valid[i, j]`` tells whether message ``i`` really has a byte at offset
+    ``j``; every statistic only counts valid cells, so short messages do not
+    drown the tail offsets in padding zeros. ``sizes`` are the real message
+    lengths when the payloads are truncated (interceptor logs).
+    """
+
+    def __init__(self, payloads, width=64, sizes=None):
+        self.count = len(payloads)
+        self.width = width
+        stored = np.fromiter((len(payload) for payload in payloads), dtype=np.int64, count=self.count)
+        self.lengths = stored if sizes is None else np.asarray(sizes, dtype=np.int64)
+        # One join + frombuffer instead of a Python loop per byte
+        truncated = [payload[:width].ljust(width, b'\x00') for payload in payloads]
+        self.data = np.frombuffer(b''.join(truncated), dtype=np.uint8).reshape(self.count, width)
+        self.valid = np.arange(width)[None, :] < np.minimum(stored, self.lengths)[:, None]
+
+    def byte_histograms(self):
+        """``(width, 256)`` counts of each byte value per offset"""
+        offsets = np.broadcast_to(np.arange(self.width), self.data.shape)
+        keys = offsets[self.valid] * 256 + self.data[self.valid]
+        return np.bincount(keys, minlength=self.width * 256).reshape(self.width, 256)
+
+    def offset_entropy(self, histograms=None):
+        """Shannon entropy (bits) of the byte at each offset; NaN where no message is that long"""
+        histograms = self.byte_histograms() if histograms is None else histograms
+        totals = histograms.sum(axis=1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p = histograms / totals
+            entropy = np.maximum(-np.where(p > 0, p * np.log2(p), 0.0).sum(axis=1), 0.0)
+        entropy[totals[:, 0] == 0] = np.nan
+        return entropy
+
+    def field_constancy(self, histograms=None):
+        """Per offset: most common byte and the share of messages that have it"""
+        histograms = self.byte_histograms() if histograms is None else histograms
+        totals = histograms.sum(axis=1)
+        top = histograms.argmax(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = histograms[np.arange(self.width), top] / totals
+        share[totals == 0] = np.nan
+        return top, share
+
+    def length_fields(self, min_support=0.5, top=10, sample=4096):
+        """Offsets whose 1/2/4-byte value tracks the message length as ``length = value + bias``.
+
+        Every offset, size and byte order is checked at once: the candidate
+        values form a ``(messages, offsets)`` array, the most common
+        ``length - value`` of each column is taken from a sample of rows, and
+        the support is the share of all messages where it matches. Support is
+        relative to every message, so a field used by half the traffic is
+        still found.
+        """
+        data = self.data.astype(np.int64)
+        rows = np.random.default_rng(0).permutation(self.count)[:sample]
+        candidates = []
+        for size in (1, 2, 4):
+            if size > self.width:
+                continue
+            span = self.width - size + 1
+            covered = self.valid[:, size - 1:]
+            for endian in ('<', '>') if size > 1 else ('<',):
+                values = np.zeros((self.count, span), dtype=np.int64)
+                for i in range(size):
+                    shift = 8 * (i if endian == '<' else size - 1 - i)
+                    values |= data[:, i:i + span] << shift
+                bias = self.lengths[:, None] - values
+
+                modes = np.zeros(span, dtype=np.int64)
+                for offset in range(span):
+                    column = bias[rows, offset][covered[rows, offset]]
+                    if len(column):
+                        unique, counts = np.unique(column, return_counts=True)
+                        modes[offset] = unique[counts.argmax()]
+                matches = covered & (bias == modes[None, :])
+                support = matches.sum(axis=0) / self.count
+                # A constant column "matches" any constant-length traffic; the value has to move
+                varying = np.where(matches, values, -1).max(axis=0) > np.where(matches, values, 1 << 40).min(axis=0)
+                for offset in np.flatnonzero((support >= min_support) & varying):
+                    candidates.append({'offset': int(offset), 'size': size,
+                                       'endian': 'little' if endian == '<' else 'big',
+                                       'bias': int(modes[offset]), 'support': float(support[offset])})
+        candidates.sort(key=lambda c: (-c['support'], c['offset'], -c['size']))
+        return candidates[:top]
+
+    def ngrams(self, n=2, top=20):
+        """Most frequent byte n-grams (n ≤ 4) over the valid part of every message"""
+        if not 1 <= n <= 4:
+            raise ValueError("n must be between 1 and 4")
+        span = self.width - n + 1
+        keys = np.zeros((self.count, span), dtype=np.uint32)
+        for i in range(n):
+            keys = (keys << np.uint32(8)) | self.data[:, i:i + span]
+        inside = self.valid[:, n - 1:]
+        if n <= 2:
+            # Small key space: counting beats sorting
+            counts = np.bincount(keys[inside], minlength=1 << (8 * n))
+            unique = np.arange(len(counts))
+        else:
+            unique, counts = np.unique(keys[inside], return_counts=True)
+        order = np.argsort(counts)[::-1][:top]
+        return [(int(unique[i]).to_bytes(n, 'big'), int(counts[i])) for i in order]
+
+    def printable_ratio(self):
+        """Share of printable ASCII bytes per message (valid bytes only)"""
+        printable = ((self.data >= 0x20) & (self.data < 0x7F)) | np.isin(self.data, (0x09, 0x0A, 0x0D))
+        return (printable & self.valid).sum(axis=1) / np.maximum(self.valid.sum(axis=1), 1)
+
+    def cluster(self, k=8, prefix=16, max_entropy=3.0, entropy=None):
+        """Group messages by their structural bytes; returns (labels, per-cluster summaries).
+
+        Structural bytes are the offsets in the first ``prefix`` bytes whose
+        entropy stays under ``max_entropy`` bits (magic, type, flags). Random
+        body bytes are left out by that, and so are counters: the high byte
+        of a sequence number has low entropy too, but it changes between
+        consecutive messages far less often than an independent field with
+        the same byte distribution would. Messages sharing the structural
+        bytes form a cluster; the ``k`` biggest are reported and the rest
+        are labelled -1.
+        """
+        prefix = min(prefix, self.width)
+        histograms = self.byte_histograms()[:prefix]
+        entropy = self.offset_entropy(histograms) if entropy is None else entropy[:prefix]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p = histograms / histograms.sum(axis=1, keepdims=True)
+        expected_changes = 1.0 - np.nansum(p ** 2, axis=1)
+        both = self.valid[1:, :prefix] & self.valid[:-1, :prefix]
+        changed = (self.data[1:, :prefix] != self.data[:-1, :prefix]) & both
+        observed_changes = changed.sum(axis=0) / np.maximum(both.sum(axis=0), 1)
+        structural = (entropy < max_entropy) & (observed_changes >= 0.5 * expected_changes)
+        columns = np.flatnonzero(structural)
+        if len(columns) == 0:
+            columns = np.arange(min(4, prefix))
+        # 0x100 marks "message too short", so a missing byte never equals a real zero;
+        # rows are compared as opaque blobs, which np.unique sorts much faster than axis=0
+        signature = np.ascontiguousarray(np.where(self.valid[:, columns], self.data[:, columns].astype(np.uint16),
+                                                  0x100))
+        keys = signature.view(np.dtype((np.void, signature.dtype.itemsize * len(columns)))).ravel()
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        inverse = inverse.reshape(-1)
+        biggest = np.argsort(counts)[::-1][:k]
+        remap = np.full(len(counts), -1, dtype=np.int64)
+        remap[biggest] = np.arange(len(biggest))
+        labels = remap[inverse]
+
+        summaries = []
+        for label in range(len(biggest)):
+            members = labels == label
+            rows = self.data[members, :prefix]
+            constant = (rows == rows[0]).all(axis=0) & self.valid[members, :prefix].all(axis=0)
+            pattern = ' '.join(f'{byte:02x}' if fixed else '..' for byte, fixed in zip(rows[0], constant))
+            lengths = self.lengths[members]
+            summaries.append({'cluster': label, 'messages': int(members.sum()),
+                              'length_min': int(lengths.min()), 'length_median': int(np.median(lengths)),
+                              'length_max': int(lengths.max()), 'pattern': pattern})
+        return labels, summaries
+
+def report(matrix, clusters=8):
+    started = time.perf_counter()
+    histograms = matrix.byte_histograms()
+    entropy = matrix.offset_entropy(histograms)
+    top, share = matrix.field_constancy(histograms)
+    print(f"📊 {matrix.count} messages, length {matrix.lengths.min()}–{matrix.lengths.max()} "
+          f"(median {int(np.median(matrix.lengths))}), first {matrix.width} bytes analyzed")
+
+    print("\n🔬 Offset | entropy | most common byte (share)")
+    for offset in range(matrix.width):
+        if np.isnan(entropy[offset]):
+            break
+        kind = 'constant' if share[offset] >= 0.99 else 'low' if entropy[offset] < 2 else ''
+        print(f"   {offset:4d}   {entropy[offset]:5.2f}    0x{top[offset]:02x} ({share[offset]:6.1%}) {kind}")
+
+    print("\n📏 Length field candidates")
+    for candidate in matrix.length_fields() or []:
+        print(f"   offset {candidate['offset']:3d} uint{candidate['size'] * 8} {candidate['endian']:>6}: "
+              f"length = value {candidate['bias']:+d} ({candidate['support']:.1%} of messages)")
+
+    for n in (2, 4):
+        grams = ', '.join(f"{gram.hex()}×{count}" for gram, count in matrix.ngrams(n, top=8))
+        print(f"\n🔤 Top {n}-grams: {grams}")
+
+    text = matrix.printable_ratio()
+    print(f"\n📝 Mostly text (>90% printable): {(text > 0.9).mean():.1%} of messages")
+
+    labels, summaries = matrix.cluster(clusters, entropy=entropy)
+    print(f"\n🧩 {len(summaries)} biggest message kinds (first 16 bytes, '..' = varies), "
+          f"{(labels < 0).sum()} messages in smaller ones")
+    for summary in summaries:
+        print(f"   #{summary['cluster']:<2} {summary['messages']:7d} msgs | len {summary['length_min']}–"
+              f"{summary['length_max']} (median {summary['length_median']}) | {summary['pattern']}")
+    print(f"\n✅ Analysis took {time.perf_counter() - started:.2f}s")
+
+
+def synthetic_payloads(count=200000, seed=2021):
+    """PES-like binary messages: magic, type, little-endian length, sequence, body (+ some HTTP)"""
+    rng = np.random.default_rng(seed)
+    types = rng.integers(1, 6, count).tolist()
+    bodies = rng.integers(8, 120, count).tolist()
+    noise = rng.integers(0, 256, sum(bodies), dtype=np.uint8).tobytes()
+    http = b'GET /XME994-E1/info/info_en.txt HTTP/1.1\r\nHost: pes21-x64-gate.cs.konami.net\r\n\r\n'
+    header = struct.Struct('<3sBHI')
+    payloads = []
+    position = 0
+    for sequence, (message_type, body) in enumerate(zip(types, bodies), 1):
+        if message_type == 5:
+            payloads.append(http)
+        else:
+            payloads.append(header.pack(b'PES', message_type, 10 + body, sequence) + noise[position:position + body])
+        position += body
+    return payloads
+
+
+def main():
+    """Analyze captures: pes_payload_analysis.py capture.pcap pes_traffic_log_*.json (or --synthetic N)"""
+    parser = argparse.ArgumentParser(description="Offline PES payload analysis")
+    parser.add_argument('captures', nargs='*', help="pcap files or pes_traffic_log_*.json")
+    parser.add_argument('--width', type=int, default=64, help="bytes per message to analyze")
+    parser.add_argument('--clusters', type=int, default=8)
+    parser.add_argument('--synthetic', type=int, metavar='N', help="analyze N generated messages instead")
+    args = parser.parse_args()
+
+    sizes = None
+    if args.synthetic:
+        payloads = synthetic_payloads(args.synthetic)
+    elif args.captures:
+        payloads, sizes = load_payloads(args.captures)
+    else:
+        parser.print_help()
+        return
+    if not payloads:
+        print("❌ No payloads found")
+        sys.exit(1)
+
+    started = time.perf_counter()
+    matrix = PayloadMatrix(payloads, args.width, sizes)
+    print(f"📥 Loaded {len(payloads)} payloads in {time.perf_counter() - started:.2f}s")
+    report(matrix, args.clusters)
+
+
+if __name__ == "__main__":
+    main()
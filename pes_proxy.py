@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+PES 2021 Forwarding Proxy
+Transparent TCP forwarding (PES ↔ game server) with inline inspection
+Copy relay by default, optional splice() on Linux; payload copies go to the analyzer on the side
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+
+CHUNK_SIZE = 65536
+PIPE_SIZE = 1 << 20
+F_SETPIPE_SZ = 1031
+SPLICE_F_MOVE = 0x01
+SPLICE_F_NONBLOCK = 0x02
+
+
+def load_tee():
+    """libc tee(2) through ctypes (the os module has splice but not tee), or None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        tee = libc.tee
+    except (OSError, AttributeError):
+        return None
+    tee.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_size_t, ctypes.c_uint)
+    tee.restype = ctypes.c_ssize_t
+    return tee
+
+
+class ForwardingProxy:
+    """Accepts on ``listen`` and relays each connection to ``upstream``, both directions.
+
+    The default relay is recv_into/sendall with one reused buffer per
+    direction. ``zero_copy`` (Linux with ``os.splice``) moves data socket →
+    pipe → socket in the kernel instead, and when inspecting ``tee(2)``
+    duplicates the pipe contents into a tap pipe; on loopback it measured
+    no faster than the copy relay, so it is opt-in. Payload copies are
+    queued for the analyzer without waiting, so a slow analyzer drops samples instead of slowing the
+    game down. A connection with no traffic in either direction for
+    ``idle_timeout`` seconds is closed, so half-open peers do not hold
+    relay threads forever.
+    """
+
+    def __init__(self, listen, upstream, on_payload=None, zero_copy=False, queue_size=1024, idle_timeout=300.0):
+        self.listen = listen
+        self.upstream = upstream
+        self.on_payload = on_payload
+        self.tee = load_tee() if on_payload and zero_copy else None
+        self.zero_copy = zero_copy and hasattr(os, 'splice') and (on_payload is None or self.tee is not None)
+        self.idle_timeout = idle_timeout
+        self.samples = queue.Queue(queue_size)
+        self.server = None
+        self.running = False
+        # Relay threads update these concurrently
+        self.stats_lock = threading.Lock()
+        self.connections = 0
+        self.dropped_samples = 0
+
+    def start(self):
+        family = socket.AF_INET6 if ':' in self.listen[0] else socket.AF_INET
+        self.server = socket.create_server(self.listen, family=family)
+        self.listen = self.server.getsockname()[:2]
+        self.running = True
+        threading.Thread(target=self.accept_loop, name="pes-proxy-accept", daemon=True).start()
+        if self.on_payload:
+            threading.Thread(target=self.analyzer_loop, name="pes-proxy-analyzer", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.server is not None:
+            self.server.close()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                client, address = self.server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.handle_connection, args=(client, address), daemon=True).start()
+
+    def handle_connection(self, client, address):
+        try:
+            upstream = socket.create_connection(self.upstream, timeout=10)
+        except OSError as e:
+            print(f"⚠️ Proxy: upstream {format_address(self.upstream)} unreachable: {e}")
+            client.close()
+            return
+        upstream.settimeout(None)
+        for sock in (client, upstream):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.set_idle_timeout(sock)
+        with self.stats_lock:
+            self.connections += 1
+
+        client_name = format_address(address)
+        upstream_name = format_address(self.upstream)
+        relay = self.relay_splice if self.zero_copy else self.relay_copy
+        # Last time either direction moved data; a relay timing out only gives up once both are quiet
+        activity = [time.monotonic()]
+        reverse = threading.Thread(target=relay, args=(upstream, client, upstream_name, client_name, activity),
+                                   daemon=True)
+        reverse.start()
+        relay(client, upstream, client_name, upstream_name, activity)
+        reverse.join()
+        client.close()
+        upstream.close()
+
+    def set_idle_timeout(self, sock):
+        if not self.idle_timeout:
+            return
+        if sys.platform == 'win32':
+            sock.settimeout(self.idle_timeout)
+            return
+        # Kernel-side timeouts keep the socket blocking: splice() needs that, and recv skips a poll() per call
+        seconds = int(self.idle_timeout)
+        timeval = struct.pack('ll', seconds, int((self.idle_timeout - seconds) * 1e6))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, timeval)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, timeval)
+
+    def idle(self, activity):
+        return time.monotonic() - activity[0] >= self.idle_timeout
+
+    @staticmethod
+    def abort(*socks):
+        """Shut both ends down; wakes the other direction's relay as well"""
+        for sock in socks:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def sample(self, data, source, destination):
+        try:
+            self.samples.put_nowait((data, source, destination))
+        except queue.Full:
+            with self.stats_lock:
+                self.dropped_samples += 1
+
+    def relay_copy(self, source, destination, source_name, destination_name, activity):
+        buffer = bytearray(CHUNK_SIZE)
+        view = memoryview(buffer)
+        try:
+            while True:
+                try:
+                    received = source.recv_into(buffer)
+                except (BlockingIOError, TimeoutError):
+                    # Receive timeout expired
+                    if self.idle(activity):
+                        self.abort(source, destination)
+                        break
+                    continue
+                if not received:
+                    break
+                activity[0] = time.monotonic()
+                destination.sendall(view[:received])
+                if self.on_payload:
+                    self.sample(bytes(view[:received]), source_name, destination_name)
+        except (BlockingIOError, TimeoutError):
+            # The receiver stopped reading for idle_timeout seconds
+            self.abort(source, destination)
+        except OSError:
+            pass
+        finally:
+            self.half_close(destination)
+
+    def relay_splice(self, source, destination, source_name, destination_name, activity):
+        pipe_r, pipe_w = os.pipe()
+        tap_r, tap_w = os.pipe() if self.on_payload else (None, None)
+        try:
+            # A bigger pipe moves more pages per splice call (the default holds 16)
+            for fd in (pipe_w, tap_w):
+                if fd is not None:
+                    try:
+                        fcntl.fcntl(fd, F_SETPIPE_SZ, PIPE_SIZE)
+                    except OSError:
+                        pass
+            source_fd, destination_fd = source.fileno(), destination.fileno()
+            while True:
+                try:
+                    received = os.splice(source_fd, pipe_w, PIPE_SIZE, flags=SPLICE_F_MOVE)
+                except BlockingIOError:
+                    # SO_RCVTIMEO expired
+                    if self.idle(activity):
+                        self.abort(source, destination)
+                        break
+                    continue
+                if not received:
+                    break
+                activity[0] = time.monotonic()
+                copied = 0
+                if tap_w is not None:
+                    copied = self.tee(pipe_r, tap_w, received, SPLICE_F_NONBLOCK)
+                pending = received
+                while pending:
+                    pending -= os.splice(pipe_r, destination_fd, pending, flags=SPLICE_F_MOVE)
+                if copied > 0:
+                    # Forwarded already; now the analyzer's copy
+                    self.sample(os.read(tap_r, copied), source_name, destination_name)
+        except BlockingIOError:
+            # SO_SNDTIMEO expired: the receiver stopped reading
+            self.abort(source, destination)
+        except OSError as e:
+            if e.errno not in (errno.ECONNRESET, errno.EPIPE, errno.EBADF, errno.ENOTCONN):
+                print(f"⚠️ Proxy relay {source_name} → {destination_name}: {e}")
+        finally:
+            for fd in (pipe_r, pipe_w, tap_r, tap_w):
+                if fd is not None:
+                    os.close(fd)
+            self.half_close(destination)
+
+    @staticmethod
+    def half_close(sock):
+        try:
+            sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    def analyzer_loop(self):
+        while self.running:
+            try:
+                data, source, destination = self.samples.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.on_payload(data, source, destination)
+            except Exception as e:
+                print(f"⚠️ Proxy analyzer error: {e}")
+
+
+def split_host_port(value):
+    """``HOST:PORT``, ``[IPv6]:PORT`` or a bare ``PORT`` → (host or '', port string)"""
+    if value.startswith('['):
+        host, _, rest = value[1:].partition(']')
+        return host, rest[1:] if rest.startswith(':') else ''
+    host, _, port = value.rpartition(':')
+    return host, port
+
+
+def format_address(address):
+    """(host, port) as ``host:port``, brackets around IPv6 hosts"""
+    host, port = address[:2]
+    return f"[{host}]:{port}" if ':' in host else f"{host}:{port}"
+
+
+def parse_route(value):
+    """``[LISTEN_HOST:]LISTEN_PORT=HOST:PORT`` → ((listen host, port), (upstream host, port))
+
+    IPv6 hosts go in brackets (``[::1]:8080``); the listen host defaults to 0.0.0.0.
+    """
+    listen, _, upstream = value.partition('=')
+    listen_host, listen_port = split_host_port(listen)
+    host, port = split_host_port(upstream)
+    if not listen_port.isdigit() or not host or not port.isdigit():
+        raise argparse.ArgumentTypeError(f"expected [LISTEN_HOST:]LISTEN_PORT=HOST:PORT, got {value!r}")
+    return (listen_host or '0.0.0.0', int(listen_port)), (host, int(port))
+
+
+def echo_server():
+    """Loopback upstream for the benchmark: echoes small messages, swallows bulk uploads"""
+    server = socket.create_server(('127.0.0.1', 0))
+
+    def serve(conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buffer = bytearray(CHUNK_SIZE)
+        with conn:
+            try:
+                while True:
+                    received = conn.recv_into(buffer)
+                    if not received:
+                        return
+                    if received < 1024:
+                        conn.sendall(buffer[:received])
+            except OSError:
+                return
+
+    def accept():
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server.getsockname()[:2]
+
+
+def measure(address, round_trips=5000, bulk_bytes=256 << 20):
+    """Request/response latency (p50/p99 in µs) and one-way bulk throughput (MB/s) to ``address``"""
+    conn = socket.create_connection(address)
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    message = b'GET /XME994-E1/info/info_en.txt HTTP/1.1\r\n\r\n'
+    latencies = []
+    for _ in range(round_trips):
+        started = time.perf_counter()
+        conn.sendall(message)
+        received = 0
+        while received < len(message):
+            received += len(conn.recv(4096))
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+    latencies.sort()
+
+    conn = socket.create_connection(address)
+    chunk = b'\x00' * (1 << 20)
+    started = time.perf_counter()
+    for _ in range(bulk_bytes // len(chunk)):
+        conn.sendall(chunk)
+    conn.shutdown(socket.SHUT_WR)
+    conn.recv(1)
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return (latencies[len(latencies) // 2] * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6,
+            bulk_bytes / elapsed / 1e6)
+
+
+def benchmark():
+    """Direct vs proxied on loopback, for each relay mode"""
+    upstream = echo_server()
+    seen = [0]
+
+    def count(data, source, destination):
+        seen[0] += len(data)
+
+    print("📊 Loopback, 5000 × 44-byte round trips + 256 MB upload")
+    p50, p99, throughput = measure(upstream)
+    print(f"   {'direct':>22}: p50 {p50:7.1f} µs | p99 {p99:7.1f} µs | {throughput:7.0f} MB/s")
+    modes = [('copy', False, None), ('copy + inspect', False, count)]
+    if hasattr(os, 'splice'):
+        modes += [('splice', True, None), ('splice + tee inspect', True, count)]
+    for name, zero_copy, on_payload in modes:
+        proxy = ForwardingProxy(('127.0.0.1', 0), upstream, on_payload, zero_copy=zero_copy).start()
+        p50_proxied, p99_proxied, throughput = measure(proxy.listen)
+        proxy.stop()
+        print(f"   {name:>22}: p50 {p50_proxied:7.1f} µs | p99 {p99_proxied:7.1f} µs | {throughput:7.0f} MB/s"
+              f" | +{p50_proxied - p50:.1f} µs")
+
+
+def main():
+    """Run the benchmark, or forward: pes_proxy.py 8080=127.0.0.1:80 (or 127.0.0.1:8080=[::1]:80)"""
+    parser = argparse.ArgumentParser(description="PES 2021 forwarding proxy")
+    parser.add_argument('route', nargs='?', type=parse_route, help="[LISTEN_HOST:]LISTEN_PORT=HOST:PORT")
+    parser.add_argument('--zero-copy', action='store_true', help="relay with splice() (Linux)")
+    parser.add_argument('--idle-timeout', type=float, default=300.0,
+                        help="close connections idle this many seconds (0 = never)")
+    args = parser.parse_args()
+    if args.route is None:
+        benchmark()
+        return
+
+    listen, upstream = args.route
+    proxy = ForwardingProxy(listen, upstream, zero_copy=args.zero_copy, idle_timeout=args.idle_timeout).start()
+    print(f"🔀 Forwarding {format_address(proxy.listen)} → {format_address(upstream)} "
+          f"({'splice' if proxy.zero_copy else 'copy'}), Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        proxy.stop()
+        print(f"✅ Proxy stopped after {proxy.connections} connections")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+PES 2021 Redirect Registry
+Single source of PES domains, server IPs and ports for all tools
+Compiled into a suffix trie (domains) and a radix tree (IPs/CIDRs)
+"""
+
+import ipaddress
+import json
+import os
+import sys
+
+DEFAULT_REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pes_registry.json')
+
+
+class DomainSuffixTrie:
+    """Trie over reversed domain labels; lookup cost is the number of labels.
+
+    ``*.example.com`` entries match any name below example.com (not the bare
+    domain). Exact entries win over wildcards; deeper wildcards win over
+    shallower ones.
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, domain, value):
+        domain = domain.lower().rstrip('.')
+        wildcard = domain.startswith('*.')
+        if wildcard:
+            domain = domain[2:]
+        node = self.root
+        for label in reversed(domain.split('.')):
+            node = node.setdefault(label, {})
+        # Keys '' and '*' can never be labels, so they mark entries
+        node.setdefault('*' if wildcard else '', value)
+
+    def lookup(self, name):
+        """Value for ``name`` or None"""
+        node = self.root
+        match = None
+        for label in reversed(name.lower().rstrip('.').split('.')):
+            match = node.get('*', match)
+            node = node.get(label)
+            if node is None:
+                return match
+        return node.get('', match)
+
+
+class IPRadixTree:
+    """Binary radix tree for longest-prefix matching of IPv4/IPv6 addresses and CIDRs"""
+
+    def __init__(self):
+        self.roots = {4: [None, None, None], 6: [None, None, None]}
+
+    def insert(self, network, value):
+        network = ipaddress.ip_network(network, strict=False)
+        bits = int(network.network_address)
+        width = network.max_prefixlen
+        node = self.roots[network.version]
+        for i in range(network.prefixlen):
+            bit = (bits >> (width - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[2] is None:
+            node[2] = value
+
+    def lookup(self, address):
+        """Value of the longest matching prefix for ``address`` or None"""
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return None
+        bits = int(address)
+        width = address.max_prefixlen
+        node = self.roots[address.version]
+        match = node[2]
+        for i in range(width):
+            node = node[(bits >> (width - 1 - i)) & 1]
+            if node is None:
+                break
+            if node[2] is not None:
+                match = node[2]
+        return match
+
+
+class PESRegistry:
+    """Compiled view of pes_registry.json"""
+
+    def __init__(self, config):
+        self.config = config
+        self.local_server_ip = config.get('local_server_ip', '127.0.0.1')
+        self.domain_trie = DomainSuffixTrie()
+        self.ip_tree = IPRadixTree()
+        self.port_names = {}
+
+        # Insertion order decides the group reported for names listed twice
+        for group, domains in config.get('domains', {}).items():
+            for domain in domains:
+                self.domain_trie.insert(domain, group)
+        for group, networks in config.get('ips', {}).items():
+            for network in networks:
+                self.ip_tree.insert(network, group)
+        for entry in config.get('ports', []):
+            self.port_names[(entry['port'], entry.get('protocol', 'TCP').upper())] = entry.get('name', '')
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or os.environ.get('PES_REGISTRY', DEFAULT_REGISTRY_PATH)
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def domains(self, *groups):
+        """Configured domains of the given groups (all groups if none), without duplicates"""
+        selected = self.config.get('domains', {})
+        names = []
+        for group in groups or selected:
+            for domain in selected.get(group, []):
+                if domain not in names:
+                    names.append(domain)
+        return names
+
+    def ips(self, *groups):
+        selected = self.config.get('ips', {})
+        networks = []
+        for group in groups or selected:
+            for network in selected.get(group, []):
+                if network not in networks:
+                    networks.append(network)
+        return networks
+
+    def ports(self):
+        """[(port, protocol, name)] in config order"""
+        return [(port, protocol, name) for (port, protocol), name in self.port_names.items()]
+
+    def domain_group(self, name):
+        return self.domain_trie.lookup(name) if name else None
+
+    def ip_group(self, address):
+        return self.ip_tree.lookup(address)
+
+    def is_pes_domain(self, name):
+        return self.domain_group(name) is not None
+
+    def is_pes_ip(self, address):
+        return self.ip_group(address) is not None
+
+    def is_pes_port(self, port, protocol='TCP'):
+        return (port, protocol.upper()) in self.port_names
+
+    def classify(self, host):
+        """Group for a host that may be a name, an IP, or either with ':port'"""
+        if host.startswith('['):
+            host = host[1:host.find(']')]
+        elif host.count(':') == 1:
+            host = host.split(':')[0]
+        return self.ip_group(host) or self.domain_group(host)
+
+
+_default_registry = None
+
+
+def load_registry(path=None):
+    """Shared registry instance (loaded once per process unless a path is given)"""
+    global _default_registry
+    if path is not None:
+        return PESRegistry.load(path)
+    if _default_registry is None:
+        _default_registry = PESRegistry.load()
+    return _default_registry
+
+
+def main():
+    """Classify hosts given on the command line"""
+    registry = load_registry()
+    print(f"📚 Registry: {len(registry.domains())} domains, {len(registry.ips())} IPs/CIDRs, "
+          f"{len(registry.port_names)} ports")
+    for host in sys.argv[1:]:
+        group = registry.classify(host)
+        print(f"   {'🎯' if group else '🌐'} {host} → {group or 'not PES'}")
+
+
+if __name__ == "__main__":
+    main()
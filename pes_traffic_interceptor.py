@@ -4,6 +4,7 @@ PES 2021 Traffic Interceptor - Advanced Protocol Analysis
 Real-time capture and analysis of PES network traffic
 """
 
+import argparse
 import socket
 import struct
 import threading
@@ -12,12 +13,19 @@ import json
 from datetime import datetime
 import binascii
 
+from pes_registry import load_registry
+from pes_packet_capture import PacketRingCapture, parse_frame
+from pes_proxy import ForwardingProxy, format_address, parse_route
+
 class PESTrafficInterceptor:
     """Advanced PES traffic analysis and interception"""
     
     def __init__(self):
         self.running = False
         self.captured_packets = []
+        self.registry = load_registry()
+        self.ring_capture = None
+        self.proxies = []
         self.protocol_patterns = {
             # Known PES signatures from reverse engineering
             b'PES21': 'PES 2021 Protocol Header',
@@ -48,6 +56,7 @@ class PESTrafficInterceptor:
             'patterns_found': [],
             'decoded_text': '',
             'protocol_guess': 'Unknown',
+            'pes_endpoint': self.registry.classify(source) or self.registry.classify(dest),
             'interesting': False
         }
         
@@ -82,7 +91,8 @@ class PESTrafficInterceptor:
             analysis['protocol_guess'] = 'Binary Protocol'
         
         # Check if this looks like game traffic
-        if (analysis['interesting'] or 
+        if (analysis['interesting'] or
+            analysis['pes_endpoint'] or 
             'pes' in analysis['decoded_text'].lower() or
             'konami' in analysis['decoded_text'].lower() or
             'lobby' in analysis['decoded_text'].lower()):
@@ -148,15 +158,8 @@ class PESTrafficInterceptor:
             except Exception as e:
                 print(f"❌ Failed to monitor port {port}: {e}")
         
-        # Monitor key ports
-        key_ports = [
-            (80, 'TCP'),    # HTTP
-            (443, 'TCP'),   # HTTPS
-            (8000, 'TCP'),  # Game server
-            (5739, 'UDP'),  # P2P
-            (5740, 'UDP'),  # P2P
-            (3478, 'UDP'),  # STUN
-        ]
+        # Monitor key ports (from pes_registry.json)
+        key_ports = [(port, protocol) for port, protocol, name in self.registry.ports()]
         
         for port, protocol in key_ports:
             thread = threading.Thread(
@@ -169,6 +172,45 @@ class PESTrafficInterceptor:
         
         return capture_methods
     
+    def setup_passive_capture(self, interface=None, all_ports=False):
+        """Observe traffic on the wire instead of listening on the ports (Linux, needs root / CAP_NET_RAW).
+
+        Frames come from a memory-mapped TPACKET_V3 ring, filtered in the
+        kernel to the registry ports unless ``all_ports``. Nothing is bound,
+        so the game server can keep port 80.
+        """
+        ports = None if all_ports else [port for port, protocol, name in self.registry.ports()]
+        self.ring_capture = PacketRingCapture(interface, ports).open()
+        
+        def on_frame(frame, timestamp):
+            parsed = parse_frame(frame)
+            if parsed is None or not parsed[3]:
+                return  # not TCP/UDP, or no payload (handshakes, bare ACKs)
+            source, destination, protocol, payload = parsed
+            self.process_analysis(self.analyze_packet_data(bytes(payload), source, destination))
+        
+        threading.Thread(target=self.ring_capture.run, args=(on_frame,), daemon=True).start()
+        where = interface or 'all interfaces'
+        return [f"passive {where} ({'all ports' if all_ports else 'ports ' + ', '.join(map(str, ports))})"]
+    
+    def setup_proxy_capture(self, routes):
+        """Sit in the path: forward each ``(listen, upstream)`` route both ways and analyze what passes.
+
+        Unlike the port monitors the client gets real answers from the
+        upstream (e.g. the game server moved to another port), so PES keeps
+        working while the traffic is inspected.
+        """
+        def on_payload(data, source, destination):
+            self.process_analysis(self.analyze_packet_data(data, source, destination))
+        
+        methods = []
+        for listen, upstream in routes:
+            proxy = ForwardingProxy(listen, upstream, on_payload).start()
+            self.proxies.append(proxy)
+            methods.append(f"proxy {format_address(proxy.listen)} → {format_address(upstream)} "
+                           f"({'splice + tee' if proxy.zero_copy else 'copy'})")
+        return methods
+    
     def process_analysis(self, analysis):
         """Process and display packet analysis"""
         if analysis['interesting']:
@@ -177,6 +219,8 @@ class PESTrafficInterceptor:
             print(f"   Route: {analysis['source']} → {analysis['destination']}")
             print(f"   Size: {analysis['size']} bytes")
             print(f"   Protocol: {analysis['protocol_guess']}")
+            if analysis['pes_endpoint']:
+                print(f"   🎯 PES endpoint: {analysis['pes_endpoint']}")
             
             if analysis['patterns_found']:
                 print(f"   🔍 Patterns found:")
@@ -195,7 +239,7 @@ class PESTrafficInterceptor:
             # Brief log for non-interesting traffic
             print(f"📦 {analysis['timestamp']} | {analysis['source']} → {analysis['destination']} | {analysis['size']} bytes | {analysis['protocol_guess']}")
     
-    def start_advanced_capture(self):
+    def start_advanced_capture(self, passive=False, interface=None, all_ports=False, proxy_routes=None):
         """Start advanced traffic capture"""
         print("=" * 80)
         print("🔬 PES 2021 ADVANCED TRAFFIC INTERCEPTOR")
@@ -207,7 +251,12 @@ class PESTrafficInterceptor:
         self.running = True
         
         # Setup capture methods
-        methods = self.setup_traffic_capture()
+        if proxy_routes:
+            methods = self.setup_proxy_capture(proxy_routes)
+        elif passive:
+            methods = self.setup_passive_capture(interface, all_ports)
+        else:
+            methods = self.setup_traffic_capture()
         
         print("🚀 Traffic capture started!")
         print(f"📡 Monitoring: {', '.join(methods)}")
@@ -224,6 +273,14 @@ class PESTrafficInterceptor:
         except KeyboardInterrupt:
             print("\n⏹️ Stopping traffic capture...")
             self.running = False
+            if self.ring_capture is not None:
+                stats = self.ring_capture.stats()
+                print(f"📡 Ring: {self.ring_capture.frames} frames, kernel drops: {stats['drops']}")
+                self.ring_capture.stop()
+            for proxy in self.proxies:
+                proxy.stop()
+                print(f"🔀 Proxy :{proxy.listen[1]}: {proxy.connections} connections, "
+                      f"{proxy.dropped_samples} samples dropped")
             self.print_summary()
     
     def print_summary(self):
@@ -279,8 +336,21 @@ class PESTrafficInterceptor:
 
 def main():
     """Main entry point"""
+    parser = argparse.ArgumentParser(description="PES 2021 traffic interceptor")
+    parser.add_argument('--passive', action='store_true',
+                        help="capture on the wire with AF_PACKET (Linux, root) instead of binding the ports")
+    parser.add_argument('--interface', help="interface for --passive (default: all)")
+    parser.add_argument('--all-ports', action='store_true', help="no port filter in --passive mode")
+    parser.add_argument('--proxy', action='append', type=parse_route, metavar='[LISTEN_HOST:]LISTEN_PORT=HOST:PORT',
+                        help="forward a port to an upstream and inspect the traffic (repeatable), "
+                             "e.g. --proxy 80=127.0.0.1:8080 or --proxy 127.0.0.1:80=[::1]:8080")
+    args = parser.parse_args()
+    
+    if args.passive and not PacketRingCapture.supported():
+        print("❌ Passive capture needs Linux AF_PACKET sockets")
+        return
     interceptor = PESTrafficInterceptor()
-    interceptor.start_advanced_capture()
+    interceptor.start_advanced_capture(args.passive, args.interface, args.all_ports, args.proxy)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
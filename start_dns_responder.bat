@@ -0,0 +1,43 @@
+@echo off
+title PES 2021 DNS Responder - NO HOSTS FILE
+color 0B
+echo.
+echo ========================================
+echo   PES 2021 EMBEDDED DNS RESPONDER
+echo   Redirects PES domains without touching hosts
+echo ========================================
+echo.
+
+net session >nul 2>&1
+if %errorLevel% neq 0 (
+    echo ERROR: This script requires Administrator privileges!
+    echo Port 53 needs admin access.
+    echo Right-click and select "Run as Administrator"
+    echo.
+    pause
+    exit /b 1
+)
+
+echo Administrator privileges confirmed!
+echo.
+
+echo What this does:
+echo - Answers PES 2021 / PES 2019 domains with 127.0.0.1
+echo - Forwards all other names to your normal DNS server (cached)
+echo - Counts how often each name is queried
+echo - No hosts file changes, no ipconfig /flushdns
+echo.
+
+echo IMPORTANT: Set your network adapter DNS server to 127.0.0.1
+echo while this is running, and switch it back afterwards.
+echo.
+
+pause
+echo.
+
+cd /d "%~dp0"
+python pes_dns_responder.py --upstream 8.8.8.8
+
+echo.
+echo DNS responder stopped.
+pause
@@ -0,0 +1,37 @@
+"""In-flight limits of pes_admission.AdmissionController"""
+
+import unittest
+
+from pes_admission import AdmissionController
+
+INFO_PATH = '/XME994-E1/info/info_en.txt'
+
+
+class InFlightLimitTests(unittest.TestCase):
+    def fill(self, controller, path):
+        admitted = 0
+        while controller.admit('127.0.0.1', path) == (None, 0):
+            admitted += 1
+        return admitted
+
+    def test_small_caps_leave_regular_slots(self):
+        for max_in_flight in range(1, 10):
+            with self.subTest(max_in_flight=max_in_flight):
+                controller = AdmissionController(rate=0, max_in_flight=max_in_flight)
+                self.assertGreaterEqual(self.fill(controller, '/api/lobbies'), 1)
+
+    def test_reserve_is_kept_for_priority_paths(self):
+        controller = AdmissionController(rate=0, max_in_flight=64, priority_reserve=8)
+        self.assertEqual(self.fill(controller, '/api/lobbies'), 56)
+        self.assertEqual(self.fill(controller, INFO_PATH), 8)
+        self.assertEqual(controller.admit('127.0.0.1', '/api/lobbies'), (503, 1))
+
+    def test_release_frees_a_slot(self):
+        controller = AdmissionController(rate=0, max_in_flight=4)
+        self.fill(controller, '/api/lobbies')
+        controller.release()
+        self.assertEqual(controller.admit('127.0.0.1', '/api/lobbies'), (None, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+"""Request routing in enhanced_pes_server_v2_for_pes_game"""
+
+import unittest
+
+from enhanced_pes_server_v2_for_pes_game import ROUTES
+
+
+class RouteTableTests(unittest.TestCase):
+    def test_parameterised_route(self):
+        name, handler, params, allowed = ROUTES.resolve('POST', '/api/lobbies/42/join')
+        self.assertEqual((name, handler, params, allowed),
+                         ('lobby_join', 'handle_lobby_join', {'lobby_id': '42'}, None))
+
+    def test_preflight_on_parameterised_route(self):
+        _, handler, _, allowed = ROUTES.resolve('OPTIONS', '/api/lobbies/42/join')
+        self.assertEqual(handler, 'handle_preflight')
+        self.assertIsNone(allowed)
+
+    def test_preflight_on_static_route(self):
+        _, handler, _, allowed = ROUTES.resolve('OPTIONS', '/api/auth/login')
+        self.assertEqual(handler, 'handle_preflight')
+        self.assertIsNone(allowed)
+
+    def test_wrong_method_is_405(self):
+        _, handler, _, allowed = ROUTES.resolve('GET', '/api/lobbies/42/join')
+        self.assertIsNone(handler)
+        self.assertEqual(allowed, ['POST'])
+
+
+if __name__ == '__main__':
+    unittest.main()